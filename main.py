@@ -1,16 +1,29 @@
 # -*- coding: utf-8 -*-
 import platform
-import shutil
 import subprocess
 import sys
-import time
+import threading
 
-import requests
 from PyQt5.QtCore import Qt, QThread, pyqtSignal
 from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QLabel, QPushButton, QProgressBar, QTextEdit, \
     QMessageBox
 
-from mod_validate import validate_mods_with_config, print_validate_report
+from mod_download import download_file, get_fastest_url, order_urls
+from mod_git_sync import SYNC_MODE_ENV_VAR, GitSparseSync
+from mod_mirror import MirrorPool
+from mod_scheduler import FOREGROUND, TransferScheduler
+from mod_peer import PEER_ENV_VAR, PeerNode
+from mod_pipeline import DEFAULT_MOD_INFO_URLS, SyncPipeline, build_file_urls, mirror_base_urls, select_entries_to_sync
+from mod_prefetch import PREFETCH_ENV_VAR, PrefetchDaemon, apply_plan, load_ready_plan
+from mod_profiles import MultiProfileUpdate, load_profiles, recover_profiles
+from mod_prewarm import PREWARM_ENV_VAR, Prewarmer, manifest_jar_paths
+from mod_stats import STATS_SPANS, append_run_record, build_run_record
+from mod_trace import TRACE_ENV_VAR, tracer, span
+from mod_transaction import UpdateTransaction, recover_journal
+from mod_tree import TreeSync, fetch_tree_manifest
+from mod_validate import VERSION_UPDATES, validate_mods, full_verify_due, load_verify_state, \
+    record_full_verify, start_full_verify
+from mod_watch import ModDirWatcher
 from util import *
 
 # 目录
@@ -19,7 +32,11 @@ config_dir = os.path.join(root_dir, "config")
 lib_dir = os.path.join(root_dir, "lib")
 temp_dir = os.path.join(root_dir, "temp")  # 临时文件目录
 git_dir = os.path.join(lib_dir, "git")
+git_sync_dir = os.path.join(temp_dir, "git_sync")  # Git稀疏同步的工作目录
+staging_dir = os.path.join(temp_dir, "staging")  # 同步时下载文件的临时目录
+apply_dir = os.path.join(staging_dir, "apply")  # 已校验、等待改名到位的文件
 local_mod_dir = os.path.join(root_dir, ".minecraft","versions","CMagic_client","mods")
+instance_dir = os.path.dirname(local_mod_dir)  # 整合包实例目录（config、kubejs、资源包等）
 
 dir_dict = {
     "config_dir":config_dir,
@@ -35,14 +52,15 @@ git_zip_name = "git.7z.exe"  # 下载后的压缩包名
 # 路径
 mod_info_path = os.path.join(config_dir, "mod_info.json")
 latest_mod_info_path = os.path.join(temp_dir, latest_mod_info_name)
+tree_info_path = os.path.join(config_dir, "tree_info.json")  # 上次同步的目录树配置
+latest_tree_info_path = os.path.join(temp_dir, "latest_tree_info.json")
 git_exe_path = os.path.join(git_dir, "bin","git.exe")  # Git可执行文件路径
 
 # 地址
 remote_repo = "https://github.com/baimianxiao/Test_client.git"  # 远程Git仓库（HTTPS）
 
-mod_info_urls=[
-    "https://gh-proxy.org/https://github.com/baimianxiao/Test_client/blob/master/config/mod_info.json",
-]
+# 局域网内有镜像（python mod_serve.py serve）时，可把 "http://<镜像IP>:8000/config/mod_info.json" 加在首位
+mod_info_urls = list(DEFAULT_MOD_INFO_URLS)
 
 git_download_urls = [
     "https://registry.npmmirror.com/-/binary/git-for-windows/v2.52.0.windows.1/PortableGit-2.52.0-64-bit.7z.exe",
@@ -62,98 +80,206 @@ class GitDeployThread(QThread):
     log_signal = pyqtSignal(str)  # 日志提示信号
     finish_signal = pyqtSignal(bool)  # 部署完成信号（成功/失败）
 
+    def __init__(self, mod_watcher=None, mirror_pool=None, scheduler=None, peer_node=None):
+        super().__init__()
+        self.mod_watcher = mod_watcher  # 本地Mod目录监视器（可选，用于复用已缓存的哈希）
+        # 线路状态表（首字节时间样本和熔断器，跨多次更新保留）
+        self.mirror_pool = mirror_pool or MirrorPool(mirror_base_urls(mod_info_urls))
+        # 传输调度器（与后台任务共享，用户点击的更新以前台优先级运行）
+        self.scheduler = scheduler or TransferScheduler()
+        # 局域网共享节点（可选，同步时优先从局域网内其他客户端获取内容）
+        self.peer_node = peer_node
+        self.run_info = {}  # 本次运行的附加统计信息（所选线路、整合包版本）
+
     def run(self):
+        # 每次运行都在内存中记录阶段耗时（只记录统计所需的区间和计数器），结束后追加一条统计记录到config目录
+        # 设置了CMAGIC_TRACE环境变量（值为输出路径）时记录全部区间并导出追踪文件
+        trace_path = os.environ.get(TRACE_ENV_VAR)
+        tracer.start(None if trace_path else STATS_SPANS)
+        try:
+            with span("update"):
+                self._run()
+        finally:
+            tracer.stop()
+            append_run_record(build_run_record(tracer, **self.run_info))
+            if trace_path:
+                tracer.export(trace_path)
+
+    def _run(self):
         try:
             # 1. 创建需要的目录
             self.log_signal.emit(f"🔍 检测工作目录")
-            for dir_name in dir_dict:
-                dir_path=dir_dict[dir_name]
-                if not os.path.exists(dir_path):
-                    self.log_signal.emit(f"🔧 创建{dir_name}目录")
-                    os.makedirs(dir_path)
-                    self.log_signal.emit(f"✅ 创建{dir_name}目录")
-                else:
-                    self.log_signal.emit(f"✅ {dir_name}已存在")
+            with span("prepare_dirs"):
+                for dir_name in dir_dict:
+                    dir_path=dir_dict[dir_name]
+                    if not os.path.exists(dir_path):
+                        self.log_signal.emit(f"🔧 创建{dir_name}目录")
+                        os.makedirs(dir_path)
+                        self.log_signal.emit(f"✅ 创建{dir_name}目录")
+                    else:
+                        self.log_signal.emit(f"✅ {dir_name}已存在")
+
+            # 1.1 配置了多个版本（config/profiles.json）时合并更新所有版本
+            profiles = load_profiles()
+            if profiles:
+                self.log_signal.emit(f"🔍 检测 {len(profiles)} 个版本")
+                outcome = MultiProfileUpdate(profiles, log=self.log_signal.emit, mirror_pool=self.mirror_pool,
+                                             scheduler=self.scheduler, peers=self.peer_node).run()
+                failed = [name for name, ok in outcome.items() if not ok]
+                if failed:
+                    raise Exception(f"{len(failed)} 个版本同步失败：{failed}")
+                self.log_signal.emit(f"✅ 所有版本同步完成")
+                self.finish_signal.emit(True)
+                return
 
             # 2.获取远程mod列表
             self.log_signal.emit(f"🔍 检测更新文件线路")
-            mod_fastest_url = self.get_fastest_url(mod_info_urls)
-            if not mod_fastest_url:
-                self.log_signal.emit(f"❌ 所有线路测速失败，尝试全部线路下载...")
-                download_urls = mod_info_urls
-            else:
-                self.log_signal.emit(f"✅ 选择最快线路：{mod_fastest_url}")
-                download_urls = [mod_fastest_url] + [u for u in mod_info_urls if u != mod_fastest_url]
-
-            download_success = False
-            for idx, url in enumerate(download_urls):
-                try:
-                    self.log_signal.emit(f"📥 开始从线路 {idx + 1}/{len(download_urls)} 下载：{url}")
-
-                    response = requests.get(url, stream=True, timeout=30, proxies={"http": None, "https": None})
-                    response.raise_for_status()  # 触发HTTP错误（如404/500）
-
-                    git_zip_path = os.path.join(temp_dir, latest_mod_info_name)
-                    with open(git_zip_path, "wb") as f:
-                        for chunk in response.iter_content(chunk_size=1024 * 1024):
-                            if chunk:
-                                f.write(chunk)
-
-                    self.log_signal.emit(f"✅ mod列表获取完成！")
-                    download_success = True
-                    break  # 下载成功，退出线路循环
-
-                except Exception as e:
-                    self.log_signal.emit(f"❌ 线路 {url} 下载失败：{str(e)}")
-                    # 清理不完整文件
-                    if os.path.exists(git_zip_path):
-                        os.remove(git_zip_path)
-                    # 最后一条线路仍失败
-                    if idx == len(download_urls) - 1:
-                        self.log_signal.emit(f"❌ 所有线路下载失败！")
-
-            if not download_success:
-                raise Exception("获取远程mod列表失败")
+            with span("fetch_manifest"):
+                mod_fastest_url = get_fastest_url(mod_info_urls, log=self.log_signal.emit)
+                if not mod_fastest_url:
+                    self.log_signal.emit(f"❌ 所有线路测速失败，尝试全部线路下载...")
+                else:
+                    self.log_signal.emit(f"✅ 选择最快线路：{mod_fastest_url}")
+                self.run_info["mirror"] = mod_fastest_url
+
+                download_urls = order_urls(mod_info_urls, mod_fastest_url)
+                # 占用前台名额：进行中的后台预下载随即暂停
+                with self.scheduler.slot(FOREGROUND):
+                    ok = download_file(download_urls, latest_mod_info_path, log=self.log_signal.emit,
+                                       mirror_pool=self.mirror_pool, scheduler=self.scheduler, priority=FOREGROUND)
+                if not ok:
+                    raise Exception("获取远程mod列表失败")
+                self.log_signal.emit(f"✅ mod列表获取完成！")
 
             # 3.比对本地mod列表
             self.log_signal.emit(f"🔍 检测是否需要更新")
+            manifest_path = latest_mod_info_path  # 本次校验/同步使用的mod列表（所有文件到位后才替换本地mod列表）
+            # 后台完整校验发现问题时，即使版本相同也需要完整校验并修复
+            force_full = load_verify_state().get('force_full', False)
             if os.path.exists(mod_info_path):
                 self.log_signal.emit(f"✅ 本地mod列表已存在")
                 mod_info= get_json_from_file(mod_info_path)
                 latest_mod_info = get_json_from_file(latest_mod_info_path)
-                if mod_info["split_time"]==latest_mod_info["split_time"]:
+                self.run_info["pack_version"] = latest_mod_info["split_time"]
+                # mod列表相同但目录树未同步（如离线导入只更新了mod）时仍需继续同步目录树
+                latest_tree = latest_mod_info.get("tree")
+                local_tree = get_json_from_file(tree_info_path) if os.path.exists(tree_info_path) else None
+                tree_current = not latest_tree or (local_tree or {}).get("root_hash") == latest_tree["root_hash"]
+                if mod_info["split_time"]==latest_mod_info["split_time"] and tree_current and not force_full:
                     self.log_signal.emit(f"✅ 本地mod列表已是最新")
                     self.finish_signal.emit(True)
                     os.remove(latest_mod_info_path)
                     return
+                elif not tree_current and mod_info["split_time"]==latest_mod_info["split_time"]:
+                    self.log_signal.emit(f"ℹ️ 目录树配置需要更新")
                 else:
                     self.log_signal.emit(f"ℹ️ 存在需要更新的mod")
             else:
-                self.log_signal.emit(f"🔧 创建mod列表")
-                shutil.move(latest_mod_info_path, mod_info_path)
-                self.log_signal.emit(f"✅ 创建mod列表成功")
+                self.log_signal.emit(f"🔧 本地mod列表不存在，同步完成后创建")
+
+            # 3.1 后台预下载已就绪时直接移入暂存文件（随后的检测只需确认结果）
+            plan = load_ready_plan(get_json_from_file(manifest_path)["split_time"])
+            if plan:
+                with span("apply_prefetch"):
+                    placed = apply_plan(plan, local_mod_dir, log=self.log_signal.emit)
+                self.log_signal.emit(f"⚡ 已应用后台预下载的 {len(placed)} 个mod文件")
 
             # 4.使用mod列表检测本地mod
             self.log_signal.emit(f"🔍 检测本地mod文件")
-            inconsistent_mods, extra_local_files= validate_mods_with_config(mod_info_path, local_mod_dir)
-            print_validate_report(inconsistent_mods, extra_local_files)
-
-            # 4.
-            if len(inconsistent_mods['missing_files'])==0:
-                self.log_signal.emit(f"✅ 所有必须的mod文件存在")
-            else:
-                self.log_signal.emit(f"ℹ️ 缺少必须的mod文件")
-                all_mod_files=get_json_from_file(mod_info_path)["all_mod_files"]
-                for missing_mods in inconsistent_mods['missing_files']:
-                    self.log_signal.emit(f"🔄 同步缺少的 {missing_mods}")
-                    single_mod_info=all_mod_files[missing_mods]
-
-
-
-
-
-
-
+            # 日常只做快速校验（大小+快速指纹，有疑问的文件才计算完整哈希），完整校验在后台定期进行
+            # 首次安装时Mod目录还不存在，先创建（视为空目录，所有mod都需要同步）
+            os.makedirs(local_mod_dir, exist_ok=True)
+            result = validate_mods(manifest_path, local_mod_dir, self.mod_watcher, quick=not force_full)
+            if not result.valid:
+                raise Exception("mod列表或本地mod目录无法读取")
+            # 报告只在有问题时渲染
+            if result.problem_count or result.extra_files or result.duplicates:
+                print(result.render_text())
+
+            # 5.同步需要更新的mod（下载、校验、放置流水线并发执行）
+            for issue in result.of_kind(VERSION_UPDATES):
+                self.log_signal.emit(f"🔄 升级 {issue.entry.get('mod_id')}：{issue.old_files[0].get('mod_version')} → "
+                                     f"{issue.entry.get('mod_version')}")
+
+            with span("sync"):
+                mods_to_sync = select_entries_to_sync(get_json_from_file(manifest_path), result)
+                transaction = UpdateTransaction()
+                failed = []
+                if len(mods_to_sync)==0:
+                    self.log_signal.emit(f"✅ 所有必须的mod文件存在")
+                else:
+                    self.log_signal.emit(f"ℹ️ 需要同步 {len(mods_to_sync)} 个mod文件")
+                    # 下载的文件先全部放在暂存目录，由事务统一改名到位
+                    if os.environ.get(SYNC_MODE_ENV_VAR) == "git" and os.path.exists(git_exe_path):
+                        # Git稀疏同步：只获取本次需要的Mod内容
+                        git_sync = GitSparseSync(remote_repo, git_sync_dir, git_exe=git_exe_path,
+                                                 log=self.log_signal.emit)
+                        repo_manifest = get_json_from_file(git_sync.update())
+                        # 仓库HEAD与HTTP获取的mod列表须为同一版本，否则取出的文件与本次校验的哈希对不上
+                        if repo_manifest["split_time"] != get_json_from_file(manifest_path)["split_time"]:
+                            raise Exception(f"Git仓库中的mod列表版本（{repo_manifest['split_time']}）"
+                                            f"与远程mod列表版本不一致，请稍后重试")
+                        succeeded, failed = git_sync.fetch_entries(mods_to_sync, apply_dir)
+                    else:
+                        base_urls = mirror_base_urls(order_urls(mod_info_urls, mod_fastest_url))
+                        if self.peer_node and self.peer_node.discover():
+                            self.log_signal.emit(f"🔗 局域网内发现 {self.peer_node.peer_count()} 个客户端，优先从局域网获取")
+                        pipeline = SyncPipeline(base_urls, apply_dir, staging_dir, log=self.log_signal.emit,
+                                                mirror_pool=self.mirror_pool, scheduler=self.scheduler,
+                                                priority=FOREGROUND, peers=self.peer_node)
+                        succeeded, failed = pipeline.run(mods_to_sync)
+                    for entry in mods_to_sync:
+                        if entry['file_name'] in succeeded:
+                            transaction.add_file(os.path.join(apply_dir, entry['file_name']),
+                                                 os.path.join(local_mod_dir, entry['file_name']),
+                                                 entry['file_size_bytes'])
+
+                    # 删除被新版本取代的旧文件
+                    for issue in result.of_kind(VERSION_UPDATES):
+                        if issue.file_name in succeeded:
+                            for old_file in issue.old_files:
+                                transaction.remove_file(old_file['file_path'])
+
+            # 5.1 同步整合包其他目录（摘要相同的目录整体跳过，只下载变化的文件）
+            tree_info = get_json_from_file(manifest_path).get("tree")
+            if tree_info:
+                with span("sync_tree"):
+                    base_urls = mirror_base_urls(order_urls(mod_info_urls, mod_fastest_url))
+                    tree_urls = build_file_urls(base_urls, tree_info["manifest_path"])
+                    # 目录树配置须与mod列表记录的根摘要一致（防止线路缓存的旧配置被当作最新版本应用）
+                    with self.scheduler.slot(FOREGROUND):
+                        tree_manifest = fetch_tree_manifest(tree_urls, latest_tree_info_path, tree_info["root_hash"],
+                                                            log=self.log_signal.emit, mirror_pool=self.mirror_pool,
+                                                            scheduler=self.scheduler, priority=FOREGROUND)
+                    if tree_manifest is None:
+                        raise Exception("获取目录树配置失败")
+                    previous_tree = get_json_from_file(tree_info_path) if os.path.exists(tree_info_path) else None
+                    tree_sync = TreeSync(base_urls, instance_dir, os.path.join(apply_dir, "tree"),
+                                         log=self.log_signal.emit, mirror_pool=self.mirror_pool,
+                                         scheduler=self.scheduler)
+                    changed, removed = tree_sync.plan(tree_manifest, previous_tree)
+                    if changed or removed:
+                        self.log_signal.emit(f"ℹ️ 整合包文件需要同步 {len(changed)} 个，删除 {len(removed)} 个")
+                    tree_succeeded, tree_failed = tree_sync.download(tree_manifest, changed)
+                    tree_sync.add_to_transaction(transaction, tree_succeeded, removed)
+                    failed.extend(tree_failed)
+                    if not tree_failed:
+                        transaction.add_file(latest_tree_info_path, tree_info_path)
+
+            # 6.应用：文件改名到位，全部成功时最后替换本地mod列表
+            with span("apply"):
+                if not failed:
+                    transaction.set_manifest(latest_mod_info_path, mod_info_path)
+                transaction.commit(log=self.log_signal.emit)
+            if failed:
+                raise Exception(f"{len(failed)} 个mod同步失败：{failed}")
+            if force_full:
+                record_full_verify(0)
+            if self.peer_node:
+                self.peer_node.share_manifest(mod_info_path, local_mod_dir)
+
+            self.log_signal.emit(f"✅ mod同步完成")
+            self.finish_signal.emit(True)
             return
             # 2. 检测Git是否已存在
             if os.path.exists(git_exe_path):
@@ -165,71 +291,38 @@ class GitDeployThread(QThread):
 
             # 3. 下载Git便携版
             # 3.1 先测速选最快线路
-            fastest_url = self.get_fastest_url(git_download_urls)
-            if not fastest_url:
-                self.log_signal.emit(f"❌ 所有线路测速失败，尝试全部线路下载...")
-                download_urls = git_download_urls
-            else:
-                self.log_signal.emit(f"✅ 选择最快线路：{fastest_url}")
-                download_urls = [fastest_url] + [u for u in git_download_urls if u != fastest_url]
-
-            # 3.2 遍历线路下载（失败自动切换）
-            download_success = False
-            for idx, url in enumerate(download_urls):
-                try:
-                    self.log_signal.emit(f"📥 开始从线路 {idx + 1}/{len(download_urls)} 下载：{url}")
-                    response = requests.get(url, stream=True, timeout=30,proxies={"http": None, "https": None})
-                    response.raise_for_status()  # 触发HTTP错误（如404/500）
-
-                    total_size = int(response.headers.get("content-length", 0))
-                    downloaded_size = 0
-                    git_zip_path = os.path.join(temp_dir, git_zip_name)
-                    with open(git_zip_path, "wb") as f:
-                        for chunk in response.iter_content(chunk_size=1024 * 1024):
-                            if chunk:
-                                f.write(chunk)
-                                downloaded_size += len(chunk)
-                                if total_size > 0:
-                                    progress = int((downloaded_size / total_size) * 100)
-                                    self.progress_signal.emit(progress)
-                                    self.log_signal.emit(f"📥 下载进度：{progress}%")
-
-                    # 验证文件完整性（可选但建议保留）
-                    if total_size > 0 and downloaded_size != total_size:
-                        raise Exception(f"文件大小不匹配：下载{downloaded_size}字节，预期{total_size}字节")
-
-                    self.log_signal.emit(f"✅ Git便携版下载完成！")
-                    download_success = True
-                    break  # 下载成功，退出线路循环
-
-                except Exception as e:
-                    self.log_signal.emit(f"❌ 线路 {url} 下载失败：{str(e)}")
-                    # 清理不完整文件
-                    if os.path.exists(git_zip_path):
-                        os.remove(git_zip_path)
-                    # 最后一条线路仍失败
-                    if idx == len(download_urls) - 1:
-                        self.log_signal.emit(f"❌ 所有线路下载失败！")
-
-            if not download_success:
-                raise Exception("Git便携版下载失败，所有线路均不可用")
+            with span("git_download"):
+                fastest_url = get_fastest_url(git_download_urls, log=self.log_signal.emit)
+                if not fastest_url:
+                    self.log_signal.emit(f"❌ 所有线路测速失败，尝试全部线路下载...")
+                else:
+                    self.log_signal.emit(f"✅ 选择最快线路：{fastest_url}")
+
+                # 3.2 遍历线路下载（失败自动切换）
+                download_urls = order_urls(git_download_urls, fastest_url)
+                git_zip_path = os.path.join(temp_dir, git_zip_name)
+                if not download_file(download_urls, git_zip_path, log=self.log_signal.emit,
+                                     progress=self.on_download_progress, mirror_pool=self.mirror_pool):
+                    raise Exception("Git便携版下载失败，所有线路均不可用")
+                self.log_signal.emit(f"✅ Git便携版下载完成！")
 
             # 4. 解压Git压缩包（tar.bz2格式，需先解压外层tar，再取内部Git目录）
 
-            self.log_signal.emit(f"🔧 开始解压{git_zip_name}")
-            result = subprocess.run(
-                [
-                    f"./temp/{git_zip_name}",
-                    f"-o./lib/git",  # 解压路径（无空格）
-                    "-y",  # 覆盖无需确认
-                    "-silent"  # 完全静默（无窗口）
-                ],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                encoding="utf-8",
-                shell=False,
-                creationflags=subprocess.CREATE_NO_WINDOW  # 隐藏子进程窗口
-            )
+            with span("git_extract"):
+                self.log_signal.emit(f"🔧 开始解压{git_zip_name}")
+                result = subprocess.run(
+                    [
+                        f"./temp/{git_zip_name}",
+                        f"-o./lib/git",  # 解压路径（无空格）
+                        "-y",  # 覆盖无需确认
+                        "-silent"  # 完全静默（无窗口）
+                    ],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    encoding="utf-8",
+                    shell=False,
+                    creationflags=subprocess.CREATE_NO_WINDOW  # 隐藏子进程窗口
+                )
             self.progress_signal.emit(90)  # 解压阶段固定进度90%
             if result.returncode == 0:
                 self.log_signal.emit(f"✅ 解压Git压缩包成功")
@@ -245,26 +338,10 @@ class GitDeployThread(QThread):
             self.log_signal.emit(f"❌ Git部署失败：{str(e)}")
             self.finish_signal.emit(False)
 
-    # 测速函数：返回最快地下载地址
-    def get_fastest_url(self, url_list, timeout=5):
-        fastest_url = None
-        min_response_time = float("inf")
-        for url in url_list:
-            try:
-                self.log_signal.emit(f"🔍 测试线路：{url}")
-                start_time = time.time()
-                # 仅发送HEAD请求测速（不下载内容）
-                response = requests.head(url, timeout=timeout, allow_redirects=True)
-                if response.status_code == 200:
-                    response_time = time.time() - start_time
-                    self.log_signal.emit(f"📶 线路 {url} 响应时间：{response_time:.2f}秒")
-                    if response_time < min_response_time:
-                        min_response_time = response_time
-                        fastest_url = url
-            except Exception as e:
-                self.log_signal.emit(f"❌ 线路 {url} 测速失败：{str(e)}")
-                continue
-        return fastest_url
+    def on_download_progress(self, progress):
+        """下载进度回调：更新进度条并输出日志"""
+        self.progress_signal.emit(progress)
+        self.log_signal.emit(f"📥 下载进度：{progress}%")
 
 
 class MCUpdaterGUI(QWidget):
@@ -274,6 +351,35 @@ class MCUpdaterGUI(QWidget):
         super().__init__()
         self.init_ui()
         self.git_deployed = False  # Git是否部署完成标记
+        # 上次更新在应用途中被中断时，按日志继续完成（无需重新校验整个Mod目录）
+        if not recover_journal(log=self.log_print) or not recover_profiles(load_profiles(), log=self.log_print):
+            self.log_print("⚠️ 上次中断的更新未能完整恢复，请点击更新重新检测")
+        # 启动时即在后台扫描Mod目录，点击更新时可直接使用缓存状态
+        self.mod_watcher = ModDirWatcher(local_mod_dir)
+        self.mod_watcher.start()
+        # 完整校验到期时在后台进行（复用监视器的哈希缓存），发现问题时下次更新自动完整校验
+        if os.path.exists(mod_info_path) and full_verify_due():
+            start_full_verify(mod_info_path, local_mod_dir, self.mod_watcher)
+        self.mirror_pool = MirrorPool(mirror_base_urls(mod_info_urls))
+        self.scheduler = TransferScheduler()
+        # 可选的后台预下载（设置CMAGIC_PREFETCH=1开启），以后台优先级运行，点击更新时会被抢占
+        self.prefetch_daemon = None
+        if os.environ.get(PREFETCH_ENV_VAR) == "1":
+            self.prefetch_daemon = PrefetchDaemon(mod_info_urls, local_mod_dir, mod_info_path,
+                                                  scheduler=self.scheduler, mirror_pool=self.mirror_pool,
+                                                  watcher=self.mod_watcher)
+            self.prefetch_daemon.start()
+        self.prewarmer = None
+        # 可选的局域网共享（设置CMAGIC_PEER=1开启）：与同一局域网内的客户端互相提供已校验的Mod内容
+        self.peer_node = None
+        if os.environ.get(PEER_ENV_VAR) == "1":
+            try:
+                self.peer_node = PeerNode(log=self.log_print).start()
+                if os.path.exists(mod_info_path):
+                    threading.Thread(target=self.peer_node.share_manifest, args=(mod_info_path, local_mod_dir),
+                                     daemon=True).start()
+            except OSError as e:
+                self.log_print(f"⚠️ 局域网共享启动失败：{str(e)}")
 
     def init_ui(self):
         # 窗口配置
@@ -330,7 +436,7 @@ class MCUpdaterGUI(QWidget):
         self.log_print("===== 开始更新流程 =====")
 
         # 1. 启动Git部署线程
-        self.git_thread = GitDeployThread()
+        self.git_thread = GitDeployThread(self.mod_watcher, self.mirror_pool, self.scheduler, self.peer_node)
         self.git_thread.progress_signal.connect(self.update_progress)
         self.git_thread.log_signal.connect(self.log_print)
         self.git_thread.finish_signal.connect(self.on_git_deploy_finish)
@@ -351,6 +457,22 @@ class MCUpdaterGUI(QWidget):
         self.git_deployed = True
         self.progress_bar.setVisible(False)  # 隐藏进度条
         self.log_print("===== Git部署完成，开始检测更新 =====")
+        # 可选的页缓存预热（设置CMAGIC_PREWARM=1开启）：按mod列表顺序把Mod读入系统缓存，加快游戏首次启动
+        if os.environ.get(PREWARM_ENV_VAR) == "1" and os.path.exists(mod_info_path):
+            if self.prewarmer:
+                self.prewarmer.cancel()
+            self.prewarmer = Prewarmer(manifest_jar_paths(mod_info_path, local_mod_dir)).start()
+
+    def closeEvent(self, event):
+        """关闭窗口时停止目录监视、后台预下载、预热和局域网共享"""
+        self.mod_watcher.stop()
+        if self.prefetch_daemon:
+            self.prefetch_daemon.stop()
+        if self.prewarmer:
+            self.prewarmer.cancel()
+        if self.peer_node:
+            self.peer_node.stop()
+        super().closeEvent(event)
 
     def on_update_finish(self, success):
         """更新完成后的回调"""
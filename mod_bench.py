@@ -0,0 +1,264 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+
+import mod_split
+import mod_unsplit
+from mod_prewarm import measure_cold_start
+from mod_validate import get_local_mod_file_map, validate_mods, validate_mods_with_config
+from mod_version import get_mcmod_version
+
+# 单位转换常量
+KB_TO_BYTES = 1024
+MB_TO_BYTES = 1024 * 1024
+
+# 合成Mod的neoforge.mods.toml模板
+MODS_TOML_TEMPLATE = '''modLoader="javafml"
+loaderVersion="[1,)"
+license="MIT"
+
+[[mods]]
+modId="{mod_id}"
+version="{version}"
+displayName="{display_name}"
+'''
+
+
+# ===================== 合成整合包生成 =====================
+def _write_payload(stream, size, seed):
+    """
+    向流中写入指定大小的伪随机数据（不可压缩，避免zip压缩改变文件大小）
+    :param stream: 可写的文件对象
+    :param size: 字节数
+    :param seed: 数据种子（不同文件内容不同，哈希不会重复）
+    """
+    block = os.urandom(MB_TO_BYTES)
+    prefix = seed.to_bytes(8, "little")
+    written = 0
+    while written < size:
+        n = min(MB_TO_BYTES, size - written)
+        # 每个块开头写入种子和块序号，保证各块/各文件内容不同
+        stream.write((prefix + written.to_bytes(8, "little") + block[16:])[:n])
+        written += n
+
+
+def make_synthetic_jar(file_path, mod_id, version, payload_size, seed=0):
+    """
+    生成一个带合法META-INF/neoforge.mods.toml的合成Mod
+    :param file_path: 输出路径（.jar）
+    :param mod_id: modId
+    :param version: 版本号
+    :param payload_size: 填充数据大小（字节，以STORED方式写入，文件大小约等于该值）
+    :param seed: 数据种子
+    """
+    with zipfile.ZipFile(file_path, "w", compression=zipfile.ZIP_STORED) as jar:
+        jar.writestr("META-INF/neoforge.mods.toml",
+                     MODS_TOML_TEMPLATE.format(mod_id=mod_id, version=version, display_name=mod_id))
+        with jar.open("assets/payload.bin", "w", force_zip64=payload_size > 0x7fffffff) as payload:
+            _write_payload(payload, payload_size, seed)
+
+
+def generate_mod_pack(mod_dir, small_count=500, small_size_kb=64, large_count=1, large_size_mb=None):
+    """
+    生成合成Mod目录
+    :param mod_dir: 输出目录
+    :param small_count: 小Mod数量
+    :param small_size_kb: 小Mod大小（KB）
+    :param large_count: 大Mod数量（超过SPLIT_THRESHOLD，会被分割）
+    :param large_size_mb: 大Mod大小（MB，默认为分割阈值+一个分包）
+    :return: 生成的总字节数
+    """
+    if large_size_mb is None:
+        large_size_mb = (mod_split.SPLIT_THRESHOLD + mod_split.CHUNK_SIZE) // MB_TO_BYTES
+    os.makedirs(mod_dir, exist_ok=True)
+    for idx in range(small_count):
+        make_synthetic_jar(os.path.join(mod_dir, f"bench_small_{idx:05d}-1.0.{idx}.jar"),
+                           f"bench_small_{idx}", f"1.0.{idx}", small_size_kb * KB_TO_BYTES, seed=idx)
+    for idx in range(large_count):
+        make_synthetic_jar(os.path.join(mod_dir, f"bench_large_{idx:02d}-2.0.{idx}.jar"),
+                           f"bench_large_{idx}", f"2.0.{idx}", large_size_mb * MB_TO_BYTES, seed=1_000_000 + idx)
+    return sum(os.path.getsize(os.path.join(mod_dir, f)) for f in os.listdir(mod_dir))
+
+
+# ===================== 缓存控制 =====================
+def drop_file_cache(paths):
+    """
+    尽力将文件移出操作系统页缓存（仅支持posix_fadvise的平台）
+    :param paths: 文件或目录路径列表
+    :return: 支持冷缓存返回True，否则False
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    os.sync()  # 脏页无法丢弃，先落盘
+    for path in paths:
+        targets = [path]
+        if os.path.isdir(path):
+            targets = [os.path.join(root, f) for root, _, files in os.walk(path) for f in files]
+        for target in targets:
+            try:
+                fd = os.open(target, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+    return True
+
+
+def warm_file_cache(paths):
+    """将文件完整读入页缓存（热缓存条件）"""
+    for path in paths:
+        targets = [path]
+        if os.path.isdir(path):
+            targets = [os.path.join(root, f) for root, _, files in os.walk(path) for f in files]
+        for target in targets:
+            with open(target, "rb") as f:
+                while f.read(MB_TO_BYTES):
+                    pass
+
+
+# ===================== 计时 =====================
+def _time_call(func, cache_paths, cold, setup=None):
+    """
+    计时单次调用（被测函数的控制台输出重定向到空设备）
+    :return: 耗时（秒），冷缓存不支持时返回None
+    """
+    if setup:
+        setup()
+    if cold:
+        if not drop_file_cache(cache_paths):
+            return None
+    else:
+        warm_file_cache(cache_paths)
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+
+
+def run_case(name, func, cache_paths, data_bytes, repeat, setup=None):
+    """
+    在冷/热缓存条件下分别多次执行一个用例
+    :param name: 用例名称
+    :param func: 被测函数（无参数）
+    :param cache_paths: 用例读取的文件/目录（用于控制缓存状态）
+    :param data_bytes: 用例处理的数据量（用于计算吞吐量）
+    :param repeat: 每种条件的重复次数
+    :param setup: 每次执行前的准备函数（不计时）
+    :return: 结果字典
+    """
+    result = {"bytes": data_bytes}
+    for condition in ("cold", "warm"):
+        times = []
+        for _ in range(repeat):
+            elapsed = _time_call(func, cache_paths, condition == "cold", setup)
+            if elapsed is None:
+                break
+            times.append(round(elapsed, 6))
+        result[condition] = {
+            "seconds": times,
+            "best": min(times) if times else None,
+            "mb_per_s": round(data_bytes / MB_TO_BYTES / min(times), 2) if times and min(times) > 0 else None,
+        }
+    print(f"[信息] {name:<28} 冷缓存最佳：{result['cold']['best']}s  热缓存最佳：{result['warm']['best']}s")
+    return result
+
+
+def run_benchmarks(work_dir, small_count, small_size_kb, large_count, large_size_mb, repeat):
+    """
+    生成合成整合包并对拆分/还原/校验/扫描/版本读取各路径计时
+    :param work_dir: 工作目录（生成的文件均在其中）
+    :return: 结果字典（可直接序列化为JSON）
+    """
+    mod_dir = os.path.join(work_dir, "mods")
+    config_dir = os.path.join(work_dir, "config")
+    restore_dir = os.path.join(work_dir, "restored")
+    split_dir = os.path.join(work_dir, "split_parts")
+
+    if large_size_mb is None:
+        large_size_mb = (mod_split.SPLIT_THRESHOLD + mod_split.CHUNK_SIZE) // MB_TO_BYTES
+    print(f"[信息] 生成合成整合包：{small_count} 个 {small_size_kb}KB 小Mod，{large_count} 个 {large_size_mb}MB 大Mod")
+    total_bytes = generate_mod_pack(mod_dir, small_count, small_size_kb, large_count, large_size_mb)
+    jar_paths = sorted(os.path.join(mod_dir, f) for f in os.listdir(mod_dir) if f.endswith(".jar"))
+    large_paths = [p for p in jar_paths if os.path.getsize(p) > mod_split.SPLIT_THRESHOLD]
+    config_file = os.path.join(config_dir, "mod_info.json")
+
+    results = {}
+    results["get_local_mod_file_map"] = run_case(
+        "get_local_mod_file_map", lambda: get_local_mod_file_map(mod_dir), [mod_dir], total_bytes, repeat)
+    results["get_mcmod_version"] = run_case(
+        "get_mcmod_version", lambda: [get_mcmod_version(p) for p in jar_paths], [mod_dir], total_bytes, repeat)
+    if large_paths:
+        large_bytes = sum(os.path.getsize(p) for p in large_paths)
+        results["split_large_file"] = run_case(
+            "split_large_file", lambda: [mod_split.split_large_file(p, split_dir) for p in large_paths],
+            large_paths, large_bytes, repeat, setup=lambda: shutil.rmtree(split_dir, ignore_errors=True))
+    results["mod_split.main"] = run_case(
+        "mod_split.main", lambda: mod_split.main(mod_dir, config_output_dir=config_dir),
+        [mod_dir], total_bytes, repeat)
+    results["validate_mods_with_config"] = run_case(
+        "validate_mods_with_config", lambda: validate_mods_with_config(config_file, mod_dir),
+        [mod_dir], total_bytes, repeat)
+    # 结构化结果（不输出、不渲染报告），与上面的兼容接口对比
+    results["validate_mods"] = run_case(
+        "validate_mods", lambda: validate_mods(config_file, mod_dir),
+        [mod_dir], total_bytes, repeat)
+    # mod_unsplit.main还原分割文件并校验未分割文件，输出目录需每次清空
+    results["mod_unsplit.main"] = run_case(
+        "mod_unsplit.main", lambda: mod_unsplit.main(config_file, restore_dir),
+        [mod_dir], total_bytes, repeat, setup=lambda: shutil.rmtree(restore_dir, ignore_errors=True))
+    # 冷缓存下加载器读取全部Mod的耗时：无预热 vs 预热后（不支持丢弃缓存的平台为None）
+    results["prewarm_cold_start"] = measure_cold_start(jar_paths, repeat)
+    if results["prewarm_cold_start"]:
+        print(f"[信息] {'prewarm_cold_start':<28} 无预热：{results['prewarm_cold_start']['cold_s']}s  "
+              f"预热后：{results['prewarm_cold_start']['prewarmed_s']}s")
+
+    return {
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cold_cache_supported": hasattr(os, "posix_fadvise"),
+        },
+        "parameters": {
+            "small_count": small_count,
+            "small_size_kb": small_size_kb,
+            "large_count": large_count,
+            "large_size_mb": large_size_mb,
+            "repeat": repeat,
+            "total_bytes": total_bytes,
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mod拆分/还原/校验性能基准（使用合成整合包）")
+    parser.add_argument("--small-count", type=int, default=500, help="小Mod数量（默认500）")
+    parser.add_argument("--small-size-kb", type=int, default=64, help="小Mod大小KB（默认64）")
+    parser.add_argument("--large-count", type=int, default=1, help="超过分割阈值的大Mod数量（默认1）")
+    parser.add_argument("--large-size-mb", type=int, default=None, help="大Mod大小MB（默认分割阈值+一个分包）")
+    parser.add_argument("--repeat", type=int, default=3, help="每种缓存条件的重复次数（默认3）")
+    parser.add_argument("--work-dir", default=None, help="工作目录（默认系统临时目录，结束后删除）")
+    parser.add_argument("--output", default="bench_output.json", help="结果JSON路径（默认bench_output.json）")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="mod_bench_")
+    try:
+        bench_result = run_benchmarks(work_dir, args.small_count, args.small_size_kb, args.large_count,
+                                      args.large_size_mb, args.repeat)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(bench_result, f, ensure_ascii=False, indent=4)
+    print(f"[成功] 基准结果已写入：{args.output}")
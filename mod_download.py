@@ -0,0 +1,459 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+import requests
+
+from mod_scheduler import FOREGROUND
+from mod_trace import bind, count, span, traced
+from mod_transport import DecodingWriter
+
+# 下载超时（秒）
+DOWNLOAD_TIMEOUT = 30
+# 测速超时（秒）
+PROBE_TIMEOUT = 5
+# 单次读取块大小（同时也是限速的粒度）
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+# 不使用系统代理（国内镜像走代理反而更慢）
+NO_PROXIES = {"http": None, "https": None}
+# 对冲下载中检查传输速度（是否需要再平衡）的间隔（秒）
+REBALANCE_CHECK_INTERVAL = 0.5
+
+
+def _throttle(scheduler, size, priority):
+    """
+    经调度器限速（未指定调度器时不限速）
+    :return: 等待的秒数（限速或被前台抢占的时间，不计入线路的传输耗时）
+    """
+    if scheduler is None:
+        return 0.0
+    waited_from = time.perf_counter()
+    scheduler.consume(size, priority or FOREGROUND)
+    return time.perf_counter() - waited_from
+
+
+def _range_headers(byte_range):
+    """生成Range请求头（byte_range为闭区间(start, end)，None为完整文件）"""
+    if byte_range is None:
+        return None
+    return {"Range": f"bytes={byte_range[0]}-{byte_range[1]}"}
+
+
+def _iter_body(response, byte_range):
+    """
+    逐块读取响应正文；请求了区间但服务器忽略Range返回完整内容（200）时，只保留请求的区间
+    """
+    chunks = response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+    if byte_range is None or response.status_code == 206:
+        yield from chunks
+        return
+    start, end = byte_range
+    pos = 0
+    for chunk in chunks:
+        low, high = max(start - pos, 0), min(end + 1 - pos, len(chunk))
+        pos += len(chunk)
+        if low < high:
+            yield chunk[low:high]
+        if pos > end:
+            break
+
+
+@traced("get_fastest_url")
+def get_fastest_url(url_list, timeout=PROBE_TIMEOUT, log=print):
+    """
+    测速函数：对每条线路发送HEAD请求，返回响应最快的地址
+    :param url_list: 线路地址列表
+    :param timeout: 单条线路测速超时（秒）
+    :param log: 日志输出函数
+    :return: 最快的地址（全部失败返回None）
+    """
+    fastest_url = None
+    min_response_time = float("inf")
+    for url in url_list:
+        try:
+            with span("probe_mirror", url=url):
+                log(f"🔍 测试线路：{url}")
+                start_time = time.time()
+                # 仅发送HEAD请求测速（不下载内容）
+                response = requests.head(url, timeout=timeout, allow_redirects=True)
+                if response.status_code == 200:
+                    response_time = time.time() - start_time
+                    log(f"📶 线路 {url} 响应时间：{response_time:.2f}秒")
+                    if response_time < min_response_time:
+                        min_response_time = response_time
+                        fastest_url = url
+        except Exception as e:
+            log(f"❌ 线路 {url} 测速失败：{str(e)}")
+            continue
+    return fastest_url
+
+
+def order_urls(url_list, fastest_url):
+    """将最快线路排在首位，其余线路保持原顺序作为备用"""
+    if not fastest_url:
+        return list(url_list)
+    return [fastest_url] + [u for u in url_list if u != fastest_url]
+
+
+def download_file(urls, dest_path, log=print, progress=None, timeout=DOWNLOAD_TIMEOUT,
+                  expected_size=None, expected_hash=None, hash_algorithm="md5", report=None, mirror_pool=None,
+                  byte_range=None, scheduler=None, priority=None, codec=None, decoded_size=None, decoded_hash=None):
+    """
+    按顺序尝试各线路下载文件，失败自动切换下一条线路
+    传入mirror_pool时改用对冲下载（见hedged_download）
+    :param urls: 线路地址列表（按优先级排列）
+    :param dest_path: 保存路径
+    :param log: 日志输出函数
+    :param progress: 进度回调（参数为0-100的整数，可选）
+    :param timeout: 连接/读取超时（秒）
+    :param expected_size: 预期字节数（可选，不一致视为失败）
+    :param expected_hash: 预期哈希（可选，不一致视为失败）
+    :param hash_algorithm: 哈希算法（默认MD5，与配置文件一致）
+    :param report: 可选字典，写入本次下载的统计（线路、首字节时间、总耗时、浪费字节数等）
+    :param mirror_pool: 可选的mod_mirror.MirrorPool（提供对冲截止时间和熔断状态）
+    :param byte_range: 只下载文件的一段（闭区间(start, end)，可选）
+    :param scheduler: 可选的mod_scheduler.TransferScheduler（限速与前后台优先级）
+    :param priority: 传输优先级（mod_scheduler.FOREGROUND/BACKGROUND，默认前台）
+    :param codec: 传输压缩方式（mod_transport，指定时边下载边解压，expected_size/expected_hash对应压缩数据）
+    :param decoded_size: 解压后的预期字节数（codec指定时使用）
+    :param decoded_hash: 解压后的预期哈希（codec指定时使用）
+    :return: 成功返回True，否则False
+    """
+    if mirror_pool is not None:
+        return hedged_download(urls, dest_path, mirror_pool, log=log, progress=progress, timeout=timeout,
+                               expected_size=expected_size, expected_hash=expected_hash,
+                               hash_algorithm=hash_algorithm, report=report, byte_range=byte_range,
+                               scheduler=scheduler, priority=priority, codec=codec,
+                               decoded_size=decoded_size, decoded_hash=decoded_hash)
+    if byte_range is not None and expected_size is None:
+        expected_size = byte_range[1] - byte_range[0] + 1
+    if report is None:
+        report = {}
+    report.update({"url": None, "attempts": 0, "bytes": 0, "bytes_wasted": 0, "ttfb_s": None, "total_s": None})
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+
+    for idx, url in enumerate(urls):
+        report["attempts"] += 1
+        downloaded_size = 0
+        try:
+            log(f"📥 开始从线路 {idx + 1}/{len(urls)} 下载：{url}")
+            with span("download", url=url) as download_span:
+                response = requests.get(url, stream=True, timeout=timeout, proxies=NO_PROXIES,
+                                        headers=_range_headers(byte_range))
+                response.raise_for_status()  # 触发HTTP错误（如404/500）
+
+                total_size = expected_size or 0
+                if byte_range is None:
+                    total_size = int(response.headers.get("content-length", 0)) or total_size
+                hash_obj = hashlib.new(hash_algorithm) if expected_hash else None
+                last_progress = -1
+                with open(dest_path, "wb") as f:
+                    sink = DecodingWriter(f, codec, hash_algorithm, decoded_size) if codec else f
+                    for chunk in _iter_body(response, byte_range):
+                        if not chunk:
+                            continue
+                        if report["ttfb_s"] is None:
+                            report["ttfb_s"] = time.perf_counter() - start
+                        _throttle(scheduler, len(chunk), priority)
+                        sink.write(chunk)
+                        if hash_obj:
+                            hash_obj.update(chunk)
+                        downloaded_size += len(chunk)
+                        count("download_bytes", len(chunk))
+                        if progress and total_size > 0:
+                            current = int(downloaded_size / total_size * 100)
+                            if current != last_progress:
+                                last_progress = current
+                                progress(current)
+                    if codec:
+                        sink.finish()
+                download_span.add(bytes=downloaded_size)
+
+            # 验证文件完整性
+            if expected_size is not None and downloaded_size != expected_size:
+                raise Exception(f"文件大小不匹配：下载{downloaded_size}字节，预期{expected_size}字节")
+            if expected_size is None and total_size > 0 and downloaded_size != total_size:
+                raise Exception(f"文件大小不匹配：下载{downloaded_size}字节，预期{total_size}字节")
+            if hash_obj and hash_obj.hexdigest() != expected_hash:
+                raise Exception(f"文件哈希不匹配：下载{hash_obj.hexdigest()}，预期{expected_hash}")
+            if codec:
+                sink.verify(decoded_size, decoded_hash)
+
+            report.update({"url": url, "bytes": downloaded_size, "total_s": time.perf_counter() - start})
+            return True
+
+        except Exception as e:
+            report["bytes_wasted"] += downloaded_size
+            log(f"❌ 线路 {url} 下载失败：{str(e)}")
+            # 清理不完整文件
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+            # 最后一条线路仍失败
+            if idx == len(urls) - 1:
+                log(f"❌ 所有线路下载失败！")
+
+    report["total_s"] = time.perf_counter() - start
+    return False
+
+
+class _HedgeAttempt:
+    """对冲下载中对单条线路的一次请求（在独立线程中执行）"""
+
+    def __init__(self, url, part_path, index):
+        self.url = url
+        self.part_path = part_path
+        self.index = index
+        self.first_byte = False
+        self.done = False
+        self.ok = False
+        self.cancelled = threading.Event()
+        self.bytes = 0
+        self.total_size = 0
+        self.started_at = time.perf_counter()
+        self.first_byte_at = None
+        self.throttled_s = 0.0  # 在调度器中等待的时间
+        self.error = None
+        self.logged = False
+
+
+def _remove_part(part_path):
+    """删除对冲请求的临时文件（不存在或仍被占用时忽略，占用者退出时会自行删除）"""
+    try:
+        os.remove(part_path)
+    except OSError:
+        pass
+
+
+def _run_attempt(attempt, cond, pool, progress_state, timeout, expected_size, expected_hash, hash_algorithm,
+                 byte_range=None, scheduler=None, priority=None, codec=None, decoded_size=None, decoded_hash=None):
+    """
+    执行单次请求：写入独立的临时文件，首字节到达/完成/失败时通知调度线程
+    """
+    start = time.perf_counter()
+    hash_obj = hashlib.new(hash_algorithm) if expected_hash else None
+    total_size = 0
+    pool.begin(attempt.url)
+    try:
+        with span("download", url=attempt.url, hedge=attempt.index) as download_span:
+            response = requests.get(attempt.url, stream=True, timeout=timeout, proxies=NO_PROXIES,
+                                    headers=_range_headers(byte_range))
+            try:
+                response.raise_for_status()
+                total_size = expected_size or 0
+                if byte_range is None:
+                    total_size = int(response.headers.get("content-length", 0)) or total_size
+                attempt.total_size = total_size
+                # 等待响应期间已被取消时不再创建临时文件
+                if not attempt.cancelled.is_set():
+                    with open(attempt.part_path, "wb") as f:
+                        sink = DecodingWriter(f, codec, hash_algorithm, decoded_size) if codec else f
+                        for chunk in _iter_body(response, byte_range):
+                            if attempt.cancelled.is_set():
+                                break
+                            if not chunk:
+                                continue
+                            # 首字节时间在限速等待之前记录（限速和后台暂停不计入线路的响应时间）
+                            if not attempt.first_byte:
+                                attempt.first_byte_at = time.perf_counter()
+                                pool.record_ttfb(attempt.url, attempt.first_byte_at - start)
+                                with cond:
+                                    attempt.first_byte = True
+                                    cond.notify_all()
+                            attempt.throttled_s += _throttle(scheduler, len(chunk), priority)
+                            sink.write(chunk)
+                            if hash_obj:
+                                hash_obj.update(chunk)
+                            attempt.bytes += len(chunk)
+                            count("download_bytes", len(chunk))
+                            progress_state(attempt, total_size)
+                        if codec and not attempt.cancelled.is_set():
+                            sink.finish()
+            finally:
+                response.close()
+            download_span.add(bytes=attempt.bytes, cancelled=attempt.cancelled.is_set())
+
+        if not attempt.cancelled.is_set():
+            expected = expected_size if expected_size is not None else total_size
+            if expected and attempt.bytes != expected:
+                raise Exception(f"文件大小不匹配：下载{attempt.bytes}字节，预期{expected}字节")
+            if hash_obj and hash_obj.hexdigest() != expected_hash:
+                raise Exception(f"文件哈希不匹配：下载{hash_obj.hexdigest()}，预期{expected_hash}")
+            if codec:
+                sink.verify(decoded_size, decoded_hash)
+            elapsed = time.perf_counter() - start - attempt.throttled_s
+            if elapsed > 0:
+                pool.record_throughput(attempt.url, attempt.bytes / elapsed)
+            pool.record_success(attempt.url)
+            attempt.ok = True
+    except Exception as e:
+        attempt.error = e
+        if not attempt.cancelled.is_set():
+            pool.record_failure(attempt.url)
+    finally:
+        pool.end(attempt.url)
+
+    if attempt.cancelled.is_set():
+        pool.record_cancel(attempt.url)
+    # 失败或已被取消（其他线路胜出）的请求不保留临时文件
+    if not attempt.ok or attempt.cancelled.is_set():
+        _remove_part(attempt.part_path)
+    with cond:
+        attempt.done = True
+        cond.notify_all()
+
+
+def hedged_download(urls, dest_path, mirror_pool, log=print, progress=None, timeout=DOWNLOAD_TIMEOUT,
+                    expected_size=None, expected_hash=None, hash_algorithm="md5", report=None, byte_range=None,
+                    scheduler=None, priority=None, codec=None, decoded_size=None, decoded_hash=None):
+    """
+    对冲下载：先请求首条线路，若在自适应截止时间内没有收到首字节，
+    同时向下一条线路发出相同请求，取先完成者，其余请求取消
+    传输中途变慢时，若其他线路（按历史吞吐量估计）明显更快，也会交给该线路并行下载
+    熔断中的线路会被跳过（全部熔断时仍按原顺序尝试）
+    :param urls: 线路地址列表（按优先级排列）
+    :param dest_path: 保存路径
+    :param mirror_pool: mod_mirror.MirrorPool
+    :param log: 日志输出函数
+    :param progress: 进度回调（参数为0-100的整数，可选，按领先的请求计算）
+    :param timeout: 连接/读取超时（秒）
+    :param expected_size: 预期字节数（可选，不一致视为失败）
+    :param expected_hash: 预期哈希（可选，不一致视为失败）
+    :param hash_algorithm: 哈希算法（默认MD5，与配置文件一致）
+    :param report: 可选字典，统计字段同download_file，另有hedges（额外发出的对冲请求数）和rebalances（其中因中途变慢发出的数量）
+    :param byte_range: 只下载文件的一段（闭区间(start, end)，可选）
+    :param scheduler: 可选的mod_scheduler.TransferScheduler（限速与前后台优先级）
+    :param priority: 传输优先级（mod_scheduler.FOREGROUND/BACKGROUND，默认前台）
+    :param codec: 传输压缩方式（同download_file）
+    :param decoded_size: 解压后的预期字节数
+    :param decoded_hash: 解压后的预期哈希
+    :return: 成功返回True，否则False
+    """
+    if byte_range is not None and expected_size is None:
+        expected_size = byte_range[1] - byte_range[0] + 1
+    if report is None:
+        report = {}
+    report.update({"url": None, "attempts": 0, "hedges": 0, "rebalances": 0, "bytes": 0, "bytes_wasted": 0,
+                   "ttfb_s": None, "total_s": None})
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+
+    cond = threading.Condition()
+    attempts = []
+    # 临时文件名每次调用唯一：已取消但仍在等待响应的请求不会与同一目标的重试互相覆盖/删除
+    part_prefix = f"{dest_path}.{uuid.uuid4().hex[:8]}"
+    pending = list(urls)
+    skipped = []
+    last_progress = [-1]
+
+    def progress_state(attempt, total_size):
+        # 只按领先的请求汇报进度，避免对冲时进度来回跳动
+        if not progress or total_size <= 0:
+            return
+        with cond:
+            if attempt.bytes < max(a.bytes for a in attempts):
+                return
+            current = int(attempt.bytes / total_size * 100)
+            if current <= last_progress[0]:
+                return
+            last_progress[0] = current
+        progress(current)
+
+    def start_next(reason=None):
+        """启动下一条可用线路的请求，没有可用线路返回False"""
+        url = None
+        while pending:
+            candidate = pending.pop(0)
+            if mirror_pool.allow(candidate):
+                url = candidate
+                break
+            skipped.append(candidate)
+            log(f"⚡ 线路 {candidate} 熔断中，跳过")
+        if url is None and not attempts and skipped:
+            url = skipped.pop(0)  # 全部线路熔断时仍尝试首条线路
+        if url is None:
+            return False
+        attempt = _HedgeAttempt(url, f"{part_prefix}.hedge{len(attempts)}", len(attempts))
+        attempts.append(attempt)
+        report["attempts"] += 1
+        if reason:
+            report["hedges"] += 1
+            count("hedged_requests")
+            log(f"⏱️ {reason}，同时请求线路：{url}")
+        else:
+            log(f"📥 开始从线路 {url} 下载")
+        threading.Thread(target=bind(_run_attempt), daemon=True,
+                         args=(attempt, cond, mirror_pool, progress_state, timeout, expected_size,
+                               expected_hash, hash_algorithm, byte_range, scheduler, priority, codec,
+                               decoded_size, decoded_hash)).start()
+        return True
+
+    winner = None
+    with cond:
+        start_next()
+        deadline = mirror_pool.hedge_deadline(timeout)
+        hedge_at = time.perf_counter() + deadline
+        while attempts:
+            winner = next((a for a in attempts if a.ok), None)
+            if winner:
+                break
+            running = [a for a in attempts if not a.done]
+            for a in attempts:
+                if a.done and a.error is not None and not a.logged:
+                    a.logged = True
+                    log(f"❌ 线路 {a.url} 下载失败：{str(a.error)}")
+            if not running:
+                # 所有请求都已失败，立即换下一条线路
+                if not start_next():
+                    break
+                hedge_at = time.perf_counter() + mirror_pool.hedge_deadline(timeout)
+                continue
+            if not pending:
+                cond.wait()
+                continue
+            streaming = [a for a in running if a.first_byte]
+            if streaming:
+                # 已在传输：检查是否明显慢于其他线路，是则把剩余线路中最快的提到前面并行下载
+                # （已有并行请求在等待首字节时不再追加）
+                lead = max(streaming, key=lambda a: a.bytes)
+                faster = None
+                if len(streaming) == len(running):
+                    faster = mirror_pool.should_rebalance(
+                        lead.url, lead.bytes, lead.total_size,
+                        time.perf_counter() - lead.first_byte_at - lead.throttled_s, pending)
+                if faster:
+                    pending.remove(faster)
+                    pending.insert(0, faster)
+                    if start_next(f"线路 {lead.url} 传输过慢"):
+                        report["rebalances"] += 1
+                        count("rebalanced_requests")
+                    continue
+                cond.wait(REBALANCE_CHECK_INTERVAL)
+                continue
+            remaining = hedge_at - time.perf_counter()
+            if remaining > 0:
+                cond.wait(remaining)
+                continue
+            slow = running[-1]
+            if start_next(f"线路 {slow.url} 在{deadline:.2f}秒内无响应"):
+                deadline = mirror_pool.hedge_deadline(timeout)
+                hedge_at = time.perf_counter() + deadline
+
+        for a in attempts:
+            if a is not winner:
+                a.cancelled.set()
+
+    # 已完成（包括同样下载成功）的落选请求由这里删除临时文件，仍在运行的请求退出时自行删除
+    for a in attempts:
+        if a is not winner:
+            _remove_part(a.part_path)
+    report["bytes_wasted"] = sum(a.bytes for a in attempts if a is not winner)
+    report["total_s"] = time.perf_counter() - start
+    if winner is None:
+        log(f"❌ 所有线路下载失败！")
+        return False
+    os.replace(winner.part_path, dest_path)
+    report.update({"url": winner.url, "bytes": winner.bytes, "ttfb_s": winner.first_byte_at - start if winner.first_byte_at else None})
+    return True
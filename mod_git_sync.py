@@ -0,0 +1,152 @@
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+
+from mod_pipeline import MANIFEST_REL_PATH, repo_relative_path
+from mod_trace import span, traced
+from mod_unsplit import restore_split_file
+from util import calculate_file_hash, get_json_from_file
+
+# 始终检出的目录（配置文件所在）
+ALWAYS_CHECKOUT = ["/config/"]
+# 同步方式环境变量（值为git时使用Git稀疏检出代替HTTP下载）
+SYNC_MODE_ENV_VAR = "CMAGIC_SYNC"
+# Windows下隐藏git子进程的控制台窗口（其他平台没有该标志，取0）
+CREATE_NO_WINDOW = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+
+
+class GitSparseSync:
+    """
+    Git稀疏同步：浅克隆（--depth 1）+ 按需获取文件内容（--filter=blob:none）+ 稀疏检出
+    平时只检出config目录；同步时把本次需要的Mod路径加入稀疏检出，Git只下载这些文件的内容
+    仓库历史再长也只传输最新提交的目录结构和需要的文件
+    """
+
+    def __init__(self, repo_url, work_dir, git_exe="git", branch=None, log=print):
+        """
+        :param repo_url: 远程仓库地址（本地测试时使用file://地址，直接用路径克隆会忽略--filter）
+        :param work_dir: 本地工作目录
+        :param git_exe: git可执行文件路径
+        :param branch: 分支（默认远程默认分支）
+        :param log: 日志输出函数
+        """
+        self.repo_url = repo_url
+        self.work_dir = work_dir
+        self.git_exe = git_exe
+        self.branch = branch
+        self.log = log
+
+    def _git(self, *args, cwd=None):
+        """执行git命令，失败时抛出异常（包含git的错误输出）"""
+        result = subprocess.run([self.git_exe, *args], cwd=cwd or self.work_dir, capture_output=True, text=True,
+                                creationflags=CREATE_NO_WINDOW)
+        if result.returncode != 0:
+            raise Exception(f"git {' '.join(args)} 失败：{result.stderr.strip()}")
+        return result.stdout
+
+    def _set_sparse(self, patterns):
+        # 非cone模式：可以精确到单个文件，而不是整个mods目录
+        self._git("sparse-checkout", "set", "--no-cone", *patterns)
+
+    @traced("git_update")
+    def update(self):
+        """
+        克隆（首次）或拉取最新提交，只检出config目录
+        :return: 本地配置文件路径
+        """
+        if not os.path.isdir(os.path.join(self.work_dir, ".git")):
+            self.log(f"🔧 稀疏克隆仓库：{self.repo_url}")
+            args = ["clone", "--filter=blob:none", "--depth", "1", "--sparse", "--no-checkout"]
+            if self.branch:
+                args += ["--branch", self.branch]
+            os.makedirs(os.path.dirname(os.path.abspath(self.work_dir)), exist_ok=True)
+            self._git(*args, self.repo_url, self.work_dir, cwd=os.path.dirname(os.path.abspath(self.work_dir)))
+        else:
+            self.log(f"🔍 获取仓库最新提交")
+            self._git("fetch", "--depth", "1", "--filter=blob:none", "origin", self.branch or "HEAD")
+        self._set_sparse(ALWAYS_CHECKOUT)
+        target = "FETCH_HEAD" if os.path.exists(os.path.join(self.work_dir, ".git", "FETCH_HEAD")) else "HEAD"
+        self._git("reset", "--hard", target)
+        return os.path.join(self.work_dir, MANIFEST_REL_PATH)
+
+    @staticmethod
+    def entry_paths(entry):
+        """单个Mod在仓库中需要的文件（未分割文件本身、分割文件的全部分包或所在bundle）"""
+        if entry.get("bundle"):
+            return [entry["bundle"]["bundle_path"]]
+        if entry.get("is_split") and entry.get("split_details"):
+            return [chunk["chunk_path"] for chunk in entry["split_details"]["chunks"]]
+        return [entry["file_path"]]
+
+    @traced("git_fetch_entries")
+    def fetch_entries(self, entries, dest_dir):
+        """
+        检出本次需要的Mod并取出到暂存目录（校验哈希），完成后稀疏检出恢复为只有config目录
+        :param entries: 配置文件中的Mod信息列表
+        :param dest_dir: 暂存目录
+        :return: (成功的文件名列表, 失败的文件名列表)
+        """
+        os.makedirs(dest_dir, exist_ok=True)
+        rel_paths = sorted({repo_relative_path(p) for entry in entries for p in self.entry_paths(entry)})
+        succeeded, failed = [], []
+        try:
+            with span("git_checkout", files=len(rel_paths)):
+                # 稀疏检出范围扩大时，Git一次性批量获取缺少的文件内容
+                self._set_sparse(ALWAYS_CHECKOUT + ["/" + path for path in rel_paths])
+            for entry in entries:
+                try:
+                    ok = self._extract_entry(entry, dest_dir)
+                except Exception as e:
+                    self.log(f"❌ 取出 {entry['file_name']} 失败：{str(e)}")
+                    ok = False
+                (succeeded if ok else failed).append(entry["file_name"])
+        finally:
+            self._set_sparse(ALWAYS_CHECKOUT)
+        return succeeded, failed
+
+    def _repo_path(self, path):
+        return os.path.join(self.work_dir, *repo_relative_path(path).split("/"))
+
+    def _extract_entry(self, entry, dest_dir):
+        dest_path = os.path.join(dest_dir, entry["file_name"])
+        if entry.get("bundle"):
+            with open(self._repo_path(entry["bundle"]["bundle_path"]), "rb") as f:
+                f.seek(entry["bundle"]["offset"])
+                data = f.read(entry["file_size_bytes"])
+            if hashlib.md5(data).hexdigest() != entry["file_hash"]:
+                return False
+            with open(dest_path, "wb") as out:
+                out.write(data)
+            return True
+        if entry.get("is_split") and entry.get("split_details"):
+            # 分包可能不在同一目录（发布目录按哈希存放），逐个换成工作目录中的路径
+            split_details = dict(entry["split_details"], chunks=[
+                dict(chunk, chunk_path=self._repo_path(chunk["chunk_path"]))
+                for chunk in entry["split_details"]["chunks"]])
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+            return restore_split_file(dict(entry, split_details=split_details), dest_dir, verify_chunks=False)
+        src_path = self._repo_path(entry["file_path"])
+        if calculate_file_hash(src_path) != entry["file_hash"]:
+            return False
+        shutil.copyfile(src_path, dest_path)
+        return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Git稀疏同步：只下载配置文件和需要的Mod（本地测试可使用file://裸仓库地址）")
+    parser.add_argument("repo_url", help="仓库地址（本地裸仓库需开启uploadpack.allowFilter并使用file://地址）")
+    parser.add_argument("--work-dir", default=os.path.join("temp", "git_sync"), help="工作目录（默认temp/git_sync）")
+    parser.add_argument("--dest", default=None, help="取出全部Mod到该目录（默认只更新配置文件）")
+    parser.add_argument("--branch", default=None, help="分支（默认远程默认分支）")
+    args = parser.parse_args()
+
+    sync = GitSparseSync(args.repo_url, args.work_dir, branch=args.branch)
+    manifest_path = sync.update()
+    print(f"[成功] 配置文件：{manifest_path}")
+    if args.dest:
+        manifest = get_json_from_file(manifest_path)
+        ok, bad = sync.fetch_entries(manifest["all_mod_files"], args.dest)
+        print(f"[信息] 成功 {len(ok)} 个，失败 {len(bad)} 个")
@@ -0,0 +1,217 @@
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+# 熔断：连续失败次数达到该值后打开熔断器
+BREAKER_FAILURE_THRESHOLD = 3
+# 熔断打开后多久进入半开状态（秒），半开时只放行一个试探请求
+BREAKER_RESET_TIMEOUT = 30.0
+# 对冲请求：首字节时间取最近样本的该百分位
+HEDGE_PERCENTILE = 0.95
+# 对冲截止时间 = 百分位首字节时间 × 该倍数
+HEDGE_MULTIPLIER = 1.5
+# 样本不足时使用的默认对冲截止时间（秒）
+HEDGE_DEFAULT_DEADLINE = 2.0
+# 对冲截止时间的下限（秒），避免过早发出重复请求
+HEDGE_MIN_DEADLINE = 0.2
+# 计算百分位所需的最少样本数
+HEDGE_MIN_SAMPLES = 5
+# 每条线路保留的样本数
+SAMPLE_WINDOW = 50
+# 再平衡：当前线路预计剩余时间超过其他线路完整下载预计时间的该倍数时，改由更快的线路并行下载
+REBALANCE_RATIO = 2.0
+# 再平衡前至少观察的传输时间（秒），避免刚开始传输时误判
+REBALANCE_MIN_ELAPSED = 1.0
+
+
+class CircuitBreaker:
+    """
+    单条线路的熔断器：closed（正常）→ open（连续失败，暂停使用）→ half_open（试探恢复）
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        是否允许向该线路发出请求（半开状态下只允许一个试探请求）
+        :return: 允许返回True
+        """
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_cancel(self):
+        """请求被主动取消（对冲请求中的落后者）：不计成败，但释放半开状态的试探名额"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+
+class MirrorPool:
+    """
+    线路状态表：记录各线路的首字节时间、吞吐量样本和熔断器
+    线路以仓库根地址（或域名）区分，同一线路上的不同文件共享统计
+    """
+
+    def __init__(self, base_urls=()):
+        """
+        :param base_urls: 已知线路的仓库根地址（用于按前缀识别URL所属线路）
+        """
+        self.base_urls = list(base_urls)
+        self._ttfb = {}
+        self._throughput = {}
+        self._breakers = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def mirror_of(self, url):
+        """返回URL所属线路（匹配已知根地址，否则取域名）"""
+        for base in self.base_urls:
+            if url.startswith(base):
+                return base
+        return urlsplit(url).netloc or url
+
+    def breaker(self, url):
+        mirror = self.mirror_of(url)
+        with self._lock:
+            if mirror not in self._breakers:
+                self._breakers[mirror] = CircuitBreaker()
+            return self._breakers[mirror]
+
+    # ---------- 样本记录 ----------
+    def record_ttfb(self, url, seconds):
+        with self._lock:
+            self._ttfb.setdefault(self.mirror_of(url), deque(maxlen=SAMPLE_WINDOW)).append(seconds)
+
+    def record_throughput(self, url, bytes_per_second):
+        with self._lock:
+            self._throughput.setdefault(self.mirror_of(url), deque(maxlen=SAMPLE_WINDOW)).append(bytes_per_second)
+
+    def record_success(self, url):
+        self.breaker(url).record_success()
+
+    def record_failure(self, url):
+        self.breaker(url).record_failure()
+
+    def record_cancel(self, url):
+        self.breaker(url).record_cancel()
+
+    def begin(self, url):
+        """登记一个正在进行的请求（用于按负载分配线路）"""
+        mirror = self.mirror_of(url)
+        with self._lock:
+            self._inflight[mirror] = self._inflight.get(mirror, 0) + 1
+
+    def end(self, url):
+        mirror = self.mirror_of(url)
+        with self._lock:
+            self._inflight[mirror] = max(0, self._inflight.get(mirror, 0) - 1)
+
+    # ---------- 查询 ----------
+    def hedge_deadline(self, timeout=None):
+        """
+        对冲截止时间：所有线路最近首字节时间的百分位 × 倍数（自适应）
+        :param timeout: 上限（一般为下载超时）
+        :return: 秒数
+        """
+        with self._lock:
+            samples = sorted(s for values in self._ttfb.values() for s in values)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            deadline = HEDGE_DEFAULT_DEADLINE
+        else:
+            index = min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE))
+            deadline = max(HEDGE_MIN_DEADLINE, samples[index] * HEDGE_MULTIPLIER)
+        return min(deadline, timeout) if timeout else deadline
+
+    def throughput(self, url):
+        """线路最近吞吐量的平均值（字节/秒，无样本返回None）"""
+        with self._lock:
+            values = self._throughput.get(self.mirror_of(url))
+            return sum(values) / len(values) if values else None
+
+    def rank(self, urls):
+        """
+        按预计完成时间排序线路：(进行中的请求数 + 1) / 吞吐量，熔断中的线路排在最后
+        没有吞吐量样本的线路按已知最快线路估计（乐观，让新线路也能分到任务）
+        多个分包依次调用即可按吞吐量比例分散到各线路
+        :param urls: 同一文件在各线路上的地址
+        :return: 排序后的地址列表
+        """
+        with self._lock:
+            known = [sum(v) / len(v) for v in self._throughput.values() if v]
+            best = max(known) if known else 1.0
+            costs = {}
+            for idx, url in enumerate(urls):
+                mirror = self.mirror_of(url)
+                values = self._throughput.get(mirror)
+                speed = sum(values) / len(values) if values else best
+                breaker = self._breakers.get(mirror)
+                tripped = breaker is not None and breaker.state == CircuitBreaker.OPEN
+                costs[url] = (tripped, (self._inflight.get(mirror, 0) + 1) / speed, idx)
+        return sorted(urls, key=lambda u: costs[u])
+
+    def should_rebalance(self, url, received, total, elapsed, alternatives):
+        """
+        判断正在传输的请求是否应当交给更快的线路并行下载
+        :param url: 当前请求地址
+        :param received: 已接收字节数
+        :param total: 总字节数
+        :param elapsed: 自首字节以来的传输时间（秒）
+        :param alternatives: 可选的其他线路地址
+        :return: 应当改用的线路地址，不需要返回None
+        """
+        if elapsed < REBALANCE_MIN_ELAPSED or not total or received <= 0 or received >= total:
+            return None
+        remaining = (total - received) / (received / elapsed)
+        best_url, best_time = None, None
+        for alt in alternatives:
+            speed = self.throughput(alt)
+            if not speed or self.breaker(alt).state != CircuitBreaker.CLOSED:
+                continue
+            estimate = self.hedge_deadline() + total / speed
+            if best_time is None or estimate < best_time:
+                best_url, best_time = alt, estimate
+        if best_url and remaining > best_time * REBALANCE_RATIO:
+            return best_url
+        return None
+
+    def allow(self, url):
+        """该URL所属线路当前是否允许发出请求（半开线路返回True即占用其试探名额）"""
+        return self.breaker(url).allow()
+
+    def states(self):
+        """各线路熔断器状态（用于日志/统计）"""
+        with self._lock:
+            return {mirror: breaker.state for mirror, breaker in self._breakers.items()}
@@ -0,0 +1,425 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+from mod_bench import generate_mod_pack
+from mod_download import download_file, get_fastest_url, order_urls
+from mod_mirror import MirrorPool
+from mod_pipeline import SyncPipeline
+from mod_publish import Publisher
+from util import calculate_file_hash, get_json_from_file, parse_range_header
+
+MB_TO_BYTES = 1024 * 1024
+
+# 限速发送的块大小
+SEND_BLOCK_SIZE = 16 * 1024
+
+
+class NetemProfile:
+    """单个模拟线路的网络特性"""
+
+    def __init__(self, name="mirror", latency=0.0, bandwidth=None, error_rate=0.0, drop_rate=0.0,
+                 range_support=True, stall_rate=0.0, stall=0.0, shared_bandwidth=None, seed=None):
+        """
+        :param name: 线路名称（用于报告）
+        :param latency: 每个请求的首字节延迟（秒）
+        :param bandwidth: 带宽上限（字节/秒，None为不限速）
+        :param error_rate: 返回503错误的概率（0-1）
+        :param drop_rate: 传输途中断开连接的概率（0-1）
+        :param range_support: 是否支持Range请求
+        :param stall_rate: GET请求在发送响应前卡住的概率（0-1，HEAD不受影响，模拟测速正常但下载卡住的线路）
+        :param stall: 卡住的时长（秒）
+        :param shared_bandwidth: 整条线路（所有连接共享）的带宽上限（字节/秒，None为不限速，模拟按线路限速的代理）
+        :param seed: 随机种子（固定后结果可复现）
+        """
+        self.name = name
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.range_support = range_support
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.shared_bandwidth = shared_bandwidth
+        self.random = random.Random(seed)
+
+
+class _NetemHandler(BaseHTTPRequestHandler):
+    """按NetemProfile模拟网络特性的静态文件处理器"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # 不输出访问日志
+
+    def do_HEAD(self):
+        self._handle(send_body=False)
+
+    def do_GET(self):
+        self._handle(send_body=True)
+
+    def _handle(self, send_body):
+        server = self.server
+        profile = server.profile
+        with server.stats_lock:
+            server.stats["requests"] += 1
+        time.sleep(profile.latency)
+        if send_body and profile.stall_rate and profile.random.random() < profile.stall_rate:
+            with server.stats_lock:
+                server.stats["stalls"] += 1
+            time.sleep(profile.stall)
+
+        if profile.random.random() < profile.error_rate:
+            with server.stats_lock:
+                server.stats["errors"] += 1
+            self.send_error(503, "Emulated error")
+            return
+
+        file_path = os.path.join(server.root_dir, unquote(self.path.lstrip("/").split("?", 1)[0]))
+        if not os.path.isfile(file_path):
+            self.send_error(404, "Not Found")
+            return
+        file_size = os.path.getsize(file_path)
+
+        start, end = 0, file_size - 1
+        status = 200
+        byte_range = parse_range_header(self.headers.get("Range"), file_size) if profile.range_support else None
+        if byte_range == (-1, -1):
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{file_size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if byte_range:
+            start, end = byte_range
+            status = 206
+
+        length = end - start + 1
+        self.send_response(status)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes" if profile.range_support else "none")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{file_size}")
+        self.end_headers()
+        if not send_body:
+            return
+
+        # 随机决定是否中途断开，以及断开位置
+        drop_at = profile.random.randint(0, max(0, length - 1)) if profile.random.random() < profile.drop_rate else None
+        sent = 0
+        began = time.perf_counter()
+        with open(file_path, "rb") as f:
+            f.seek(start)
+            while sent < length:
+                block = f.read(min(SEND_BLOCK_SIZE, length - sent))
+                if not block:
+                    break
+                if drop_at is not None and sent + len(block) > drop_at:
+                    block = block[:drop_at - sent]
+                    self._send(block)
+                    sent += len(block)
+                    with server.stats_lock:
+                        server.stats["drops"] += 1
+                    self.close_connection = True
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    break
+                if profile.shared_bandwidth:
+                    self._wait_shared_bandwidth(len(block))
+                self._send(block)
+                sent += len(block)
+                if profile.bandwidth:
+                    # 按带宽上限计算应当耗费的时间，发送过快则等待
+                    delay = sent / profile.bandwidth - (time.perf_counter() - began)
+                    if delay > 0:
+                        time.sleep(delay)
+
+    def _wait_shared_bandwidth(self, size):
+        """按整条线路的带宽上限为该块预约发送时间，所有连接依次排队"""
+        server = self.server
+        with server.stats_lock:
+            now = time.perf_counter()
+            slot = max(now, server.bandwidth_free_at)
+            server.bandwidth_free_at = slot + size / server.profile.shared_bandwidth
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _send(self, block):
+        try:
+            self.wfile.write(block)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+            return
+        with self.server.stats_lock:
+            self.server.stats["bytes_sent"] += len(block)
+
+
+class EmulatedServer:
+    """在localhost上启动的模拟线路（后台线程运行）"""
+
+    def __init__(self, root_dir, profile=None):
+        """
+        :param root_dir: 对外提供的文件根目录
+        :param profile: NetemProfile（默认无延迟、不限速）
+        """
+        self.profile = profile or NetemProfile()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _NetemHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.root_dir = root_dir
+        self.httpd.profile = self.profile
+        self.httpd.stats = {"requests": 0, "errors": 0, "drops": 0, "stalls": 0, "bytes_sent": 0}
+        self.httpd.stats_lock = threading.Lock()
+        self.httpd.bandwidth_free_at = 0.0
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    @property
+    def stats(self):
+        return dict(self.httpd.stats)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+
+def run_scenario(profiles, file_size, work_dir=None, log=None, hedged=False):
+    """
+    启动若干模拟线路，对更新引擎的测速和下载流程计时
+    :param profiles: NetemProfile列表（每个对应一条线路）
+    :param file_size: 测试文件字节数
+    :param work_dir: 工作目录（默认临时目录，结束后删除）
+    :param log: 日志函数（默认不输出）
+    :param hedged: 是否使用对冲下载（MirrorPool）
+    :return: 报告字典（所选线路、首字节时间、总耗时、浪费字节数、各线路统计）
+    """
+    log = log or (lambda msg: None)
+    own_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="mod_netem_")
+    servers = []
+    try:
+        serve_dir = os.path.join(work_dir, "serve")
+        os.makedirs(serve_dir, exist_ok=True)
+        payload_path = os.path.join(serve_dir, "payload.bin")
+        with open(payload_path, "wb") as f:
+            f.write(os.urandom(file_size))
+        expected_hash = calculate_file_hash(payload_path)
+
+        servers = [EmulatedServer(serve_dir, p).start() for p in profiles]
+        urls = [s.base_url + "payload.bin" for s in servers]
+
+        probe_start = time.perf_counter()
+        fastest_url = get_fastest_url(urls, log=log)
+        probe_s = time.perf_counter() - probe_start
+
+        report = {}
+        success = download_file(order_urls(urls, fastest_url), os.path.join(work_dir, "download.bin"), log=log,
+                                expected_size=file_size, expected_hash=expected_hash, report=report,
+                                mirror_pool=MirrorPool() if hedged else None)
+        names = {s.base_url + "payload.bin": s.profile.name for s in servers}
+        return {
+            "success": success,
+            "file_size": file_size,
+            "fastest_mirror": names.get(fastest_url),
+            "used_mirror": names.get(report["url"]),
+            "probe_s": round(probe_s, 4),
+            "ttfb_s": round(report["ttfb_s"], 4) if report["ttfb_s"] is not None else None,
+            "total_s": round(report["total_s"] + probe_s, 4),
+            "attempts": report["attempts"],
+            "hedges": report.get("hedges", 0),
+            "bytes_wasted": report["bytes_wasted"],
+            "mirrors": {s.profile.name: s.stats for s in servers},
+        }
+    finally:
+        for server in servers:
+            server.stop()
+        if own_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_pipeline_scenario(profiles, pack, bundle=False, sources=None, work_dir=None, log=None):
+    """
+    生成合成整合包并发布（mod_publish布局），启动若干模拟线路，用SyncPipeline完整同步一次并计时
+    :param profiles: NetemProfile列表（每个对应一条线路，均提供整个发布目录）
+    :param pack: 合成整合包参数（传给mod_bench.generate_mod_pack，如{"small_count": 0, "large_size_mb": 240}）
+    :param bundle: 发布时是否将小Mod打包为bundle
+    :param sources: 外部下载地址（模拟上游CDN）列表[(NetemProfile, 覆盖比例)]，按文件名顺序只提供前一部分文件，
+                    其余返回404；各文件的sources按列表顺序记录在配置中
+    :param work_dir: 工作目录（默认临时目录，结束后删除）
+    :param log: 日志函数（默认不输出）
+    :return: 报告字典（总耗时、吞吐量、请求数、各线路统计、同步结果是否全部通过哈希校验）
+    """
+    log = log or (lambda msg: None)
+    own_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="mod_netem_")
+    servers = []
+    try:
+        src_dir = os.path.join(work_dir, "src")
+        serve_dir = os.path.join(work_dir, "serve")
+        target_dir = os.path.join(work_dir, "mods")
+        generate_mod_pack(src_dir, **pack)
+        source_servers = []
+        source_urls = {}
+        for source_profile, coverage in sources or []:
+            cdn_dir = os.path.join(work_dir, "cdn", source_profile.name)
+            os.makedirs(cdn_dir, exist_ok=True)
+            server = EmulatedServer(cdn_dir, source_profile).start()
+            source_servers.append(server)
+            file_names = sorted(os.listdir(src_dir))
+            for idx, file_name in enumerate(file_names):
+                file_hash = calculate_file_hash(os.path.join(src_dir, file_name))
+                # 未覆盖的文件也记录地址（请求时返回404，客户端逐个文件回退）
+                source_urls.setdefault(file_hash, []).append(f"{server.base_url}{file_hash}/{file_name}")
+                if idx < len(file_names) * coverage:
+                    os.makedirs(os.path.join(cdn_dir, file_hash), exist_ok=True)
+                    shutil.copyfile(os.path.join(src_dir, file_name), os.path.join(cdn_dir, file_hash, file_name))
+        servers.extend(source_servers)
+        manifest_path, _ = Publisher(serve_dir, cache_path=None, bundle=bundle, sources=source_urls,
+                                     log=log).publish(src_dir)
+        entries = get_json_from_file(manifest_path)["all_mod_files"]
+        total_bytes = sum(entry["file_size_bytes"] for entry in entries)
+
+        mirror_servers = [EmulatedServer(serve_dir, p).start() for p in profiles]
+        servers.extend(mirror_servers)
+        base_urls = [s.base_url for s in mirror_servers]
+        pipeline = SyncPipeline(base_urls, target_dir, os.path.join(work_dir, "staging"), log=log,
+                                mirror_pool=MirrorPool(base_urls))
+        start = time.perf_counter()
+        succeeded, failed = pipeline.run(entries)
+        total_s = time.perf_counter() - start
+
+        verified = not failed and all(
+            calculate_file_hash(os.path.join(target_dir, entry["file_name"])) == entry["file_hash"]
+            for entry in entries)
+        sent = sum(s.stats["bytes_sent"] for s in servers)
+        return {
+            "success": not failed,
+            "verified": verified,
+            "files": len(entries),
+            "total_mb": round(total_bytes / MB_TO_BYTES, 1),
+            "total_s": round(total_s, 3),
+            "throughput_mb_s": round(total_bytes / MB_TO_BYTES / total_s, 1) if total_s > 0 else None,
+            "requests": sum(s.stats["requests"] for s in servers),
+            "bytes_wasted": max(0, sent - total_bytes),
+            "mirrors": {s.profile.name: s.stats for s in mirror_servers},
+            "sources": {s.profile.name: s.stats for s in source_servers},
+        }
+    finally:
+        for server in servers:
+            server.stop()
+        if own_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# 内置场景：各线路特性参考gh-proxy/npmmirror等实际表现
+SCENARIOS = {
+    "baseline": [
+        NetemProfile("fast", latency=0.02, bandwidth=20 * 1024 * 1024, seed=1),
+        NetemProfile("slow", latency=0.2, bandwidth=2 * 1024 * 1024, seed=2),
+    ],
+    "flaky_primary": [
+        NetemProfile("flaky", latency=0.01, bandwidth=20 * 1024 * 1024, drop_rate=1.0, seed=1),
+        NetemProfile("steady", latency=0.1, bandwidth=5 * 1024 * 1024, seed=2),
+    ],
+    "erroring": [
+        NetemProfile("error", latency=0.01, error_rate=0.5, seed=1),
+        NetemProfile("ok", latency=0.05, bandwidth=10 * 1024 * 1024, seed=2),
+    ],
+    "stalling_primary": [
+        NetemProfile("stalling", latency=0.01, bandwidth=20 * 1024 * 1024, stall_rate=1.0, stall=10.0, seed=1),
+        NetemProfile("steady", latency=0.1, bandwidth=5 * 1024 * 1024, seed=2),
+    ],
+}
+
+# 流水线场景：同步整个合成整合包（分包按线路吞吐量分散到多条线路）
+# 各线路按线路整体限速（shared_bandwidth），多条线路同时下载时总吞吐量才会增加
+PIPELINE_SCENARIOS = {
+    "striped_one_mirror": {
+        "mirrors": [NetemProfile("mirror_a", latency=0.02, shared_bandwidth=40 * MB_TO_BYTES, seed=1)],
+        "pack": {"small_count": 0, "large_count": 1, "large_size_mb": 240},
+    },
+    "striped_two_mirrors": {
+        "mirrors": [NetemProfile("mirror_a", latency=0.02, shared_bandwidth=40 * MB_TO_BYTES, seed=1),
+                    NetemProfile("mirror_b", latency=0.05, shared_bandwidth=40 * MB_TO_BYTES, seed=2)],
+        "pack": {"small_count": 0, "large_count": 1, "large_size_mb": 240},
+    },
+    "striped_slow_third": {
+        "mirrors": [NetemProfile("mirror_a", latency=0.02, shared_bandwidth=40 * MB_TO_BYTES, seed=1),
+                    NetemProfile("mirror_b", latency=0.05, shared_bandwidth=40 * MB_TO_BYTES, seed=2),
+                    NetemProfile("slow", latency=0.1, shared_bandwidth=2 * MB_TO_BYTES, seed=3)],
+        "pack": {"small_count": 0, "large_count": 1, "large_size_mb": 240},
+    },
+    # 小Mod逐个请求与打包为bundle的对比（每个请求50ms延迟）
+    "small_unbundled": {
+        "mirrors": [NetemProfile("mirror_a", latency=0.05, shared_bandwidth=40 * MB_TO_BYTES, seed=1)],
+        "pack": {"small_count": 200, "small_size_kb": 200, "large_count": 0},
+    },
+    "small_bundled": {
+        "mirrors": [NetemProfile("mirror_a", latency=0.05, shared_bandwidth=40 * MB_TO_BYTES, seed=1)],
+        "pack": {"small_count": 200, "small_size_kb": 200, "large_count": 0},
+        "bundle": True,
+    },
+    # 外部下载地址：慢速源排在配置前面，按实测吞吐量排序后大部分文件应走快速源
+    "sources_ranked": {
+        "mirrors": [NetemProfile("mirror_a", latency=0.05, shared_bandwidth=10 * MB_TO_BYTES, seed=1)],
+        "sources": [(NetemProfile("cdn_slow", latency=0.1, shared_bandwidth=2 * MB_TO_BYTES, seed=2), 1.0),
+                    (NetemProfile("cdn_fast", latency=0.02, shared_bandwidth=60 * MB_TO_BYTES, seed=3), 1.0)],
+        "pack": {"small_count": 40, "small_size_kb": 2048, "large_count": 0},
+    },
+    # 外部下载地址部分缺失：快速源只有一半文件，另一个源全部404，缺失的文件逐个回退到线路
+    "sources_fallback": {
+        "mirrors": [NetemProfile("mirror_a", latency=0.05, shared_bandwidth=10 * MB_TO_BYTES, seed=1)],
+        "sources": [(NetemProfile("cdn_fast", latency=0.02, shared_bandwidth=60 * MB_TO_BYTES, seed=2), 0.5),
+                    (NetemProfile("cdn_404", latency=0.02, seed=3), 0.0)],
+        "pack": {"small_count": 40, "small_size_kb": 2048, "large_count": 0},
+    },
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="离线网络模拟：在localhost上模拟多条线路并测试线路选择和下载")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS) + sorted(PIPELINE_SCENARIOS), action="append",
+                        help="运行的场景（可多次指定，默认全部下载场景，指定--pipeline时默认全部流水线场景）")
+    parser.add_argument("--pipeline", action="store_true", help="运行流水线场景（同步整个合成整合包）")
+    parser.add_argument("--size-mb", type=float, default=8, help="测试文件大小MB（默认8）")
+    parser.add_argument("--hedged", action="store_true", help="使用对冲下载（首字节超时后同时请求下一条线路）")
+    parser.add_argument("--output", default=None, help="结果JSON路径（默认仅输出到控制台）")
+    args = parser.parse_args()
+
+    results = {}
+    for scenario in args.scenario or sorted(PIPELINE_SCENARIOS if args.pipeline else SCENARIOS):
+        if scenario in PIPELINE_SCENARIOS:
+            config = PIPELINE_SCENARIOS[scenario]
+            results[scenario] = run_pipeline_scenario(config["mirrors"], config["pack"],
+                                                      bundle=config.get("bundle", False),
+                                                      sources=config.get("sources"))
+        else:
+            results[scenario] = run_scenario(SCENARIOS[scenario], int(args.size_mb * 1024 * 1024),
+                                             hedged=args.hedged)
+        print(f"[信息] 场景 {scenario}：{json.dumps(results[scenario], ensure_ascii=False)}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=4)
+        print(f"[成功] 结果已写入：{args.output}")
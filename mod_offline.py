@@ -0,0 +1,287 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+from datetime import datetime
+
+from mod_pipeline import repo_relative_path
+from mod_trace import count, traced
+from mod_transaction import UpdateTransaction
+from mod_validate import VERSION_UPDATES, validate_mods
+from util import get_json_from_file
+
+root_dir = os.getcwd()  # 根目录
+# 导入时的工作目录（新配置文件和已校验的文件暂存于此，须与Mod目录在同一磁盘）
+offline_temp_dir = os.path.join(root_dir, "temp", "offline")
+# 离线包格式标识
+OFFLINE_FORMAT = "cmagic-offline/1"
+# 离线包中的成员名：说明、新配置文件、对象（文件名为内容哈希）
+HEADER_MEMBER = "offline.json"
+MANIFEST_MEMBER = "config/mod_info.json"
+OBJECT_PREFIX = "objects/"
+# 读写块大小（导入/导出的内存占用与离线包大小无关）
+BLOCK_SIZE = 1024 * 1024
+
+
+class _HashingReader:
+    """读取时同时计算哈希（导出时校验写入离线包的内容，不必预先多读一遍）"""
+
+    def __init__(self, f):
+        self.f = f
+        self.hash_obj = hashlib.md5()
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.hash_obj.update(data)
+        return data
+
+
+class _ChainedReader:
+    """依次读取多个文件（仓库中的分割文件按分包顺序读出原文件内容）"""
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.current = None
+
+    def read(self, size=-1):
+        chunks = []
+        while self.paths or self.current:
+            if self.current is None:
+                self.current = open(self.paths.pop(0), "rb")
+            data = self.current.read(size if size >= 0 else -1)
+            if data:
+                chunks.append(data)
+                if size >= 0:
+                    size -= len(data)
+                    if size == 0:
+                        break
+                continue
+            self.current.close()
+            self.current = None
+        return b"".join(chunks)
+
+    def close(self):
+        if self.current:
+            self.current.close()
+
+
+def changed_entries(old_manifest, new_manifest):
+    """
+    新配置中内容哈希不在旧配置里的Mod（每个哈希只取一项）
+    :param old_manifest: 旧配置文件内容（None表示全量）
+    :param new_manifest: 新配置文件内容
+    """
+    old_hashes = {entry["file_hash"] for entry in (old_manifest or {}).get("all_mod_files", [])}
+    changed, seen = [], set()
+    for entry in new_manifest["all_mod_files"]:
+        if entry["file_hash"] not in old_hashes and entry["file_hash"] not in seen:
+            seen.add(entry["file_hash"])
+            changed.append(entry)
+    return changed
+
+
+def _open_entry(entry, mod_dir=None, repo_dir=None):
+    """
+    打开Mod内容：优先取Mod目录中大小一致的同名文件，其次取仓库/发布目录中的文件（分割文件按分包顺序读取）
+    :return: 可读对象（内容在写入时校验）
+    """
+    if mod_dir:
+        path = os.path.join(mod_dir, entry["file_name"])
+        if os.path.isfile(path) and os.path.getsize(path) == entry["file_size_bytes"]:
+            return open(path, "rb")
+    if repo_dir:
+        def repo_path(rel):
+            return os.path.join(repo_dir, *repo_relative_path(rel).split("/"))
+        if entry.get("is_split") and entry.get("split_details"):
+            chunks = sorted(entry["split_details"]["chunks"], key=lambda c: c["chunk_index"])
+            return _ChainedReader([repo_path(c["chunk_path"]) for c in chunks])
+        if entry.get("bundle"):
+            f = open(repo_path(entry["bundle"]["bundle_path"]), "rb")
+            f.seek(entry["bundle"]["offset"])
+            return f
+        return open(repo_path(entry["file_path"]), "rb")
+    raise FileNotFoundError(f"找不到 {entry['file_name']} 的内容")
+
+
+def _add_bytes(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(datetime.now().timestamp())
+    tar.addfile(info, io.BytesIO(data))
+
+
+@traced("offline_export")
+def export_bundle(old_manifest_path, new_manifest_path, output_path, mod_dir=None, repo_dir=None, log=print):
+    """
+    导出离线包：只包含旧配置中没有的内容和新配置文件
+    格式为流式tar：offline.json（说明）→ config/mod_info.json（新配置）→ objects/<哈希>（各对象）
+    :param old_manifest_path: 旧配置文件路径（None表示全量导出）
+    :param new_manifest_path: 新配置文件路径
+    :param output_path: 离线包路径
+    :param mod_dir: 已更新到新版本的Mod目录（内容来源之一）
+    :param repo_dir: 仓库/发布目录（内容来源之一，按配置中的路径读取）
+    :param log: 日志输出函数
+    :return: 离线包说明字典
+    """
+    old_manifest = get_json_from_file(old_manifest_path) if old_manifest_path else None
+    new_manifest = get_json_from_file(new_manifest_path)
+    if new_manifest is None:
+        raise Exception(f"无法读取新配置文件：{new_manifest_path}")
+    entries = changed_entries(old_manifest, new_manifest)
+    header = {
+        "format": OFFLINE_FORMAT,
+        "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "from_split_time": (old_manifest or {}).get("split_time"),
+        "to_split_time": new_manifest.get("split_time"),
+        "objects": [{"hash": e["file_hash"], "size": e["file_size_bytes"], "file_name": e["file_name"]}
+                    for e in entries],
+    }
+
+    tmp_path = output_path + ".tmp"
+    try:
+        with tarfile.open(tmp_path, "w|") as tar:
+            _add_bytes(tar, HEADER_MEMBER, json.dumps(header, ensure_ascii=False, indent=4).encode("utf-8"))
+            with open(new_manifest_path, "rb") as f:
+                _add_bytes(tar, MANIFEST_MEMBER, f.read())
+            for entry in entries:
+                info = tarfile.TarInfo(OBJECT_PREFIX + entry["file_hash"])
+                info.size = entry["file_size_bytes"]
+                info.mtime = int(datetime.now().timestamp())
+                source = _open_entry(entry, mod_dir, repo_dir)
+                try:
+                    reader = _HashingReader(source)
+                    tar.addfile(info, reader)
+                finally:
+                    source.close()
+                if reader.hash_obj.hexdigest() != entry["file_hash"]:
+                    raise Exception(f"{entry['file_name']} 的内容与配置中的哈希不一致")
+        os.replace(tmp_path, output_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    total = sum(e["file_size_bytes"] for e in entries)
+    log(f"[成功] 离线包已导出：{output_path}（{len(entries)} 个对象，{total / 1024 / 1024:.1f}MB）")
+    return header
+
+
+def _stage_member(tar, member, expected_hash, expected_size, staged_path):
+    """边读边写入暂存文件并校验哈希和大小（不把对象整体读入内存）"""
+    hash_obj = hashlib.md5()
+    size = 0
+    src = tar.extractfile(member)
+    with open(staged_path, "wb") as out:
+        while data := src.read(BLOCK_SIZE):
+            out.write(data)
+            hash_obj.update(data)
+            size += len(data)
+    count("offline_bytes", size)
+    return size == expected_size and hash_obj.hexdigest() == expected_hash
+
+
+@traced("offline_import")
+def import_bundle(bundle_path, local_mod_dir, mod_info_path, log=print):
+    """
+    导入离线包：按顺序读取离线包（不预先解包），只暂存本地缺少的对象并逐个校验哈希，
+    确认新版本需要的文件都已齐全后，通过事务应用到Mod目录并替换本地配置文件
+    :param bundle_path: 离线包路径
+    :param local_mod_dir: 本地Mod目录
+    :param mod_info_path: 本地配置文件路径
+    :param log: 日志输出函数
+    :return: 成功返回True
+    """
+    work_dir = offline_temp_dir
+    apply_dir = os.path.join(work_dir, "apply")
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(apply_dir, exist_ok=True)
+    os.makedirs(local_mod_dir, exist_ok=True)
+    manifest_path = os.path.join(work_dir, "mod_info.json")
+
+    header, manifest, result, needed, staged = None, None, None, {}, set()
+    with tarfile.open(bundle_path, "r|") as tar:
+        for member in tar:
+            if member.name == HEADER_MEMBER:
+                header = json.loads(tar.extractfile(member).read().decode("utf-8"))
+                if header.get("format") != OFFLINE_FORMAT:
+                    raise Exception(f"不支持的离线包格式：{header.get('format')}")
+                log(f"[信息] 离线包：{header.get('from_split_time') or '全量'} → {header['to_split_time']}，"
+                    f"{len(header['objects'])} 个对象")
+            elif member.name == MANIFEST_MEMBER:
+                with open(manifest_path, "wb") as out:
+                    shutil.copyfileobj(tar.extractfile(member), out, BLOCK_SIZE)
+                manifest = get_json_from_file(manifest_path)
+                # 先确认本地缺少哪些文件，离线包中本地已有的对象直接跳过
+                result = validate_mods(manifest_path, local_mod_dir, quick=True)
+                names = result.files_to_sync()
+                for entry in manifest["all_mod_files"]:
+                    if entry["file_name"] in names:
+                        needed.setdefault(entry["file_hash"], []).append(entry)
+            elif member.name.startswith(OBJECT_PREFIX):
+                if manifest is None:
+                    raise Exception("离线包格式错误：对象出现在配置文件之前")
+                content_hash = member.name[len(OBJECT_PREFIX):]
+                entries = needed.get(content_hash)
+                if not entries:
+                    continue
+                first_path = os.path.join(apply_dir, entries[0]["file_name"])
+                if not _stage_member(tar, member, content_hash, entries[0]["file_size_bytes"], first_path):
+                    raise Exception(f"{entries[0]['file_name']} 校验失败，离线包已损坏")
+                for entry in entries[1:]:
+                    shutil.copyfile(first_path, os.path.join(apply_dir, entry["file_name"]))
+                staged.add(content_hash)
+
+    if header is None or manifest is None:
+        raise Exception("离线包格式错误：缺少说明或配置文件")
+    missing = [entries[0]["file_name"] for content_hash, entries in needed.items() if content_hash not in staged]
+    if missing:
+        log(f"[错误] 离线包中缺少 {len(missing)} 个本地没有的文件（离线包的起始版本与本地不一致）：{missing[:5]}")
+        return False
+
+    transaction = UpdateTransaction()
+    for entries in needed.values():
+        for entry in entries:
+            transaction.add_file(os.path.join(apply_dir, entry["file_name"]),
+                                 os.path.join(local_mod_dir, entry["file_name"]), entry["file_size_bytes"])
+    synced = {entry["file_name"] for entries in needed.values() for entry in entries}
+    for issue in result.of_kind(VERSION_UPDATES):
+        if issue.file_name in synced:
+            for old_file in issue.old_files:
+                transaction.remove_file(old_file["file_path"])
+    transaction.set_manifest(manifest_path, mod_info_path)
+    if not transaction.commit(log=log):
+        return False
+    shutil.rmtree(work_dir, ignore_errors=True)
+    log(f"[成功] 离线更新完成：{len(synced)} 个mod文件，版本 {manifest.get('split_time')}")
+    if manifest.get("tree"):
+        log(f"[信息] 离线包不包含目录树（config等目录），下次联网更新时同步")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="离线更新：在两个版本的配置文件之间导出/导入增量离线包")
+    sub = parser.add_subparsers(dest="command")
+    export_parser = sub.add_parser("export", help="导出离线包（只包含新版本中变化的内容和新配置文件）")
+    export_parser.add_argument("new_manifest", help="新配置文件路径")
+    export_parser.add_argument("output", help="离线包输出路径")
+    export_parser.add_argument("--old", default=None, help="旧配置文件路径（默认全量导出）")
+    export_parser.add_argument("--mod-dir", default=None, help="已更新到新版本的Mod目录")
+    export_parser.add_argument("--repo", default=None, help="仓库/发布目录（按配置中的路径读取内容）")
+    import_parser = sub.add_parser("import", help="导入离线包并应用到本地")
+    import_parser.add_argument("bundle", help="离线包路径")
+    import_parser.add_argument("--mod-dir", default=os.path.join(".minecraft", "versions", "CMagic_client", "mods"),
+                               help="本地Mod目录")
+    import_parser.add_argument("--mod-info", default=os.path.join("config", "mod_info.json"), help="本地配置文件路径")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        if not args.mod_dir and not args.repo:
+            print("[错误] 需要指定--mod-dir或--repo作为内容来源")
+        else:
+            export_bundle(args.old, args.new_manifest, args.output, mod_dir=args.mod_dir, repo_dir=args.repo)
+    elif args.command == "import":
+        import_bundle(args.bundle, args.mod_dir, args.mod_info)
+    else:
+        parser.print_help()
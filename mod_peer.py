@@ -0,0 +1,308 @@
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import requests
+
+from mod_download import NO_PROXIES
+from mod_trace import count
+from util import calculate_quick_fingerprint, get_json_from_file, parse_range_header
+
+# 局域网共享开关环境变量（值为1时与局域网内其他客户端互相提供已校验的Mod内容）
+PEER_ENV_VAR = "CMAGIC_PEER"
+# 发现消息使用的UDP端口（所有客户端相同）
+DISCOVERY_PORT = 37021
+# 发现消息标识（忽略同端口上的其他广播）
+DISCOVERY_MAGIC = "cmagic-peer/1"
+# 广播地址（本机多客户端测试时使用127.255.255.255）
+BROADCAST_ADDR = "255.255.255.255"
+# 定期广播间隔（秒）
+ANNOUNCE_INTERVAL = 10
+# 超过该时间未收到广播的客户端视为离线（秒）
+PEER_TIMEOUT = ANNOUNCE_INTERVAL * 3
+# 同步前等待其他客户端应答的时间（秒）
+DISCOVERY_WAIT = 1.0
+# 向其他客户端请求内容列表的超时（秒）
+PEER_HTTP_TIMEOUT = 3
+
+
+def manifest_objects(mod_info, local_mod_dir):
+    """
+    按配置文件列出本地已有的内容：完整Mod以file_hash提供，分割文件的各分包以chunk_hash提供（文件中的区间）
+    只共享大小和快速指纹都与配置一致的文件（请求方仍会按哈希校验下载的每一块）
+    :param mod_info: 配置文件内容
+    :param local_mod_dir: 本地Mod目录
+    :return: 字典{哈希: (文件路径, 偏移, 字节数)}
+    """
+    objects = {}
+    for entry in (mod_info or {}).get("all_mod_files", []):
+        path = os.path.join(local_mod_dir, entry["file_name"])
+        try:
+            if os.path.getsize(path) != entry["file_size_bytes"]:
+                continue
+            if entry.get("quick_fingerprint") and calculate_quick_fingerprint(path) != entry["quick_fingerprint"]:
+                continue
+        except OSError:
+            continue
+        objects[entry["file_hash"]] = (path, 0, entry["file_size_bytes"])
+        if entry.get("is_split") and entry.get("split_details"):
+            offset = 0
+            for chunk in entry["split_details"]["chunks"]:
+                objects[chunk["chunk_hash"]] = (path, offset, chunk["chunk_size_bytes"])
+                offset += chunk["chunk_size_bytes"]
+    return objects
+
+
+class _PeerHandler(BaseHTTPRequestHandler):
+    """
+    内容服务：GET /have 返回已有的哈希列表，GET /objects/<哈希> 返回对应内容（支持Range）
+    只提供共享表中的内容，请求路径不会映射到任意文件
+    """
+
+    protocol_version = "HTTP/1.1"
+    server_version = "CMagicPeer/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/have":
+            body = json.dumps(self.server.node.hashes()).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        obj = self.server.node.lookup(path[len("/objects/"):]) if path.startswith("/objects/") else None
+        if obj is None:
+            self._send_empty(404)
+            return
+        file_path, offset, size = obj
+        try:
+            f = open(file_path, "rb")
+        except OSError:
+            self._send_empty(404)
+            return
+        with f:
+            if os.fstat(f.fileno()).st_size < offset + size:
+                self._send_empty(404)
+                return
+            start, end, status = 0, size - 1, 200
+            byte_range = parse_range_header(self.headers.get("Range"), size)
+            if byte_range == (-1, -1):
+                self._send_empty(416, [("Content-Range", f"bytes */{size}")])
+                return
+            if byte_range:
+                start, end = byte_range
+                status = 206
+            length = end - start + 1
+            self.send_response(status)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(length))
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.end_headers()
+            self.wfile.flush()
+            try:
+                self.connection.sendfile(f, offset=offset + start, count=length)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+                return
+            count("peer_bytes_served", length)
+
+    def _send_empty(self, status, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class PeerNode:
+    """
+    局域网共享节点：UDP广播发现其他客户端，HTTP提供本机已校验的内容
+    其他客户端按配置中的哈希请求内容，下载后逐块校验哈希，取不到或校验失败时回退到mod_info_urls线路
+    """
+
+    def __init__(self, host="0.0.0.0", http_port=0, discovery_port=DISCOVERY_PORT, broadcast_addr=BROADCAST_ADDR,
+                 announce_interval=ANNOUNCE_INTERVAL, log=print):
+        """
+        :param host: HTTP监听地址
+        :param http_port: HTTP端口（0为随机端口，端口号随广播发送）
+        :param discovery_port: 发现消息UDP端口
+        :param broadcast_addr: 广播地址（本机测试使用127.255.255.255）
+        :param announce_interval: 定期广播间隔（秒）
+        :param log: 日志输出函数
+        """
+        self.node_id = uuid.uuid4().hex
+        self.discovery_port = discovery_port
+        self.broadcast_addr = broadcast_addr
+        self.announce_interval = announce_interval
+        self.log = log
+        self._objects = {}
+        self._rev = 0
+        self._peers = {}  # 节点ID -> {"base_url", "rev", "hashes", "seen"}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+        self.httpd = ThreadingHTTPServer((host, http_port), _PeerHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.node = self
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # 同一台机器上的多个客户端共用发现端口（均能收到广播）
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.sock.bind(("", discovery_port))
+        self.sock.settimeout(0.5)
+
+    @property
+    def http_port(self):
+        return self.httpd.server_address[1]
+
+    # ---------- 本机共享的内容 ----------
+    def share(self, objects):
+        """
+        设置本机共享的内容并广播
+        :param objects: 字典{哈希: (文件路径, 偏移, 字节数)}（见manifest_objects）
+        """
+        with self._lock:
+            self._objects = dict(objects)
+            self._rev += 1
+        self._send("announce")
+
+    def share_manifest(self, mod_info_path, local_mod_dir):
+        """按本地配置文件共享本地Mod目录中的内容"""
+        self.share(manifest_objects(get_json_from_file(mod_info_path), local_mod_dir))
+
+    def hashes(self):
+        with self._lock:
+            return list(self._objects)
+
+    def lookup(self, content_hash):
+        with self._lock:
+            return self._objects.get(content_hash)
+
+    # ---------- 其他客户端 ----------
+    def object_urls(self, content_hash):
+        """
+        返回拥有该内容的在线客户端的下载地址
+        :param content_hash: 配置文件中的file_hash或chunk_hash
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [peer["base_url"] + "objects/" + content_hash for peer in self._peers.values()
+                    if now - peer["seen"] <= PEER_TIMEOUT and content_hash in peer["hashes"]]
+
+    def has(self, content_hash):
+        return bool(self.object_urls(content_hash))
+
+    def peer_count(self):
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for peer in self._peers.values() if now - peer["seen"] <= PEER_TIMEOUT)
+
+    def discover(self, wait=DISCOVERY_WAIT):
+        """广播查询并等待其他客户端应答（同步开始前调用）"""
+        self._send("query")
+        time.sleep(wait)
+        return self.peer_count()
+
+    # ---------- 发现协议 ----------
+    def _send(self, msg_type):
+        with self._lock:
+            message = {"magic": DISCOVERY_MAGIC, "type": msg_type, "id": self.node_id, "port": self.http_port,
+                       "rev": self._rev, "count": len(self._objects)}
+        try:
+            self.sock.sendto(json.dumps(message).encode("utf-8"), (self.broadcast_addr, self.discovery_port))
+        except OSError as e:
+            self.log(f"[警告] 局域网广播失败：{str(e)}")
+
+    def _listen(self):
+        while not self._stop.is_set():
+            try:
+                data, addr = self.sock.recvfrom(65535)
+                message = json.loads(data.decode("utf-8"))
+            except socket.timeout:
+                continue
+            except (OSError, ValueError):
+                if self._stop.is_set():
+                    return
+                continue
+            if not isinstance(message, dict) or message.get("magic") != DISCOVERY_MAGIC \
+                    or message.get("id") == self.node_id:
+                continue
+            if message.get("type") == "query":
+                self._send("announce")
+            self._update_peer(message, addr[0])
+
+    def _update_peer(self, message, address):
+        """记录其他客户端；内容版本变化时通过HTTP获取其内容列表（广播只携带版本号，避免超出UDP报文大小）"""
+        peer_id = message["id"]
+        base_url = f"http://{address}:{int(message['port'])}/"
+        with self._lock:
+            peer = self._peers.setdefault(peer_id, {"base_url": base_url, "rev": None, "hashes": set()})
+            peer["base_url"] = base_url
+            peer["seen"] = time.monotonic()
+            if peer["rev"] == message.get("rev"):
+                return
+        hashes = set()
+        if message.get("count"):
+            try:
+                response = requests.get(base_url + "have", timeout=PEER_HTTP_TIMEOUT, proxies=NO_PROXIES)
+                response.raise_for_status()
+                hashes = set(response.json())
+            except (requests.RequestException, ValueError) as e:
+                self.log(f"[警告] 获取局域网客户端 {address} 的内容列表失败：{str(e)}")
+                return
+        with self._lock:
+            peer["hashes"] = hashes
+            peer["rev"] = message.get("rev")
+
+    def _announce_loop(self):
+        while not self._stop.wait(self.announce_interval):
+            self._send("announce")
+
+    # ---------- 启动与停止 ----------
+    def start(self):
+        """后台运行HTTP服务、监听和定期广播"""
+        for target in (self.httpd.serve_forever, self._listen, self._announce_loop):
+            thread = threading.Thread(target=target, name="PeerNode", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._send("query")
+        self._send("announce")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="局域网共享：向同一局域网内的其他客户端提供本机已有的Mod内容")
+    parser.add_argument("--mod-info", default=os.path.join("config", "mod_info.json"), help="本地配置文件路径")
+    parser.add_argument("--mod-dir", default=os.path.join(".minecraft", "versions", "CMagic_client", "mods"),
+                        help="本地Mod目录")
+    parser.add_argument("--broadcast", default=BROADCAST_ADDR, help=f"广播地址（默认{BROADCAST_ADDR}，本机测试用127.255.255.255）")
+    args = parser.parse_args()
+
+    node = PeerNode(broadcast_addr=args.broadcast).start()
+    node.share_manifest(args.mod_info, args.mod_dir)
+    print(f"[信息] 局域网共享已启动：端口 {node.http_port}，共享 {len(node.hashes())} 项内容")
+    try:
+        while True:
+            time.sleep(ANNOUNCE_INTERVAL)
+            print(f"[信息] 在线客户端 {node.peer_count()} 个")
+    except KeyboardInterrupt:
+        node.stop()
@@ -0,0 +1,484 @@
+import hashlib
+import os
+import queue
+import shutil
+import threading
+from contextlib import nullcontext
+from urllib.parse import quote
+
+from mod_download import download_file
+from mod_mirror import MirrorPool
+from mod_scheduler import FOREGROUND
+from mod_trace import bind, count, span, traced
+from mod_unsplit import restore_split_file
+from mod_validate import ValidationResult
+from util import calculate_file_hash
+
+# 配置文件在仓库中的相对路径（线路地址去掉该后缀即为仓库根地址）
+MANIFEST_REL_PATH = "config/mod_info.json"
+# 默认的配置文件下载地址（main.py的mod_info_urls和mod_prefetch命令行共用）
+DEFAULT_MOD_INFO_URLS = [
+    "https://gh-proxy.org/https://github.com/baimianxiao/Test_client/blob/master/config/mod_info.json",
+]
+# 下载并发数
+DOWNLOAD_WORKERS = 4
+# 阶段之间队列的容量（下载过快时阻塞，避免临时目录堆积）
+STAGE_QUEUE_SIZE = 8
+# 单个文件/分包校验失败后的最大重试次数（每次换一条线路）
+MAX_RETRIES = 2
+# bundle中需要的成员间隔不超过该字节数时合并为一次区间请求
+BUNDLE_RANGE_GAP = 256 * 1024
+# 需要下载的区间总量达到bundle大小的该比例时直接下载整个bundle
+BUNDLE_WHOLE_RATIO = 0.75
+
+
+def mirror_base_urls(manifest_urls, manifest_rel_path=MANIFEST_REL_PATH):
+    """
+    由配置文件下载地址推导各线路的仓库根地址
+    :param manifest_urls: 配置文件下载地址列表（如mod_info_urls）
+    :param manifest_rel_path: 配置文件在仓库中的相对路径
+    :return: 仓库根地址列表（以/结尾）
+    """
+    bases = []
+    for url in manifest_urls:
+        if url.endswith(manifest_rel_path):
+            bases.append(url[:-len(manifest_rel_path)])
+    return bases
+
+
+def repo_relative_path(path):
+    """将配置中记录的路径（mod_split运行时的相对路径）转为URL使用的仓库相对路径"""
+    path = path.replace("\\", "/")
+    while path.startswith("./"):
+        path = path[2:]
+    return path.lstrip("/")
+
+
+def build_file_urls(base_urls, rel_path):
+    """
+    拼接文件在各线路上的下载地址
+    :param base_urls: 仓库根地址列表
+    :param rel_path: 文件在仓库中的相对路径
+    :return: 下载地址列表（与base_urls顺序一致）
+    """
+    quoted = quote(repo_relative_path(rel_path))
+    return [base + quoted for base in base_urls]
+
+
+class SyncPipeline:
+    """
+    Mod同步流水线：下载 → 校验 → 组装放置 三个阶段并发执行
+    阶段之间使用有界队列衔接，磁盘校验/拼接时网络仍在下载后续文件
+    分割文件的各分包按线路吞吐量分散到多条线路同时下载；打包进bundle的小Mod按bundle（或区间）批量下载
+    传入peers时优先从局域网内其他客户端获取内容（按哈希校验），取不到再走线路
+    配置项带有sources（外部下载地址）时优先从外部地址下载（多个外部地址按实测吞吐量排序），单个文件失败时回退到线路
+    """
+
+    def __init__(self, base_urls, target_dir, staging_dir, log=print, download_workers=DOWNLOAD_WORKERS,
+                 queue_size=STAGE_QUEUE_SIZE, mirror_pool=None, scheduler=None, priority=FOREGROUND, peers=None):
+        """
+        :param base_urls: 仓库根地址列表（按优先级排列）
+        :param target_dir: Mod放置目录（即local_mod_dir）
+        :param staging_dir: 临时目录（下载的文件和分包先存放于此）
+        :param log: 日志输出函数
+        :param download_workers: 下载并发数
+        :param queue_size: 阶段间队列容量
+        :param mirror_pool: 线路状态表（对冲下载与熔断，默认按base_urls新建）
+        :param scheduler: 传输调度器（限速、并发和优先级，默认不限制）
+        :param priority: 本次同步的传输优先级（FOREGROUND/BACKGROUND）
+        :param peers: 可选的mod_peer.PeerNode（局域网共享）
+        """
+        self.base_urls = list(base_urls)
+        self.mirror_pool = mirror_pool or MirrorPool(self.base_urls)
+        self.scheduler = scheduler
+        self.priority = priority
+        self.peers = peers
+        self.target_dir = target_dir
+        self.staging_dir = staging_dir
+        self.parts_dir = os.path.join(staging_dir, "parts")
+        self.files_dir = os.path.join(staging_dir, "files")
+        self.log = log
+        self.download_workers = download_workers
+
+        self.download_queue = queue.Queue()
+        self.verify_queue = queue.Queue(maxsize=queue_size)
+        self.assemble_queue = queue.Queue(maxsize=queue_size)
+
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._pending = 0
+        self._chunks_ready = {}  # 文件名 -> 已校验的分包数
+        self.succeeded = []
+        self.failed = []
+
+    # ---------- 对外接口 ----------
+    @traced("sync_pipeline")
+    def run(self, mod_entries):
+        """
+        同步一批Mod
+        :param mod_entries: 配置文件中的Mod信息列表（all_mod_files中的项）
+        :return: (成功的文件名列表, 失败的文件名列表)
+        """
+        os.makedirs(self.parts_dir, exist_ok=True)
+        os.makedirs(self.files_dir, exist_ok=True)
+        os.makedirs(self.target_dir, exist_ok=True)
+        if not mod_entries:
+            return [], []
+
+        self._pending = len(mod_entries)
+        bundled = {}
+        for entry in mod_entries:
+            if entry.get("is_split") and not (entry.get("split_details") or {}).get("chunks"):
+                # 分割信息不完整的文件无法下载，直接记为失败（否则没有任务完成它，run会一直等待）
+                self.log(f"❌ {entry['file_name']} 的分包信息缺失")
+                self._finish(entry, False)
+                continue
+            if self.peers is not None and self.peers.has(entry["file_hash"]):
+                # 局域网内有完整文件：整个文件从其他客户端获取，失败时再按线路拆分任务
+                self.download_queue.put(self._peer_job(entry))
+                continue
+            if entry.get("bundle") and not entry.get("sources"):
+                bundled.setdefault(entry["bundle"]["bundle_name"], []).append(entry)
+                continue
+            for job in self._build_jobs(entry):
+                self.download_queue.put(job)
+        for members in bundled.values():
+            for job in self._build_bundle_jobs(members):
+                self.download_queue.put(job)
+
+        threads = [threading.Thread(target=bind(self._download_worker), daemon=True) for _ in range(self.download_workers)]
+        threads.append(threading.Thread(target=bind(self._verify_worker), daemon=True))
+        threads.append(threading.Thread(target=bind(self._assemble_worker), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        self._done.wait()
+        for _ in range(self.download_workers):
+            self.download_queue.put(None)
+        self.verify_queue.put(None)
+        self.assemble_queue.put(None)
+        for thread in threads:
+            thread.join()
+        return list(self.succeeded), list(self.failed)
+
+    # ---------- 任务构造 ----------
+    def _build_jobs(self, entry):
+        """将单个Mod拆成下载任务（未分割文件1个任务，分割文件每个分包1个任务）"""
+        if entry.get("is_split") and entry.get("split_details"):
+            self._chunks_ready[entry["file_name"]] = 0
+            return [{
+                "entry": entry,
+                "rel_path": chunk["chunk_path"],
+                "dest": os.path.join(self.parts_dir, chunk["chunk_name"]),
+                "size": chunk["chunk_size_bytes"],
+                "hash": chunk["chunk_hash"],
+                "attempt": 0,
+                "striped": True,
+            } for chunk in entry["split_details"]["chunks"]]
+        if entry.get("sources"):
+            # 外部下载地址只提供原文件，不使用传输压缩版本
+            return [{
+                "entry": entry,
+                "rel_path": entry["file_path"],
+                "sources": entry["sources"],
+                "dest": os.path.join(self.files_dir, entry["file_name"]),
+                "size": entry["file_size_bytes"],
+                "hash": entry["file_hash"],
+                "attempt": 0,
+                "striped": False,
+            }]
+        if entry.get("transport"):
+            # 传输压缩版本：边下载边解压，下载时已校验压缩前后的哈希，校验阶段不再读取文件
+            transport = entry["transport"]
+            return [{
+                "entry": entry,
+                "rel_path": transport["path"],
+                "dest": os.path.join(self.files_dir, entry["file_name"]),
+                "size": transport["size_bytes"],
+                "hash": transport["hash"],
+                "codec": transport["codec"],
+                "attempt": 0,
+                "striped": False,
+            }]
+        return [{
+            "entry": entry,
+            "rel_path": entry["file_path"],
+            "dest": os.path.join(self.files_dir, entry["file_name"]),
+            "size": entry["file_size_bytes"],
+            "hash": entry["file_hash"],
+            "attempt": 0,
+            "striped": False,
+        }]
+
+    def _peer_job(self, entry):
+        """整个文件从局域网获取的任务"""
+        return {
+            "entry": entry,
+            "rel_path": None,
+            "dest": os.path.join(self.files_dir, entry["file_name"]),
+            "size": entry["file_size_bytes"],
+            "hash": entry["file_hash"],
+            "attempt": 0,
+            "striped": False,
+            "peer": True,
+        }
+
+    def _mirror_jobs(self, entry):
+        """局域网获取失败后改走线路的任务"""
+        if entry.get("bundle") and not entry.get("sources"):
+            return self._build_bundle_jobs([entry])
+        return self._build_jobs(entry)
+
+    def _build_bundle_jobs(self, members):
+        """
+        将同一bundle中需要的Mod合并为下载任务：
+        需要的成员按偏移排序，间隔较小的合并为一个区间；区间总量接近整个bundle时直接下载整个bundle
+        """
+        bundle = members[0]["bundle"]
+        members = sorted(members, key=lambda e: e["bundle"]["offset"])
+        runs = []
+        for entry in members:
+            start = entry["bundle"]["offset"]
+            end = start + entry["file_size_bytes"] - 1
+            if runs and start - runs[-1]["end"] - 1 <= BUNDLE_RANGE_GAP:
+                runs[-1]["end"] = max(runs[-1]["end"], end)
+                runs[-1]["members"].append(entry)
+            else:
+                runs.append({"start": start, "end": end, "members": [entry]})
+
+        fetch_bytes = sum(run["end"] - run["start"] + 1 for run in runs)
+        if fetch_bytes >= bundle["bundle_size_bytes"] * BUNDLE_WHOLE_RATIO:
+            runs = [{"start": 0, "end": bundle["bundle_size_bytes"] - 1, "members": members, "whole": True}]
+
+        jobs = []
+        for run in runs:
+            jobs.append({
+                "entry": run["members"][0],
+                "members": run["members"],
+                "rel_path": bundle["bundle_path"],
+                "dest": os.path.join(self.parts_dir, f"{bundle['bundle_name']}.{run['start']}"),
+                "size": run["end"] - run["start"] + 1,
+                "hash": None,  # 区间无整体哈希，解包前逐个校验成员
+                "range": None if run.get("whole") else (run["start"], run["end"]),
+                "offset": run["start"],
+                "attempt": 0,
+                "striped": True,
+            })
+        return jobs
+
+    @staticmethod
+    def _job_entries(job):
+        """任务涉及的Mod（bundle任务可能包含多个Mod）"""
+        return job.get("members") or [job["entry"]]
+
+    def _job_urls(self, job):
+        """
+        确定任务的线路顺序：分包按各线路吞吐量和当前负载分散（同一文件的不同分包并行走不同线路），
+        未分割文件保持测速顺序；带外部地址的文件先按实测吞吐量使用各外部地址，线路只作为回退；
+        重试时再按重试次数轮换，优先使用其他线路
+        """
+        urls = build_file_urls(self.base_urls, job["rel_path"])
+        if job["striped"]:
+            urls = self.mirror_pool.rank(urls)
+        if job.get("sources"):
+            urls = self.mirror_pool.rank(job["sources"]) + urls
+        shift = job["attempt"] % len(urls) if urls else 0
+        return urls[shift:] + urls[:shift]
+
+    # ---------- 状态管理 ----------
+    def _is_failed(self, entry):
+        with self._lock:
+            return entry["file_name"] in self.failed
+
+    def _finish(self, entry, success):
+        """记录单个Mod的最终结果，全部完成时通知run返回"""
+        with self._lock:
+            name = entry["file_name"]
+            if name in self.failed or name in self.succeeded:
+                return
+            (self.succeeded if success else self.failed).append(name)
+            self._pending -= 1
+            if self._pending == 0:
+                self._done.set()
+        if success:
+            self.log(f"✅ 已同步 {name}")
+        else:
+            self.log(f"❌ 同步失败 {name}")
+
+    def _retry_or_fail(self, job, reason):
+        """校验失败时换线路重试，超过次数则整个Mod失败"""
+        if os.path.exists(job["dest"]):
+            os.remove(job["dest"])
+        if job["attempt"] < MAX_RETRIES:
+            self.log(f"🔄 {os.path.basename(job['dest'])} {reason}，更换线路重试")
+            self.download_queue.put(dict(job, attempt=job["attempt"] + 1))
+        else:
+            for entry in self._job_entries(job):
+                self._finish(entry, False)
+
+    def _fail_job(self, job, stage, error):
+        """任务处理中出现意外异常时，任务涉及的Mod全部记为失败（工作线程继续处理后续任务）"""
+        self.log(f"❌ {stage} {os.path.basename(job['dest'])} 失败：{str(error)}")
+        for entry in self._job_entries(job):
+            self._finish(entry, False)
+
+    # ---------- 各阶段 ----------
+    def _download_worker(self):
+        while True:
+            job = self.download_queue.get()
+            if job is None:
+                return
+            if self._is_failed(job["entry"]):
+                continue
+            try:
+                self._download_job(job)
+            except Exception as e:
+                self._fail_job(job, "下载", e)
+
+    def _download_job(self, job):
+        if self._download_from_peers(job):
+            self.verify_queue.put(job)
+            return
+        if job.get("peer"):
+            for mirror_job in self._mirror_jobs(job["entry"]):
+                self.download_queue.put(mirror_job)
+            return
+        slot = self.scheduler.slot(self.priority) if self.scheduler else nullcontext()
+        transport = {}
+        if job.get("codec"):
+            transport = {"expected_hash": job["hash"], "codec": job["codec"],
+                         "decoded_size": job["entry"]["file_size_bytes"],
+                         "decoded_hash": job["entry"]["file_hash"]}
+        with slot, span("pipeline_download", file=os.path.basename(job["dest"])):
+            ok = download_file(self._job_urls(job), job["dest"], log=self.log, expected_size=job["size"],
+                               mirror_pool=self.mirror_pool, byte_range=job.get("range"),
+                               scheduler=self.scheduler, priority=self.priority, **transport)
+        if ok:
+            self.verify_queue.put(job)
+        else:
+            for entry in self._job_entries(job):
+                self._finish(entry, False)
+
+    def _download_from_peers(self, job):
+        """
+        从局域网内拥有该内容的客户端下载（下载时即按配置中的哈希校验，不经过限速和线路统计）
+        区间任务（bundle）和传输压缩任务没有对应的内容哈希，不从局域网获取
+        :return: 成功返回True
+        """
+        if self.peers is None or job.get("range") or job.get("codec") or not job.get("hash"):
+            return False
+        urls = self.peers.object_urls(job["hash"])
+        if not urls:
+            return False
+        with span("peer_download", file=os.path.basename(job["dest"])):
+            ok = download_file(urls, job["dest"], log=lambda msg: None, expected_size=job["size"],
+                               expected_hash=job["hash"])
+        if ok:
+            job["verified"] = True
+            count("peer_bytes", job["size"])
+        return ok
+
+    def _verify_worker(self):
+        while True:
+            job = self.verify_queue.get()
+            if job is None:
+                return
+            if self._is_failed(job["entry"]):
+                continue
+            try:
+                with span("pipeline_verify", file=os.path.basename(job["dest"])):
+                    if "members" in job:
+                        verified = self._verify_bundle_members(job)
+                    elif job.get("codec") or job.get("verified"):
+                        verified = True  # 下载时已校验
+                    else:
+                        verified = calculate_file_hash(job["dest"]) == job["hash"]
+                if not verified:
+                    self._retry_or_fail(job, "哈希不匹配")
+                    continue
+            except Exception as e:
+                self._fail_job(job, "校验", e)
+                continue
+            self.assemble_queue.put(job)
+
+    def _assemble_worker(self):
+        while True:
+            job = self.assemble_queue.get()
+            if job is None:
+                return
+            entry = job["entry"]
+            if self._is_failed(entry):
+                continue
+            try:
+                with span("pipeline_assemble", file=entry["file_name"]):
+                    if "members" in job:
+                        self._unpack_bundle(job)
+                    elif entry["file_name"] in self._chunks_ready:
+                        self._chunks_ready[entry["file_name"]] += 1
+                        if self._chunks_ready[entry["file_name"]] == len(entry["split_details"]["chunks"]):
+                            self._finish(entry, self._assemble_split(entry))
+                    else:
+                        self._place(job["dest"], entry["file_name"])
+                        self._finish(entry, True)
+            except Exception as e:
+                self._fail_job(job, "放置", e)
+
+    def _assemble_split(self, entry):
+        """拼接已校验的分包（拼接结果先放在临时目录，校验通过后再移入目标目录）"""
+        assembled_path = os.path.join(self.files_dir, entry["file_name"])
+        if os.path.exists(assembled_path):
+            os.remove(assembled_path)
+        if not restore_split_file(entry, self.files_dir, chunk_dir=self.parts_dir, verify_chunks=False):
+            return False
+        for chunk in entry["split_details"]["chunks"]:
+            chunk_path = os.path.join(self.parts_dir, chunk["chunk_name"])
+            if os.path.exists(chunk_path):
+                os.remove(chunk_path)
+        self._place(assembled_path, entry["file_name"])
+        return True
+
+    def _verify_bundle_members(self, job):
+        """逐个校验bundle区间中各成员的哈希"""
+        with open(job["dest"], "rb") as f:
+            for entry in job["members"]:
+                f.seek(entry["bundle"]["offset"] - job["offset"])
+                data = f.read(entry["file_size_bytes"])
+                if len(data) != entry["file_size_bytes"] or hashlib.md5(data).hexdigest() != entry["file_hash"]:
+                    return False
+        return True
+
+    def _unpack_bundle(self, job):
+        """从已校验的bundle区间中取出各成员，直接写入临时目录后放置"""
+        with open(job["dest"], "rb") as f:
+            for entry in job["members"]:
+                f.seek(entry["bundle"]["offset"] - job["offset"])
+                staged_path = os.path.join(self.files_dir, entry["file_name"])
+                with open(staged_path, "wb") as out:
+                    out.write(f.read(entry["file_size_bytes"]))
+                self._place(staged_path, entry["file_name"])
+                self._finish(entry, True)
+        os.remove(job["dest"])
+
+    def _place(self, staged_path, file_name):
+        """将临时目录中的文件移入目标目录（同一磁盘时为原子替换）"""
+        target_path = os.path.join(self.target_dir, file_name)
+        try:
+            os.replace(staged_path, target_path)
+        except OSError:
+            shutil.move(staged_path, target_path)
+
+
+def select_entries_to_sync(mod_config, inconsistent_mods):
+    """
+    从校验结果中挑出需要下载的Mod（缺失、版本升级、大小/哈希不匹配）
+    :param mod_config: 配置文件内容
+    :param inconsistent_mods: validate_mods返回的ValidationResult（或validate_mods_with_config返回的不一致项）
+    :return: 配置文件中对应的Mod信息列表
+    """
+    if isinstance(inconsistent_mods, ValidationResult):
+        names = inconsistent_mods.files_to_sync()
+    else:
+        names = set()
+        for key in ("missing_files", "version_updates", "size_mismatch", "hash_mismatch"):
+            names.update(item["file_name"] for item in inconsistent_mods.get(key, []))
+    return [entry for entry in mod_config["all_mod_files"] if entry["file_name"] in names]
@@ -0,0 +1,232 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import threading
+from contextlib import nullcontext
+from datetime import datetime
+
+from mod_download import download_file
+from mod_mirror import MirrorPool
+from mod_pipeline import DEFAULT_MOD_INFO_URLS, SyncPipeline, mirror_base_urls, select_entries_to_sync
+from mod_scheduler import BACKGROUND, TransferScheduler
+from mod_transaction import UpdateTransaction
+from mod_validate import validate_mods
+from util import get_json_from_file, get_file_size_bytes
+
+root_dir = os.getcwd()  # 根目录
+temp_dir = os.path.join(root_dir, "temp")
+# 预下载目录：每个整合包版本一个子目录（temp/prefetch/<版本>，与前台同步的temp/staging分开）
+prefetch_root = os.path.join(temp_dir, "prefetch")
+# 默认检查间隔（秒）
+DEFAULT_INTERVAL = 30 * 60
+# 就绪计划文件名（预下载完成后写入，存在即表示可以直接应用）
+PLAN_FILE_NAME = "plan.json"
+# 版本目录中的配置文件名
+MANIFEST_FILE_NAME = "mod_info.json"
+# 后台模式开关环境变量（值为1时GUI启动后台预下载）
+PREFETCH_ENV_VAR = "CMAGIC_PREFETCH"
+
+
+def version_dir_name(pack_version):
+    """将整合包版本（split_time，如"2025-01-01 12:00:00"）转为可用作目录名的字符串"""
+    return re.sub(r"[^0-9A-Za-z._-]+", "-", pack_version).strip("-")
+
+
+def load_ready_plan(pack_version, staging_root=None):
+    """
+    读取指定版本的就绪计划，并确认暂存文件都还在且大小正确
+    :param pack_version: 整合包版本（配置文件的split_time）
+    :param staging_root: 预下载目录（默认temp/prefetch）
+    :return: 计划字典（不存在或不完整返回None）
+    """
+    version_dir = os.path.join(staging_root or prefetch_root, version_dir_name(pack_version))
+    plan_path = os.path.join(version_dir, PLAN_FILE_NAME)
+    if not os.path.exists(plan_path):
+        return None
+    plan = get_json_from_file(plan_path)
+    if not plan or plan.get("pack_version") != pack_version:
+        return None
+    for item in plan["files"]:
+        if get_file_size_bytes(os.path.join(plan["ready_dir"], item["file_name"])) != item["file_size_bytes"]:
+            print(f"[警告] 预下载文件 {item['file_name']} 缺失或不完整，忽略该计划")
+            return None
+    return plan
+
+
+def apply_plan(plan, local_mod_dir, log=print):
+    """
+    应用就绪计划：通过更新事务把暂存文件移入Mod目录并删除被取代的旧版本
+    （配置文件不在此替换，由调用方在确认全部Mod到位后提交）
+    :param plan: load_ready_plan返回的计划
+    :param local_mod_dir: 本地Mod目录
+    :param log: 日志输出函数
+    :return: 移入的文件名列表
+    """
+    os.makedirs(local_mod_dir, exist_ok=True)
+    transaction = UpdateTransaction()
+    for item in plan["files"]:
+        transaction.add_file(os.path.join(plan["ready_dir"], item["file_name"]),
+                             os.path.join(local_mod_dir, item["file_name"]), item["file_size_bytes"])
+    for old_path in plan["remove"]:
+        transaction.remove_file(old_path)
+    transaction.commit(log=log)
+    discard_plan(plan)
+    return [item["file_name"] for item in plan["files"]]
+
+
+def discard_plan(plan):
+    """删除计划对应的版本目录"""
+    shutil.rmtree(plan["version_dir"], ignore_errors=True)
+
+
+def cleanup_stale_versions(keep_version=None, staging_root=None):
+    """删除除keep_version外的所有版本目录（整合包已更新到更新的版本时，旧的预下载不再需要）"""
+    staging_root = staging_root or prefetch_root
+    if not os.path.isdir(staging_root):
+        return
+    keep = version_dir_name(keep_version) if keep_version else None
+    for name in os.listdir(staging_root):
+        path = os.path.join(staging_root, name)
+        if name != keep and os.path.exists(os.path.join(path, MANIFEST_FILE_NAME)):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class PrefetchDaemon:
+    """
+    后台预下载：定期获取最新配置，把需要更新的Mod以后台优先级下载、校验到暂存目录，
+    完成后写入就绪计划；用户点击更新时只需把暂存文件移入Mod目录
+    """
+
+    def __init__(self, manifest_urls, local_mod_dir, mod_info_path, staging_root=None, interval=DEFAULT_INTERVAL,
+                 scheduler=None, mirror_pool=None, watcher=None, log=print):
+        """
+        :param manifest_urls: 配置文件下载地址列表（mod_info_urls）
+        :param local_mod_dir: 本地Mod目录
+        :param mod_info_path: 本地配置文件路径（用于判断是否已是最新）
+        :param staging_root: 预下载目录（默认temp/prefetch）
+        :param interval: 检查间隔（秒）
+        :param scheduler: 传输调度器（与前台更新共享时，前台会抢占预下载）
+        :param mirror_pool: 线路状态表
+        :param watcher: 本地Mod目录监视器（可选）
+        :param log: 日志输出函数
+        """
+        self.manifest_urls = list(manifest_urls)
+        self.local_mod_dir = local_mod_dir
+        self.mod_info_path = mod_info_path
+        self.staging_root = staging_root or prefetch_root
+        self.interval = interval
+        self.scheduler = scheduler or TransferScheduler()
+        self.mirror_pool = mirror_pool or MirrorPool(mirror_base_urls(self.manifest_urls))
+        self.watcher = watcher
+        self.log = log
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.check_once()
+            except Exception as e:
+                self.log(f"[错误] 后台预下载失败：{str(e)}")
+            self._stop.wait(self.interval)
+
+    def check_once(self):
+        """
+        检查一次更新并预下载
+        :return: 就绪计划（已是最新或失败返回None）
+        """
+        os.makedirs(self.staging_root, exist_ok=True)
+        latest_path = os.path.join(self.staging_root, f"latest_{MANIFEST_FILE_NAME}")
+        slot = self.scheduler.slot(BACKGROUND) if self.scheduler else nullcontext()
+        with slot:
+            ok = download_file(self.manifest_urls, latest_path, log=lambda msg: None, mirror_pool=self.mirror_pool,
+                               scheduler=self.scheduler, priority=BACKGROUND)
+        if not ok:
+            self.log(f"[警告] 后台预下载：获取远程mod列表失败")
+            return None
+        latest = get_json_from_file(latest_path)
+        pack_version = latest["split_time"]
+
+        local = get_json_from_file(self.mod_info_path) if os.path.exists(self.mod_info_path) else None
+        if local and local.get("split_time") == pack_version:
+            os.remove(latest_path)
+            cleanup_stale_versions(staging_root=self.staging_root)
+            return None
+        cleanup_stale_versions(pack_version, self.staging_root)
+        plan = load_ready_plan(pack_version, self.staging_root)
+        if plan:
+            os.remove(latest_path)
+            return plan
+
+        version_dir = os.path.join(self.staging_root, version_dir_name(pack_version))
+        ready_dir = os.path.join(version_dir, "ready")
+        os.makedirs(version_dir, exist_ok=True)
+        manifest_path = os.path.join(version_dir, MANIFEST_FILE_NAME)
+        os.replace(latest_path, manifest_path)
+
+        os.makedirs(self.local_mod_dir, exist_ok=True)
+        result = validate_mods(manifest_path, self.local_mod_dir, self.watcher)
+        if not result.valid:
+            self.log(f"[警告] 后台预下载：版本 {pack_version} 的mod列表无法读取")
+            return None
+        entries = select_entries_to_sync(latest, result)
+        self.log(f"[信息] 后台预下载：版本 {pack_version} 需要下载 {len(entries)} 个mod文件")
+        pipeline = SyncPipeline(mirror_base_urls(self.manifest_urls), ready_dir, os.path.join(version_dir, "work"),
+                                log=lambda msg: None, mirror_pool=self.mirror_pool, scheduler=self.scheduler,
+                                priority=BACKGROUND)
+        succeeded, failed = pipeline.run(entries)
+        if failed:
+            self.log(f"[警告] 后台预下载：{len(failed)} 个mod下载失败，下次检查时重试")
+            return None
+
+        remove = result.superseded_paths()
+        plan = {
+            "pack_version": pack_version,
+            "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "version_dir": version_dir,
+            "ready_dir": ready_dir,
+            "manifest_path": manifest_path,
+            "files": [{"file_name": e["file_name"], "file_size_bytes": e["file_size_bytes"]}
+                      for e in entries if e["file_name"] in succeeded],
+            "remove": remove,
+        }
+        # 计划最后写入（先写临时文件再替换），存在即表示暂存文件已全部校验通过
+        plan_path = os.path.join(version_dir, PLAN_FILE_NAME)
+        with open(plan_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(plan, f, ensure_ascii=False, indent=4)
+        os.replace(plan_path + ".tmp", plan_path)
+        self.log(f"[成功] 后台预下载完成：版本 {pack_version} 已就绪（{len(plan['files'])} 个文件）")
+        return plan
+
+
+if __name__ == "__main__":
+    # 不依赖GUI（main.py需要PyQt5），各路径和地址由命令行指定，默认值与main.py一致
+    parser = argparse.ArgumentParser(description="后台预下载：定期检查整合包更新并提前下载到暂存目录")
+    parser.add_argument("--once", action="store_true", help="只检查一次后退出")
+    parser.add_argument("--interval", type=int, default=DEFAULT_INTERVAL, help="检查间隔秒数（默认1800）")
+    parser.add_argument("--mod-info-url", action="append", dest="mod_info_urls",
+                        help="配置文件下载地址（可多次指定，按优先级排列，默认与main.py相同）")
+    parser.add_argument("--mod-info", default=os.path.join("config", "mod_info.json"), help="本地配置文件路径")
+    parser.add_argument("--mod-dir", default=os.path.join(".minecraft", "versions", "CMagic_client", "mods"),
+                        help="本地Mod目录")
+    args = parser.parse_args()
+
+    daemon = PrefetchDaemon(args.mod_info_urls or DEFAULT_MOD_INFO_URLS, args.mod_dir, args.mod_info,
+                            interval=args.interval)
+    if args.once:
+        daemon.check_once()
+    else:
+        daemon.start()
+        try:
+            daemon._thread.join()
+        except KeyboardInterrupt:
+            daemon.stop()
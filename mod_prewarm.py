@@ -0,0 +1,218 @@
+import argparse
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from mod_trace import count, traced
+from util import get_json_from_file, locate_central_directory
+
+# 预热开关环境变量（值为1时更新完成后在后台预热Mod）
+PREWARM_ENV_VAR = "CMAGIC_PREWARM"
+# 预热并发数
+DEFAULT_WORKERS = 4
+# 读取文件末尾的字节数（用于定位中央目录）
+TAIL_SIZE = 64 * 1024
+# 不支持posix_fadvise的平台上读取文件时的块大小
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+def _advise(fd, offset, length):
+    """
+    通知系统预读文件区间：支持posix_fadvise的平台（Linux等）由内核异步预读，不阻塞；
+    其他平台（Windows）直接读取该区间，使其进入系统缓存
+    """
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+        return
+    os.lseek(fd, offset, os.SEEK_SET)
+    remaining = length
+    while remaining > 0:
+        data = os.read(fd, min(READ_BLOCK_SIZE, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+
+
+def manifest_jar_paths(mod_info_path, local_mod_dir):
+    """
+    按配置文件all_mod_files的顺序列出本地Mod路径（与加载器扫描顺序接近，先预热的先被读取）
+    :param mod_info_path: 本地配置文件路径
+    :param local_mod_dir: 本地Mod目录
+    :return: 存在的Mod路径列表
+    """
+    mod_info = get_json_from_file(mod_info_path) or {}
+    paths = [os.path.join(local_mod_dir, entry["file_name"]) for entry in mod_info.get("all_mod_files", [])]
+    return [path for path in paths if os.path.isfile(path)]
+
+
+class Prewarmer:
+    """
+    Mod页缓存预热：更新完成后把Mod提前读入系统缓存，游戏首次启动时不必等待磁盘
+    第一轮预热每个JAR的中央目录（加载器最先读取的部分），第二轮预热完整文件；可随时取消
+    """
+
+    def __init__(self, paths, workers=DEFAULT_WORKERS, full=True, log=print):
+        """
+        :param paths: Mod路径列表（按预热顺序）
+        :param workers: 并发数
+        :param full: 是否在中央目录之后预热完整文件
+        :param log: 日志输出函数
+        """
+        self.paths = list(paths)
+        self.workers = workers
+        self.full = full
+        self.log = log
+        self.report = {"files": 0, "central_dir_bytes": 0, "bytes_warmed": 0, "seconds": None, "cancelled": False}
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def cancel(self):
+        """取消预热（正在处理的文件完成后停止）"""
+        self._cancel.set()
+
+    def start(self):
+        """在后台线程中预热"""
+        self._thread = threading.Thread(target=self.run, name="Prewarmer", daemon=True)
+        self._thread.start()
+        return self
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _add(self, key, value):
+        with self._lock:
+            self.report[key] += value
+
+    def _warm_central_dir(self, path):
+        """预热中央目录（非ZIP文件预热末尾）"""
+        if self._cancel.is_set():
+            return
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            size = os.fstat(fd).st_size
+            tail_start = max(0, size - TAIL_SIZE)
+            os.lseek(fd, tail_start, os.SEEK_SET)
+            tail = os.read(fd, size - tail_start)
+            central_dir = locate_central_directory(tail, size)
+            warmed = len(tail)
+            if central_dir and central_dir[0] < tail_start:
+                _advise(fd, central_dir[0], tail_start - central_dir[0])
+                warmed += tail_start - central_dir[0]
+            self._add("central_dir_bytes", warmed)
+            self._add("files", 1)
+        finally:
+            os.close(fd)
+
+    def _warm_file(self, path):
+        if self._cancel.is_set():
+            return
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            size = os.fstat(fd).st_size
+            _advise(fd, 0, size)
+            self._add("bytes_warmed", size)
+        finally:
+            os.close(fd)
+
+    @traced("prewarm")
+    def run(self):
+        """
+        执行预热（阻塞）
+        :return: 统计字典（files文件数、central_dir_bytes中央目录字节数、bytes_warmed预热的总字节数、seconds耗时、cancelled是否被取消）
+        """
+        start = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            for phase in ([self._warm_central_dir, self._warm_file] if self.full else [self._warm_central_dir]):
+                for future in [executor.submit(phase, path) for path in self.paths]:
+                    if self._cancel.is_set():
+                        break
+                    try:
+                        future.result()
+                    except OSError as e:
+                        self.log(f"[警告] 预热失败：{str(e)}")
+                if self._cancel.is_set():
+                    break
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        self.report["seconds"] = round(time.perf_counter() - start, 3)
+        self.report["cancelled"] = self._cancel.is_set()
+        if not self.full:
+            self.report["bytes_warmed"] = self.report["central_dir_bytes"]
+        count("prewarm_bytes", self.report["bytes_warmed"])
+        self.log(f"[信息] 预热{'已取消' if self.report['cancelled'] else '完成'}：{self.report['files']} 个Mod，"
+                 f"{self.report['bytes_warmed'] / 1024 / 1024:.1f}MB，耗时 {self.report['seconds']}s")
+        return self.report
+
+
+def simulate_loader_read(paths):
+    """模拟加载器启动时的读取：打开每个JAR（读取中央目录）并读取全部条目"""
+    total = 0
+    for path in paths:
+        with zipfile.ZipFile(path) as jar:
+            for info in jar.infolist():
+                with jar.open(info) as entry:
+                    while data := entry.read(READ_BLOCK_SIZE):
+                        total += len(data)
+    return total
+
+
+def measure_cold_start(paths, repeat=3, workers=DEFAULT_WORKERS):
+    """
+    对比冷缓存下有无预热时加载器读取Mod的耗时（需要posix_fadvise丢弃缓存，Windows不支持）
+    :param paths: Mod路径列表
+    :param repeat: 重复次数（取最佳值）
+    :param workers: 预热并发数
+    :return: 结果字典（cold_s无预热、prewarm_s预热耗时、prewarmed_s预热后读取耗时，单位秒），不支持时返回None
+    """
+    from mod_bench import drop_file_cache
+
+    result = {"cold_s": [], "prewarm_s": [], "prewarmed_s": []}
+    for _ in range(repeat):
+        if not drop_file_cache(paths):
+            return None
+        start = time.perf_counter()
+        simulate_loader_read(paths)
+        result["cold_s"].append(time.perf_counter() - start)
+
+        drop_file_cache(paths)
+        start = time.perf_counter()
+        Prewarmer(paths, workers=workers).run()
+        result["prewarm_s"].append(time.perf_counter() - start)
+        # posix_fadvise为异步预读，等待内核完成后再测读取耗时
+        time.sleep(0.5)
+        start = time.perf_counter()
+        simulate_loader_read(paths)
+        result["prewarmed_s"].append(time.perf_counter() - start)
+    return {key: round(min(values), 4) for key, values in result.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mod页缓存预热：让游戏首次启动更快读取Mod")
+    sub = parser.add_subparsers(dest="command")
+    run_parser = sub.add_parser("run", help="按配置文件顺序预热Mod")
+    run_parser.add_argument("--mod-info", default=os.path.join("config", "mod_info.json"), help="本地配置文件路径")
+    run_parser.add_argument("--mod-dir", default=os.path.join(".minecraft", "versions", "CMagic_client", "mods"),
+                            help="本地Mod目录")
+    run_parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help=f"并发数（默认{DEFAULT_WORKERS}）")
+    bench_parser = sub.add_parser("bench", help="测量冷缓存下有无预热的读取耗时")
+    bench_parser.add_argument("mod_dir", help="Mod目录")
+    bench_parser.add_argument("--repeat", type=int, default=3, help="重复次数（默认3）")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        Prewarmer(manifest_jar_paths(args.mod_info, args.mod_dir), workers=args.workers).run()
+    elif args.command == "bench":
+        jar_paths = sorted(os.path.join(args.mod_dir, f) for f in os.listdir(args.mod_dir) if f.endswith(".jar"))
+        measured = measure_cold_start(jar_paths, args.repeat)
+        if measured is None:
+            print("[错误] 当前平台不支持丢弃文件缓存，无法测量冷启动")
+        else:
+            print(f"[信息] 无预热：{measured['cold_s']}s  预热：{measured['prewarm_s']}s  "
+                  f"预热后读取：{measured['prewarmed_s']}s")
+    else:
+        parser.print_help()
@@ -0,0 +1,265 @@
+import argparse
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from mod_download import download_file, get_fastest_url, order_urls
+from mod_mirror import MirrorPool
+from mod_pipeline import SyncPipeline, mirror_base_urls, select_entries_to_sync
+from mod_scheduler import FOREGROUND
+from mod_trace import bind, span, traced
+from mod_transaction import UpdateTransaction, recover_journal
+from mod_validate import VERSION_UPDATES, validate_mods
+from util import calculate_file_hash, get_json_from_file
+
+root_dir = os.getcwd()  # 根目录
+# 多版本配置文件：{"profiles": [{"name", "mod_info_urls", "mod_dir", "mod_info_path"(可选)}]}
+profiles_path = os.path.join(root_dir, "config", "profiles.json")
+# 各版本的工作目录（最新配置文件、暂存文件、应用日志）
+profiles_temp_dir = os.path.join(root_dir, "temp", "profiles")
+
+
+class Profile:
+    """整合包的一个版本：各自的配置文件地址、Mod目录和本地配置文件"""
+
+    def __init__(self, name, mod_info_urls, mod_dir, mod_info_path=None):
+        """
+        :param name: 版本名（用作工作目录名）
+        :param mod_info_urls: 配置文件下载地址列表
+        :param mod_dir: Mod目录
+        :param mod_info_path: 本地配置文件路径（默认config/profiles/<版本名>/mod_info.json）
+        """
+        self.name = name
+        self.mod_info_urls = list(mod_info_urls)
+        self.mod_dir = mod_dir
+        self.mod_info_path = mod_info_path or os.path.join(root_dir, "config", "profiles", name, "mod_info.json")
+        self.work_dir = os.path.join(profiles_temp_dir, name)
+        self.latest_mod_info_path = os.path.join(self.work_dir, "latest_mod_info.json")
+        self.apply_dir = os.path.join(self.work_dir, "apply")
+        self.journal_path = os.path.join(self.work_dir, "apply_journal.json")
+
+
+def load_profiles(path=None):
+    """
+    读取多版本配置
+    :param path: 配置路径（默认config/profiles.json）
+    :return: Profile列表（配置不存在时为空列表）
+    """
+    config = get_json_from_file(path or profiles_path) if os.path.exists(path or profiles_path) else None
+    if not config:
+        return []
+    return [Profile(p["name"], p["mod_info_urls"], p["mod_dir"], p.get("mod_info_path"))
+            for p in config.get("profiles", [])]
+
+
+def recover_profiles(profiles, log=print):
+    """启动时按各版本的应用日志继续完成中断的更新"""
+    complete = True
+    for profile in profiles:
+        complete = recover_journal(profile.journal_path, log=log) and complete
+    return complete
+
+
+def _link_or_copy(src, dst):
+    """优先硬链接（同一份内容放入多个版本不占额外空间），不支持时复制"""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class MultiProfileUpdate:
+    """
+    多版本更新：检测所有版本，合并更新计划，每个内容哈希只下载一次，再并发应用到各版本
+    （其他版本中已有的相同内容直接复制，不再下载；版本之间重合越多，额外的下载越少）
+    """
+
+    def __init__(self, profiles, log=print, mirror_pool=None, scheduler=None, priority=FOREGROUND, peers=None):
+        """
+        :param profiles: Profile列表
+        :param log: 日志输出函数
+        :param mirror_pool: 线路状态表（默认按所有版本的线路新建）
+        :param scheduler: 传输调度器
+        :param priority: 传输优先级
+        :param peers: 可选的mod_peer.PeerNode（局域网共享）
+        """
+        self.profiles = list(profiles)
+        self.log = log
+        self.mirror_pool = mirror_pool or MirrorPool(
+            [base for profile in self.profiles for base in mirror_base_urls(profile.mod_info_urls)])
+        self.scheduler = scheduler
+        self.priority = priority
+        self.peers = peers
+        self.plans = {}  # 版本名 -> {"profile", "manifest", "result", "entries"}
+        self.sources = {}  # 内容哈希 -> 本地已有/已下载的文件路径
+        self.failed_profiles = set()  # 检测失败的版本名（不参与下载和应用）
+        self.objects_dir = os.path.join(profiles_temp_dir, "objects")
+
+    # ---------- 检测 ----------
+    def _plan_profile(self, profile):
+        os.makedirs(profile.work_dir, exist_ok=True)
+        urls = order_urls(profile.mod_info_urls, get_fastest_url(profile.mod_info_urls, log=lambda msg: None))
+        slot = self.scheduler.slot(self.priority) if self.scheduler else nullcontext()
+        with slot:
+            ok = download_file(urls, profile.latest_mod_info_path, log=lambda msg: None, mirror_pool=self.mirror_pool,
+                               scheduler=self.scheduler, priority=self.priority)
+        if not ok:
+            raise Exception(f"获取 {profile.name} 的mod列表失败")
+        manifest = get_json_from_file(profile.latest_mod_info_path)
+        os.makedirs(profile.mod_dir, exist_ok=True)
+        result = validate_mods(profile.latest_mod_info_path, profile.mod_dir, quick=True)
+        if not result.valid:
+            raise Exception(f"{profile.name} 的mod列表无法读取")
+        entries = select_entries_to_sync(manifest, result)
+        return {"profile": profile, "manifest": manifest, "result": result, "entries": entries}
+
+    def _try_plan_profile(self, profile):
+        """检测单个版本，失败时只记录该版本，不影响其他版本"""
+        try:
+            return self._plan_profile(profile)
+        except Exception as e:
+            self.log(f"❌ {profile.name}：{str(e)}")
+            return None
+
+    @traced("profiles_plan")
+    def plan(self):
+        """
+        并发获取各版本的最新配置文件并校验本地Mod（检测失败的版本记录在failed_profiles中）
+        :return: (需要同步的文件总数, 需要下载的内容数)
+        """
+        with ThreadPoolExecutor(max_workers=max(1, len(self.profiles))) as executor:
+            for profile, plan in zip(self.profiles, executor.map(bind(self._try_plan_profile), self.profiles)):
+                if plan is None:
+                    self.failed_profiles.add(profile.name)
+                else:
+                    self.plans[profile.name] = plan
+
+        # 各版本中已校验通过的文件可作为其他版本的来源
+        # （校验按哈希匹配，同名文件可能是另一个哈希相同的文件代为通过的旧文件，用作来源前重新计算哈希）
+        needed = {entry["file_hash"] for plan in self.plans.values() for entry in plan["entries"]}
+        candidates = {}
+        for plan in self.plans.values():
+            stale = plan["result"].files_to_sync()
+            for entry in plan["manifest"]["all_mod_files"]:
+                path = os.path.join(plan["profile"].mod_dir, entry["file_name"])
+                if entry["file_hash"] in needed and entry["file_name"] not in stale and os.path.isfile(path):
+                    candidates.setdefault(entry["file_hash"], []).append(path)
+        for file_hash, paths in candidates.items():
+            for path in paths:
+                if calculate_file_hash(path) == file_hash:
+                    self.sources[file_hash] = path
+                    break
+        total = sum(len(plan["entries"]) for plan in self.plans.values())
+        return total, len(needed - set(self.sources))
+
+    # ---------- 下载 ----------
+    @traced("profiles_download")
+    def download(self):
+        """
+        下载所有版本都没有的内容（每个哈希只下载一次，从最先需要它的版本的线路下载）
+        :return: 下载失败的内容哈希集合
+        """
+        groups = {}
+        seen = set(self.sources)
+        for name, plan in self.plans.items():
+            for entry in plan["entries"]:
+                if entry["file_hash"] not in seen:
+                    seen.add(entry["file_hash"])
+                    groups.setdefault(name, []).append(entry)
+
+        failed = set()
+        for name, entries in groups.items():
+            profile = self.plans[name]["profile"]
+            target_dir = os.path.join(self.objects_dir, name)
+            shutil.rmtree(target_dir, ignore_errors=True)
+            self.log(f"📥 {name}：下载 {len(entries)} 个mod文件")
+            pipeline = SyncPipeline(mirror_base_urls(profile.mod_info_urls), target_dir,
+                                    os.path.join(profile.work_dir, "pipeline"), log=self.log,
+                                    mirror_pool=self.mirror_pool, scheduler=self.scheduler, priority=self.priority,
+                                    peers=self.peers)
+            succeeded, _ = pipeline.run(entries)
+            for entry in entries:
+                if entry["file_name"] in succeeded:
+                    self.sources[entry["file_hash"]] = os.path.join(target_dir, entry["file_name"])
+                else:
+                    failed.add(entry["file_hash"])
+        return failed
+
+    # ---------- 应用 ----------
+    def _stage_profile(self, plan):
+        """把版本需要的文件放入该版本的暂存目录，登记到事务中"""
+        profile = plan["profile"]
+        os.makedirs(profile.apply_dir, exist_ok=True)
+        transaction = UpdateTransaction(profile.journal_path)
+        failed = []
+        for entry in plan["entries"]:
+            src = self.sources.get(entry["file_hash"])
+            if src is None:
+                failed.append(entry["file_name"])
+                continue
+            staged_path = os.path.join(profile.apply_dir, entry["file_name"])
+            _link_or_copy(src, staged_path)
+            transaction.add_file(staged_path, os.path.join(profile.mod_dir, entry["file_name"]),
+                                 entry["file_size_bytes"])
+        synced = {entry["file_name"] for entry in plan["entries"]} - set(failed)
+        for issue in plan["result"].of_kind(VERSION_UPDATES):
+            if issue.file_name in synced:
+                for old_file in issue.old_files:
+                    transaction.remove_file(old_file["file_path"])
+        if not failed:
+            transaction.set_manifest(profile.latest_mod_info_path, profile.mod_info_path)
+        return transaction, failed
+
+    def _commit_profile(self, plan, transaction, failed):
+        profile = plan["profile"]
+        os.makedirs(os.path.dirname(os.path.abspath(profile.mod_info_path)), exist_ok=True)
+        os.makedirs(profile.mod_dir, exist_ok=True)
+        with span("profile_apply", profile=profile.name):
+            transaction.commit(log=self.log)
+        if failed:
+            self.log(f"❌ {profile.name}：{len(failed)} 个mod同步失败")
+        else:
+            self.log(f"✅ {profile.name}：同步完成（{len(plan['entries'])} 个mod文件）")
+        return not failed
+
+    @traced("profiles_apply")
+    def apply(self):
+        """
+        先为所有版本暂存文件（来源可能是其他版本的Mod目录，须在任何版本改动之前取出），再并发提交各版本的事务
+        :return: 字典{版本名: 是否成功}（检测失败的版本为False）
+        """
+        with ThreadPoolExecutor(max_workers=max(1, len(self.plans))) as executor:
+            staged = dict(zip(self.plans, executor.map(bind(self._stage_profile), self.plans.values())))
+            results = executor.map(bind(lambda name: self._commit_profile(self.plans[name], *staged[name])), staged)
+            outcome = dict(zip(staged, results))
+        shutil.rmtree(self.objects_dir, ignore_errors=True)
+        outcome.update({name: False for name in self.failed_profiles})
+        return outcome
+
+    @traced("profiles_update")
+    def run(self):
+        """
+        检测 → 下载 → 应用
+        :return: 字典{版本名: 是否成功}
+        """
+        total, to_download = self.plan()
+        self.log(f"ℹ️ {len(self.profiles)} 个版本共需同步 {total} 个mod文件，其中 {to_download} 个需要下载")
+        self.download()
+        return self.apply()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多版本更新：合并所有版本的更新计划，相同内容只下载一次")
+    parser.add_argument("--profiles", default=profiles_path, help="多版本配置路径（默认config/profiles.json）")
+    args = parser.parse_args()
+
+    profile_list = load_profiles(args.profiles)
+    if not profile_list:
+        print(f"[错误] 未找到多版本配置：{args.profiles}")
+    else:
+        recover_profiles(profile_list)
+        for profile_name, ok in MultiProfileUpdate(profile_list).run().items():
+            print(f"[{'成功' if ok else '错误'}] {profile_name}")
@@ -0,0 +1,300 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+
+from mod_pipeline import MANIFEST_REL_PATH
+from mod_split import CHUNK_SIZE, MB_TO_BYTES, SPLIT_THRESHOLD, attach_sources, load_mod_sources, pack_bundles
+from mod_trace import count, traced
+from mod_transport import compress_file
+from mod_version import get_mod_id_version
+from util import calculate_file_hash, calculate_quick_fingerprint, get_json_from_file
+
+root_dir = os.getcwd()  # 根目录
+# 发布缓存：源文件的大小/修改时间未变化时直接复用上次生成的配置项（不再读取文件）
+publish_cache_path = os.path.join(root_dir, "temp", "publish_cache.json")
+# 发布过程中的临时目录（传输压缩、bundle先生成于此，再按哈希移入objects）
+publish_temp_dir = os.path.join(root_dir, "temp", "publish")
+# 内容寻址目录名（文件名为内容哈希，内容永不改变，可被CDN/浏览器永久缓存）
+OBJECTS_DIR_NAME = "objects"
+
+
+def object_rel_path(content_hash):
+    """内容在发布目录中的相对路径：objects/<哈希前2位>/<哈希>"""
+    return f"{OBJECTS_DIR_NAME}/{content_hash[:2]}/{content_hash}"
+
+
+class Publisher:
+    """
+    发布：把Mod目录输出为独立的发布目录（不在Mod目录中写入任何文件）
+    所有Mod、分包、bundle、传输压缩文件都以内容哈希命名存放在objects下，已存在的对象不再写入；
+    配置文件最后写入（先写临时文件再改名），托管方看到新配置文件时其引用的对象都已就位
+    """
+
+    def __init__(self, output_dir, cache_path=publish_cache_path, split_threshold=SPLIT_THRESHOLD,
+                 chunk_size=CHUNK_SIZE, transport=False, bundle=False, sources=None, log=print):
+        """
+        :param output_dir: 发布目录（可直接作为静态托管/CDN源站的根目录）
+        :param cache_path: 发布缓存路径（None为不使用缓存）
+        :param split_threshold: 大于该字节数的文件分割为分包
+        :param chunk_size: 分包字节数
+        :param transport: 是否生成传输压缩版本
+        :param bundle: 是否将小Mod打包为bundle
+        :param sources: 外部下载地址表{文件哈希: [下载地址, ...]}（对象仍会写入，作为客户端的回退来源）
+        :param log: 日志输出函数
+        """
+        self.output_dir = output_dir
+        self.cache_path = cache_path
+        self.split_threshold = split_threshold
+        self.chunk_size = chunk_size
+        self.transport = transport
+        self.bundle = bundle
+        self.sources = sources or {}
+        self.log = log
+        self.stats = {"files": 0, "files_cached": 0, "objects_written": 0, "objects_reused": 0, "bytes_written": 0}
+        self._cache = (get_json_from_file(cache_path) or {}) if cache_path and os.path.exists(cache_path) else {}
+
+    # ---------- 对象存储 ----------
+    def _object_path(self, content_hash):
+        return os.path.join(self.output_dir, *object_rel_path(content_hash).split("/"))
+
+    def _has_object(self, content_hash, size):
+        try:
+            return os.path.getsize(self._object_path(content_hash)) == size
+        except OSError:
+            return False
+
+    def _put_object(self, content_hash, size, src_path=None, data=None, move=False):
+        """
+        写入对象（已存在时跳过）：先写临时文件再改名，托管方不会读到不完整的对象
+        :param src_path: 来源文件（与data二选一）
+        :param data: 对象内容
+        :param move: 来源为临时文件时直接移动
+        :return: 对象相对路径
+        """
+        rel_path = object_rel_path(content_hash)
+        if self._has_object(content_hash, size):
+            self.stats["objects_reused"] += 1
+            if move:
+                os.remove(src_path)
+            return rel_path
+        path = self._object_path(content_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        if data is not None:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+        elif move:
+            shutil.move(src_path, tmp_path)
+        else:
+            shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, path)
+        self.stats["objects_written"] += 1
+        self.stats["bytes_written"] += size
+        count("publish_bytes", size)
+        return rel_path
+
+    def _objects_present(self, entry):
+        """缓存的配置项引用的对象是否都还在发布目录中"""
+        if entry.get("is_split"):
+            return all(self._has_object(c["chunk_hash"], c["chunk_size_bytes"]) for c in entry["split_details"]["chunks"])
+        if entry.get("transport") and not self._has_object(entry["transport"]["hash"], entry["transport"]["size_bytes"]):
+            return False
+        return self._has_object(entry["file_hash"], entry["file_size_bytes"])
+
+    # ---------- 单个文件 ----------
+    def _split_objects(self, file_path, file_name):
+        """按分包大小读取文件，各分包作为独立对象写入"""
+        chunks = []
+        with open(file_path, "rb") as f:
+            while data := f.read(self.chunk_size):
+                chunk_hash = hashlib.md5(data).hexdigest()
+                index = len(chunks) + 1
+                chunks.append({
+                    # chunk_name只用于客户端暂存分包的文件名
+                    "chunk_name": f"{file_name}.part{index:02d}",
+                    "chunk_path": self._put_object(chunk_hash, len(data), data=data),
+                    "chunk_size_bytes": len(data),
+                    "chunk_size_mb": round(len(data) / MB_TO_BYTES, 2),
+                    "chunk_hash": chunk_hash,
+                    "chunk_index": index,
+                })
+        return chunks
+
+    def _transport_object(self, file_path, file_hash):
+        """生成传输压缩版本并按压缩数据的哈希存入objects（不划算返回None）"""
+        transport = compress_file(file_path, file_hash, publish_temp_dir)
+        if transport is None:
+            return None
+        transport["path"] = self._put_object(transport["hash"], transport["size_bytes"], src_path=transport["path"],
+                                             move=True)
+        return transport
+
+    def publish_file(self, file_path, file_name):
+        """
+        发布单个Mod（源文件未变化且对象齐全时直接复用缓存的配置项）
+        :return: 配置项（格式同mod_split生成的all_mod_files中的项，路径为objects下的相对路径）
+        """
+        st = os.stat(file_path)
+        key = os.path.abspath(file_path)
+        cached = self._cache.get(key)
+        if cached and cached["size"] == st.st_size and cached["mtime_ns"] == st.st_mtime_ns \
+                and cached["options"] == [self.split_threshold, self.chunk_size, self.transport] \
+                and self._objects_present(cached["entry"]):
+            self.stats["files_cached"] += 1
+            return dict(cached["entry"])
+
+        file_hash = calculate_file_hash(file_path)
+        mod_id, mod_version = get_mod_id_version(file_path)
+        entry = {
+            "file_path": object_rel_path(file_hash),
+            "file_name": file_name,
+            "file_size_bytes": st.st_size,
+            "file_size_mb": round(st.st_size / MB_TO_BYTES, 2),
+            "file_hash": file_hash,
+            "quick_fingerprint": calculate_quick_fingerprint(file_path),
+            "is_split": False,
+            "mod_id": mod_id,
+            "mod_version": mod_version,
+        }
+        if st.st_size > self.split_threshold:
+            chunks = self._split_objects(file_path, file_name)
+            entry["is_split"] = True
+            entry["split_details"] = {
+                "original_file_size_bytes": st.st_size,
+                "original_file_size_mb": round(st.st_size / MB_TO_BYTES, 2),
+                "original_file_hash": file_hash,
+                "chunk_count": len(chunks),
+                "chunk_size_setting_mb": round(self.chunk_size / MB_TO_BYTES, 2),
+                "chunks": chunks,
+            }
+        else:
+            self._put_object(file_hash, st.st_size, src_path=file_path)
+            if self.transport:
+                transport = self._transport_object(file_path, file_hash)
+                if transport:
+                    entry["transport"] = transport
+        self._cache[key] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                            "options": [self.split_threshold, self.chunk_size, self.transport], "entry": entry}
+        return dict(entry)
+
+    # ---------- bundle ----------
+    def _publish_bundles(self, entries, sources):
+        """将小Mod打包为bundle（先生成于临时目录，再按bundle哈希存入objects）"""
+        bundle_dir = os.path.join(publish_temp_dir, "bundles")
+        shadow = [dict(entry, file_path=sources[entry["file_name"]]) for entry in entries]
+        bundles = pack_bundles(shadow, bundle_dir)
+        paths = {}
+        for bundle in bundles:
+            paths[bundle["bundle_name"]] = self._put_object(bundle["bundle_hash"], bundle["bundle_size_bytes"],
+                                                            src_path=bundle["bundle_path"], move=True)
+            bundle["bundle_path"] = paths[bundle["bundle_name"]]
+        for entry, shadow_entry in zip(entries, shadow):
+            if shadow_entry.get("bundle"):
+                entry["bundle"] = dict(shadow_entry["bundle"], bundle_path=paths[shadow_entry["bundle"]["bundle_name"]])
+        return bundles
+
+    # ---------- 发布 ----------
+    def _write_manifest(self, manifest):
+        path = os.path.join(self.output_dir, *MANIFEST_REL_PATH.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        return path
+
+    @traced("publish")
+    def publish(self, mod_dir):
+        """
+        发布Mod目录（只读取Mod目录，不写入）
+        :param mod_dir: Mod目录
+        :return: (配置文件路径, 是否有变化)；内容与上次发布完全相同时不改写配置文件，客户端不会检测到新版本
+        """
+        entries, sources = [], {}
+        for file_name in sorted(os.listdir(mod_dir)):
+            file_path = os.path.join(mod_dir, file_name)
+            if not file_name.lower().endswith(".jar") or not os.path.isfile(file_path):
+                continue
+            entries.append(self.publish_file(file_path, file_name))
+            sources[file_name] = file_path
+            self.stats["files"] += 1
+
+        manifest = {"split_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "split_threshold_mb": round(self.split_threshold / MB_TO_BYTES, 2),
+                    "chunk_size_mb": round(self.chunk_size / MB_TO_BYTES, 2),
+                    "layout": OBJECTS_DIR_NAME,
+                    "all_mod_files": entries}
+        attach_sources(entries, self.sources)
+        if self.bundle:
+            manifest["bundles"] = self._publish_bundles(entries, sources)
+        shutil.rmtree(publish_temp_dir, ignore_errors=True)
+
+        manifest_path = os.path.join(self.output_dir, *MANIFEST_REL_PATH.split("/"))
+        previous = get_json_from_file(manifest_path) if os.path.exists(manifest_path) else None
+        changed = not previous or previous.get("all_mod_files") != entries \
+            or previous.get("bundles") != manifest.get("bundles")
+        if changed:
+            self._write_manifest(manifest)
+        self._save_cache(sources)
+        self.log(f"[{'成功' if changed else '信息'}] 发布{'完成' if changed else '内容无变化'}：{self.stats['files']} 个Mod"
+                 f"（{self.stats['files_cached']} 个未变化），写入 {self.stats['objects_written']} 个对象 "
+                 f"{self.stats['bytes_written'] / MB_TO_BYTES:.1f}MB，复用 {self.stats['objects_reused']} 个")
+        return manifest_path, changed
+
+    def _save_cache(self, sources):
+        if not self.cache_path:
+            return
+        keep = {os.path.abspath(path) for path in sources.values()}
+        self._cache = {key: value for key, value in self._cache.items() if key in keep}
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        with open(self.cache_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self._cache, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(self.cache_path + ".tmp", self.cache_path)
+
+
+def prune_objects(output_dir, manifest):
+    """
+    删除发布目录中不再被配置文件引用的对象
+    （仍在更新旧版本的客户端会找不到旧对象，应在新配置文件发布一段时间后再执行）
+    :return: 删除的对象数
+    """
+    referenced = set()
+    for entry in manifest.get("all_mod_files", []):
+        referenced.add(entry["file_path"])
+        for chunk in (entry.get("split_details") or {}).get("chunks", []):
+            referenced.add(chunk["chunk_path"])
+        if entry.get("transport"):
+            referenced.add(entry["transport"]["path"])
+    referenced.update(bundle["bundle_path"] for bundle in manifest.get("bundles", []))
+
+    removed = 0
+    objects_dir = os.path.join(output_dir, OBJECTS_DIR_NAME)
+    for root, dirs, files in os.walk(objects_dir):
+        for file_name in files:
+            path = os.path.join(root, file_name)
+            rel_path = os.path.relpath(path, output_dir).replace("\\", "/")
+            if rel_path not in referenced:
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="发布整合包：输出内容寻址的发布目录（可直接用于静态托管/CDN）")
+    parser.add_argument("output_dir", help="发布目录")
+    parser.add_argument("--mod-dir", default=".minecraft/versions/CMagic_client/mods", help="Mod目录")
+    parser.add_argument("--bundle", action="store_true", help="将小于1MB的Mod打包为bundle")
+    parser.add_argument("--compress", action="store_true", help="为可压缩的文件生成传输压缩版本")
+    parser.add_argument("--prune", action="store_true", help="发布后删除不再被引用的对象")
+    parser.add_argument("--sources", default=None, help="外部下载地址表（JSON：{文件哈希: [下载地址, ...]}）")
+    args = parser.parse_args()
+
+    publisher = Publisher(args.output_dir, transport=args.compress, bundle=args.bundle,
+                          sources=load_mod_sources(args.sources))
+    path, _ = publisher.publish(args.mod_dir)
+    if args.prune:
+        print(f"[信息] 删除 {prune_objects(args.output_dir, get_json_from_file(path))} 个不再引用的对象")
@@ -0,0 +1,147 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from mod_trace import count
+
+# 优先级：前台（用户点击更新）和后台（预下载等），前台会抢占后台
+FOREGROUND = "foreground"
+BACKGROUND = "background"
+# 默认同时进行的传输数
+DEFAULT_MAX_CONCURRENCY = 4
+# 后台传输默认限速（字节/秒），避免后台同步占满网络
+DEFAULT_BACKGROUND_RATE = 512 * 1024
+# 后台传输默认并发数
+DEFAULT_BACKGROUND_CONCURRENCY = 1
+
+
+class TokenBucket:
+    """令牌桶限速：按rate每秒补充令牌，最多积累一秒的量；允许单次消耗超过余量（欠账由后续等待补齐）"""
+
+    def __init__(self, rate=None):
+        """
+        :param rate: 限速（字节/秒，None或0为不限速）
+        """
+        self.rate = rate
+        self.tokens = rate or 0
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.rate, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self):
+        """距离有令牌可用还需等待的秒数（调用方需持有调度器的锁）"""
+        if not self.rate:
+            return 0
+        self._refill()
+        return 0 if self.tokens > 0 else -self.tokens / self.rate
+
+    def take(self, size):
+        if self.rate:
+            self._refill()
+            self.tokens -= size
+
+    def set_rate(self, rate):
+        self._refill()
+        self.rate = rate
+        self.tokens = min(self.tokens, rate) if rate else 0
+
+
+class TransferScheduler:
+    """
+    传输调度器：全局令牌桶限速 + 并发数限制 + 前台/后台两级优先级
+    前台传输进行或等待时，后台传输既不能开始也不能继续读取数据（暂停直到前台结束）
+    """
+
+    def __init__(self, rate_limit=None, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 background_rate_limit=DEFAULT_BACKGROUND_RATE, background_concurrency=DEFAULT_BACKGROUND_CONCURRENCY):
+        """
+        :param rate_limit: 全局限速（字节/秒，None为不限速，前后台共享）
+        :param max_concurrency: 前台最大并发传输数
+        :param background_rate_limit: 后台额外限速（字节/秒，None为只受全局限速）
+        :param background_concurrency: 后台最大并发传输数
+        """
+        self.max_concurrency = max_concurrency
+        self.background_concurrency = background_concurrency
+        self._global_bucket = TokenBucket(rate_limit)
+        self._background_bucket = TokenBucket(background_rate_limit)
+        self._active = {FOREGROUND: 0, BACKGROUND: 0}
+        self._waiting = {FOREGROUND: 0, BACKGROUND: 0}
+        self._cond = threading.Condition()
+
+    # ---------- 配置 ----------
+    def set_rate_limit(self, rate_limit):
+        with self._cond:
+            self._global_bucket.set_rate(rate_limit)
+            self._cond.notify_all()
+
+    def set_background_rate_limit(self, rate_limit):
+        with self._cond:
+            self._background_bucket.set_rate(rate_limit)
+            self._cond.notify_all()
+
+    # ---------- 并发槽位 ----------
+    def _foreground_busy(self):
+        return self._active[FOREGROUND] > 0 or self._waiting[FOREGROUND] > 0
+
+    def _can_start(self, priority):
+        if priority == FOREGROUND:
+            # 后台传输被抢占时处于暂停状态，不占用前台的并发名额
+            return self._active[FOREGROUND] < self.max_concurrency
+        return not self._foreground_busy() and self._active[BACKGROUND] < self.background_concurrency
+
+    @contextmanager
+    def slot(self, priority=FOREGROUND):
+        """
+        占用一个传输名额（with语句块内进行一次传输）
+        :param priority: FOREGROUND或BACKGROUND
+        """
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while not self._can_start(priority):
+                    self._cond.wait()
+            finally:
+                self._waiting[priority] -= 1
+            self._active[priority] += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active[priority] -= 1
+                self._cond.notify_all()
+
+    # ---------- 限速 ----------
+    def consume(self, size, priority=FOREGROUND):
+        """
+        传输size字节前调用：等待令牌；后台传输在前台繁忙时暂停
+        :param size: 即将写入/已读取的字节数
+        :param priority: FOREGROUND或BACKGROUND
+        """
+        paused = False
+        with self._cond:
+            while True:
+                if priority == BACKGROUND and self._foreground_busy():
+                    if not paused:
+                        paused = True
+                        count("background_preempted")
+                    self._cond.wait()
+                    continue
+                buckets = [self._global_bucket]
+                if priority == BACKGROUND:
+                    buckets.append(self._background_bucket)
+                delay = max(bucket.wait_time() for bucket in buckets)
+                if delay <= 0:
+                    for bucket in buckets:
+                        bucket.take(size)
+                    return
+                count("throttled_ms", int(delay * 1000))
+                self._cond.wait(delay)
+
+    def stats(self):
+        """当前各优先级的进行中/等待中传输数"""
+        with self._cond:
+            return {"active": dict(self._active), "waiting": dict(self._waiting)}
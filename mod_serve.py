@@ -0,0 +1,238 @@
+import argparse
+import email.utils
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+from mod_pipeline import MANIFEST_REL_PATH, repo_relative_path
+from util import get_json_from_file, parse_range_header
+
+# 默认端口
+DEFAULT_PORT = 8000
+# 各扩展名的Content-Type（其余按二进制文件处理）
+CONTENT_TYPES = {
+    ".json": "application/json; charset=utf-8",
+    ".jar": "application/java-archive",
+}
+# 内容寻址对象（mod_publish输出的objects目录）内容永不改变，可永久缓存；其余文件每次需向源站确认
+IMMUTABLE_PREFIX = "objects/"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+class ManifestIndex:
+    """
+    按配置文件建立 仓库相对路径 -> (内容哈希, 字节数) 的索引，用作ETag
+    （同一文件在所有线路上的ETag一致；配置文件更新后自动重建）
+    """
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.manifest_path = os.path.join(root_dir, *MANIFEST_REL_PATH.split("/"))
+        self._mtime_ns = None
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def _rebuild(self):
+        hashes = {}
+        manifest = get_json_from_file(self.manifest_path) or {}
+        for entry in manifest.get("all_mod_files", []):
+            hashes[repo_relative_path(entry["file_path"])] = (entry["file_hash"], entry["file_size_bytes"])
+            if entry.get("transport"):
+                hashes[repo_relative_path(entry["transport"]["path"])] = (entry["transport"]["hash"],
+                                                                         entry["transport"]["size_bytes"])
+            for chunk in (entry.get("split_details") or {}).get("chunks", []):
+                hashes[repo_relative_path(chunk["chunk_path"])] = (chunk["chunk_hash"], chunk["chunk_size_bytes"])
+        for bundle in manifest.get("bundles", []):
+            hashes[repo_relative_path(bundle["bundle_path"])] = (bundle["bundle_hash"], bundle["bundle_size_bytes"])
+        self._hashes = hashes
+
+    def content_hash(self, rel_path, size):
+        """
+        返回文件的内容哈希
+        :param rel_path: 仓库相对路径
+        :param size: 磁盘上文件的当前字节数（与配置不一致时说明文件正在复制或已被改动）
+        :return: 内容哈希（不在配置中或大小不一致时返回None）
+        """
+        with self._lock:
+            try:
+                mtime_ns = os.stat(self.manifest_path).st_mtime_ns
+            except OSError:
+                mtime_ns = None
+            if mtime_ns != self._mtime_ns:
+                self._mtime_ns = mtime_ns
+                self._rebuild()
+            content_hash, expected_size = self._hashes.get(rel_path, (None, None))
+            return content_hash if expected_size == size else None
+
+
+class _ServeHandler(BaseHTTPRequestHandler):
+    """整合包文件服务：支持ETag、条件请求和Range，文件内容用sendfile零拷贝发送"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "CMagicMirror/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_HEAD(self):
+        self._handle(send_body=False)
+
+    def do_GET(self):
+        self._handle(send_body=True)
+
+    def _resolve(self):
+        """将请求路径映射到根目录下的文件（拒绝跳出根目录的路径）"""
+        rel_path = unquote(urlsplit(self.path).path).lstrip("/")
+        root = self.server.root_dir
+        file_path = os.path.realpath(os.path.join(root, rel_path))
+        try:
+            inside = os.path.commonpath([root, file_path]) == root
+        except ValueError:
+            # Windows下路径位于不同盘符
+            inside = False
+        if not inside or not os.path.isfile(file_path):
+            return None, None
+        return rel_path, file_path
+
+    def _send_empty(self, status, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _handle(self, send_body):
+        rel_path, file_path = self._resolve()
+        if file_path is None:
+            self._send_empty(404)
+            return
+
+        with open(file_path, "rb") as f:
+            st = os.fstat(f.fileno())
+            # 文件大小与配置一致时才使用内容哈希作为ETag，否则（如复制到一半）退回大小+修改时间
+            content_hash = self.server.index.content_hash(rel_path, st.st_size)
+            etag = f'"{content_hash}"' if content_hash else f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+            last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+            validators = [("ETag", etag), ("Last-Modified", last_modified), ("Accept-Ranges", "bytes"),
+                          ("Cache-Control", IMMUTABLE_CACHE_CONTROL if rel_path.startswith(IMMUTABLE_PREFIX)
+                           else REVALIDATE_CACHE_CONTROL)]
+
+            # 条件请求：If-None-Match优先于If-Modified-Since
+            if_none_match = self.headers.get("If-None-Match")
+            if if_none_match is not None:
+                if if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]:
+                    self._send_empty(304, validators)
+                    return
+            elif self.headers.get("If-Modified-Since"):
+                try:
+                    since = email.utils.parsedate_to_datetime(self.headers["If-Modified-Since"]).timestamp()
+                    if int(st.st_mtime) <= since:
+                        self._send_empty(304, validators)
+                        return
+                except (TypeError, ValueError):
+                    pass
+
+            # Range：带If-Range且校验值不符时忽略Range，返回完整文件
+            start, end = 0, st.st_size - 1
+            status = 200
+            range_header = self.headers.get("Range")
+            if_range = self.headers.get("If-Range")
+            if range_header and (if_range is None or if_range.strip() in (etag, last_modified)):
+                byte_range = parse_range_header(range_header, st.st_size)
+                if byte_range == (-1, -1):
+                    self._send_empty(416, [("Content-Range", f"bytes */{st.st_size}")])
+                    return
+                if byte_range:
+                    start, end = byte_range
+                    status = 206
+
+            length = max(0, end - start + 1)
+            self.send_response(status)
+            for name, value in validators:
+                self.send_header(name, value)
+            self.send_header("Content-Type", CONTENT_TYPES.get(os.path.splitext(file_path)[1].lower(),
+                                                              "application/octet-stream"))
+            self.send_header("Content-Length", str(length))
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{st.st_size}")
+            self.end_headers()
+            if send_body and length:
+                self.wfile.flush()
+                try:
+                    # socket.sendfile在支持的平台上使用os.sendfile（内核直接发送，不经过用户态）
+                    self.connection.sendfile(f, offset=start, count=length)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True
+                    return
+                with self.server.stats_lock:
+                    self.server.bytes_sent += length
+
+
+class PackServer:
+    """整合包局域网镜像：以HTTP提供mod_split输出的目录（config、mods、分包、bundle）"""
+
+    def __init__(self, root_dir=".", host="0.0.0.0", port=DEFAULT_PORT, verbose=False):
+        """
+        :param root_dir: 仓库根目录（包含config/mod_info.json）
+        :param host: 监听地址
+        :param port: 端口（0为随机端口）
+        :param verbose: 是否输出访问日志
+        """
+        root_dir = os.path.realpath(root_dir)
+        self.httpd = ThreadingHTTPServer((host, port), _ServeHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.root_dir = root_dir
+        self.httpd.index = ManifestIndex(root_dir)
+        self.httpd.verbose = verbose
+        self.httpd.stats_lock = threading.Lock()
+        self.httpd.bytes_sent = 0
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{'127.0.0.1' if host == '0.0.0.0' else host}:{port}/"
+
+    @property
+    def manifest_url(self):
+        """客户端mod_info_urls中使用的地址"""
+        return self.base_url + MANIFEST_REL_PATH
+
+    def start(self):
+        """后台线程运行"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="整合包局域网镜像")
+    sub = parser.add_subparsers(dest="command")
+    serve_parser = sub.add_parser("serve", help="以HTTP提供整合包文件（支持ETag、条件请求和Range）")
+    serve_parser.add_argument("--root", default=".", help="仓库根目录（包含config/mod_info.json，默认当前目录）")
+    serve_parser.add_argument("--host", default="0.0.0.0", help="监听地址（默认0.0.0.0）")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"端口（默认{DEFAULT_PORT}）")
+    serve_parser.add_argument("--verbose", action="store_true", help="输出访问日志")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        if not os.path.isfile(os.path.join(args.root, *MANIFEST_REL_PATH.split("/"))):
+            print(f"[警告] {args.root} 下没有 {MANIFEST_REL_PATH}，请先运行mod_split生成配置文件")
+        server = PackServer(args.root, args.host, args.port, args.verbose)
+        print(f"[信息] 局域网镜像已启动，客户端mod_info_urls中加入：http://<本机IP>:{args.port}/{MANIFEST_REL_PATH}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.stop()
+    else:
+        parser.print_help()
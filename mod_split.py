@@ -5,6 +5,12 @@ import math
 from datetime import datetime
 import argparse
 
+from mod_trace import span, count, traced
+from mod_version import get_mod_id_version
+from mod_transport import TRANSPORT_DIR_NAME, compress_file, prune_transport_dir
+from mod_tree import TreeRules, build_tree_manifest
+from util import calculate_quick_fingerprint
+
 root_dir = os.getcwd()  # 根目录
 config_dir = os.path.join(root_dir, "config")
 # 单位转换常量（1MB = 1024*1024 字节）
@@ -13,6 +19,10 @@ MB_TO_BYTES = 1024 * 1024
 SPLIT_THRESHOLD = 50 * MB_TO_BYTES
 # 分包大小：40MB
 CHUNK_SIZE = 30 * MB_TO_BYTES
+# 打包阈值：小于该大小的Mod可合并进bundle（减少小文件的请求数）
+BUNDLE_MEMBER_THRESHOLD = 1 * MB_TO_BYTES
+# 单个bundle的目标大小
+BUNDLE_TARGET_SIZE = 8 * MB_TO_BYTES
 
 
 def calculate_file_hash(file_path, hash_algorithm="md5"):
@@ -24,16 +34,18 @@ def calculate_file_hash(file_path, hash_algorithm="md5"):
     """
     try:
         hash_obj = hashlib.new(hash_algorithm)
-        with open(file_path, 'rb') as f:
+        with span("hash", file=os.path.basename(file_path)), open(file_path, 'rb') as f:
             # 分块读取文件，避免大文件占用过多内存
             while chunk := f.read(4096):
                 hash_obj.update(chunk)
+            count("hash_bytes", f.tell())
         return hash_obj.hexdigest()
     except Exception as e:
         print(f"计算文件 {file_path} 哈希失败: {e}")
         return None
 
 
+@traced("split_large_file")
 def split_large_file(file_path, output_dir=None):
     """
     分割大文件为指定大小的分包，并返回分包信息
@@ -101,11 +113,140 @@ def split_large_file(file_path, output_dir=None):
         return None
 
 
-def main(mod_dir, config_file_name="mod_info.json"):
+def _write_bundle(members, bundle_dir):
+    """
+    将一组小文件依次拼接为一个bundle，文件名为内容哈希
+    :param members: 文件信息列表（all_mod_files中的项）
+    :param bundle_dir: bundle输出目录
+    :return: bundle信息字典
+    """
+    tmp_path = os.path.join(bundle_dir, "bundle.tmp")
+    hash_obj = hashlib.md5()
+    offset = 0
+    member_list = []
+    with open(tmp_path, 'wb') as bundle_file:
+        for file_info in members:
+            with open(file_info["file_path"], 'rb') as src_file:
+                data = src_file.read()
+            bundle_file.write(data)
+            hash_obj.update(data)
+            member_list.append({"file_name": file_info["file_name"], "offset": offset, "size": len(data)})
+            offset += len(data)
+    bundle_hash = hash_obj.hexdigest()
+    bundle_name = f"{bundle_hash}.bundle"
+    bundle_path = os.path.join(bundle_dir, bundle_name)
+    os.replace(tmp_path, bundle_path)
+    return {
+        "bundle_name": bundle_name,
+        "bundle_path": bundle_path,
+        "bundle_size_bytes": offset,
+        "bundle_hash": bundle_hash,
+        "members": member_list
+    }
+
+
+def _group_by_hash_prefix(candidates, target_size, prefix_len=0):
+    """
+    按内容哈希前缀分组：整组不超过目标大小时作为一个bundle，否则按下一位哈希字符拆成最多16组继续划分
+    （分组只取决于同一前缀下的文件，新增/删除一个Mod只影响它所在的那一组，其余bundle保持不变）
+    :param candidates: 待打包的文件信息列表
+    :param target_size: 单个bundle的目标字节数
+    :param prefix_len: 当前已使用的哈希前缀长度
+    :return: 分组列表（组内按哈希排序）
+    """
+    total = sum(f["file_size_bytes"] for f in candidates)
+    if total <= target_size or len(candidates) == 1 or prefix_len >= len(candidates[0]["file_hash"]):
+        return [sorted(candidates, key=lambda f: (f["file_hash"], f["file_name"]))]
+    buckets = {}
+    for file_info in candidates:
+        buckets.setdefault(file_info["file_hash"][prefix_len], []).append(file_info)
+    groups = []
+    for key in sorted(buckets):
+        groups.extend(_group_by_hash_prefix(buckets[key], target_size, prefix_len + 1))
+    return groups
+
+
+@traced("pack_bundles")
+def pack_bundles(all_mod_files, bundle_dir, member_threshold=BUNDLE_MEMBER_THRESHOLD, target_size=BUNDLE_TARGET_SIZE):
+    """
+    将小Mod按内容哈希前缀分组打包为若干bundle，并在对应文件信息中记录所在bundle和偏移
+    （分组稳定：新增一个Mod只改变一个bundle，其余bundle的内容和名称不变，可继续命中缓存；
+    同名bundle内容必然相同，目录中不再被引用的旧bundle会被删除）
+    :param all_mod_files: 配置中的文件信息列表（会被原地补充bundle字段）
+    :param bundle_dir: bundle输出目录
+    :param member_threshold: 小于该字节数的未分割文件才会被打包
+    :param target_size: 单个bundle的目标字节数
+    :return: bundle信息列表
+    """
+    os.makedirs(bundle_dir, exist_ok=True)
+    candidates = [f for f in all_mod_files
+                  if not f["is_split"] and not f.get("sources") and f.get("file_hash")
+                  and f["file_size_bytes"] < member_threshold]
+    # 只有一个文件的组不打包（按单个文件下载即可）
+    groups = [group for group in _group_by_hash_prefix(candidates, target_size) if len(group) > 1] \
+        if candidates else []
+
+    bundles = []
+    for group in groups:
+        bundle_info = _write_bundle(group, bundle_dir)
+        for file_info, member in zip(group, bundle_info["members"]):
+            file_info["bundle"] = {
+                "bundle_name": bundle_info["bundle_name"],
+                "bundle_path": bundle_info["bundle_path"],
+                "bundle_size_bytes": bundle_info["bundle_size_bytes"],
+                "offset": member["offset"]
+            }
+        bundles.append(bundle_info)
+        print(f"  生成bundle: {bundle_info['bundle_name']} ({len(group)} 个文件, "
+              f"{bundle_info['bundle_size_bytes'] / MB_TO_BYTES:.2f}MB)")
+
+    # 清理不再被引用的旧bundle
+    current_names = {b["bundle_name"] for b in bundles}
+    for name in os.listdir(bundle_dir):
+        if name.endswith(".bundle") and name not in current_names:
+            os.remove(os.path.join(bundle_dir, name))
+    return bundles
+
+
+def load_mod_sources(path):
+    """
+    读取Mod的外部下载地址表（如Mod作者的CDN），格式为{文件哈希: [下载地址, ...]}
+    :param path: 地址表路径（不存在返回空字典）
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def attach_sources(all_mod_files, sources):
+    """
+    为配置中的Mod记录外部下载地址（sources字段，按优先级排列；只用于未分割文件，客户端下载失败时回退到线路）
+    :param all_mod_files: 配置中的文件信息列表（原地修改）
+    :param sources: 地址表{文件哈希: [下载地址, ...]}
+    """
+    for file_info in all_mod_files:
+        urls = sources.get(file_info["file_hash"])
+        if urls and not file_info.get("is_split"):
+            file_info["sources"] = list(urls)
+        else:
+            file_info.pop("sources", None)
+
+
+@traced("mod_split")
+def main(mod_dir, config_file_name="mod_info.json", config_output_dir=None, bundle_dir=None, instance_dir=None,
+         tree_rules=None, transport_dir=None, sources=None):
     """
     主函数：遍历Mod目录，分割大文件并生成包含所有Mod文件校验信息的配置文件
     :param mod_dir: Mod目录路径
     :param config_file_name: 生成的配置文件名
+    :param config_output_dir: 配置文件输出目录（默认根目录下的config）
+    :param bundle_dir: bundle输出目录（指定时将小Mod打包为bundle，默认不打包）
+    :param instance_dir: 整合包实例目录（指定时同时生成config、kubejs等目录的目录树配置文件）
+    :param tree_rules: 目录树的包含/排除规则（mod_tree.TreeRules，默认mod_tree中的默认规则）
+    :param transport_dir: 传输压缩文件目录（指定时为压缩后明显变小的文件另存zlib/lzma压缩版本，默认不压缩）
+    :param sources: 外部下载地址表{文件哈希: [下载地址, ...]}（见load_mod_sources，默认无）
+    :return: 生成的配置文件路径（失败返回None）
     """
     # 验证目录是否存在
     if not os.path.isdir(mod_dir):
@@ -137,9 +278,16 @@ def main(mod_dir, config_file_name="mod_info.json"):
                 "file_size_bytes": file_size,
                 "file_size_mb": round(file_size / MB_TO_BYTES, 2),
                 "file_hash": file_hash,
+                # 快速指纹（中央目录+抽样块），客户端日常启动时用于快速校验
+                "quick_fingerprint": calculate_quick_fingerprint(file_path),
                 "is_split": False  # 默认未分割
             }
 
+            # 记录modId和版本号，供客户端按modId匹配升级（非标准Mod为None）
+            mod_id, mod_version = get_mod_id_version(file_path)
+            file_info["mod_id"] = mod_id
+            file_info["mod_version"] = mod_version
+
             # 筛选大于100MB的文件，执行分割并补充分包信息
             if file_size > SPLIT_THRESHOLD:
                 # 分割文件
@@ -152,19 +300,61 @@ def main(mod_dir, config_file_name="mod_info.json"):
             else:
                 print(f"文件 {file_path} (大小: {file_size / MB_TO_BYTES:.2f}MB) 无需分割，仅记录校验信息")
 
+            # 传输压缩版本（仅未分割文件；JAR本身已压缩，通常不划算而不生成）
+            if transport_dir and not file_info["is_split"]:
+                transport = compress_file(file_path, file_hash, transport_dir)
+                if transport:
+                    file_info["transport"] = transport
+
             # 将当前文件信息加入配置（无论是否分割）
             split_config["all_mod_files"].append(file_info)
 
+    # 有外部下载地址的Mod由客户端直接从外部地址下载，不打包进bundle
+    attach_sources(split_config["all_mod_files"], sources or {})
+
+    # 小文件打包（可选）：客户端可整包或按区间下载bundle，省去逐个文件的请求
+    if bundle_dir:
+        split_config["bundles"] = pack_bundles(split_config["all_mod_files"], bundle_dir)
+        print(f"已将小Mod打包为 {len(split_config['bundles'])} 个bundle")
+
     # 生成JSON配置文件
-    if not os.path.exists(config_dir):
-        os.makedirs(config_dir)
-    config_file_path = os.path.join(config_dir, config_file_name)
+    config_output_dir = config_output_dir or config_dir
+    if not os.path.exists(config_output_dir):
+        os.makedirs(config_output_dir)
+
+    # 整合包其他目录（config、kubejs、资源包等）：单独的目录树配置文件，mod_info中只记录其根摘要
+    if instance_dir:
+        tree_file_name = "tree_info.json"
+        try:
+            # 实例目录记录为仓库内的相对路径（客户端据此拼接下载地址，不在仓库中时无法发布）
+            tree_manifest = build_tree_manifest(instance_dir, tree_rules or TreeRules(),
+                                                os.path.join(config_output_dir, tree_file_name),
+                                                transport_dir=transport_dir)
+        except ValueError as e:
+            print(f"生成目录树配置文件失败: {e}")
+            return
+        split_config["tree"] = {
+            "manifest_path": f"config/{tree_file_name}",
+            "root_hash": tree_manifest["root_hash"],
+            "file_count": tree_manifest["file_count"],
+        }
+        print(f"已生成目录树配置文件：{tree_manifest['file_count']} 个文件")
+
+    # 清理不再被引用的传输压缩文件
+    if transport_dir:
+        referenced = [f["transport"]["path"] for f in split_config["all_mod_files"] if f.get("transport")]
+        if instance_dir:
+            referenced += [t["path"] for t in tree_manifest.get("transport", {}).values()]
+        prune_transport_dir(transport_dir, referenced)
+        print(f"已生成 {len(set(referenced))} 个传输压缩文件")
+    config_file_path = os.path.join(config_output_dir, config_file_name)
     try:
         with open(config_file_path, 'w', encoding='utf-8') as f:
             # 格式化输出JSON，便于阅读
             json.dump(split_config, f, ensure_ascii=False, indent=4)
         print(f"\n配置文件已生成：{config_file_path}")
         print(f"配置文件包含 {len(split_config['all_mod_files'])} 个Mod文件的校验信息")
+        return config_file_path
     except Exception as e:
         print(f"生成配置文件失败: {e}")
 
@@ -176,8 +366,13 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="MC Mod大文件分割工具 - 将大于100MB的Mod分割为40MB分包，并生成验证配置文件")
     # parser.add_argument("--mod-dir", required=True, help="MC Mod目录的绝对/相对路径")
     # parser.add_argument("--config-name", default="mod_split_config.json", help="生成的配置文件名（默认：mod_split_config.json）")
-    # args = parser.parse_args()
+    parser.add_argument("--bundle-dir", default=None, help="将小于1MB的Mod打包为bundle并输出到该目录（默认不打包）")
+    parser.add_argument("--instance-dir", default=None, help="同时生成该整合包实例目录下config、kubejs等目录的目录树配置文件")
+    parser.add_argument("--compress", action="store_true", help=f"为可压缩的文件生成传输压缩版本（输出到{TRANSPORT_DIR_NAME}目录）")
+    parser.add_argument("--sources", default=None, help="外部下载地址表（JSON：{文件哈希: [下载地址, ...]}）")
+    args = parser.parse_args()
 
     # 执行主函数
     # main(args.mod_dir, args.config_name)
-    main(".minecraft/versions/CMagic_client/mods")
\ No newline at end of file
+    main(".minecraft/versions/CMagic_client/mods", bundle_dir=args.bundle_dir, instance_dir=args.instance_dir,
+         transport_dir=TRANSPORT_DIR_NAME if args.compress else None, sources=load_mod_sources(args.sources))
\ No newline at end of file
@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+import statistics
+from datetime import datetime
+from urllib.parse import urlsplit
+
+root_dir = os.getcwd()  # 根目录
+config_dir = os.path.join(root_dir, "config")
+# 运行统计文件（每行一条JSON记录，只追加不改写）
+stats_file_path = os.path.join(config_dir, "update_stats.jsonl")
+
+# 统计记录中的阶段（与main.py中的追踪区间名称一致）
+PHASES = ["update", "prepare_dirs", "fetch_manifest", "get_fastest_url", "apply_prefetch", "validate", "scan_local",
+          "sync", "sync_tree", "apply", "git_download", "git_extract"]
+# 未导出追踪文件时只记录统计所需的区间（阶段、单文件哈希次数、各线路下载和测速）
+STATS_SPANS = PHASES + ["hash", "download", "probe_mirror"]
+# 耗时超过历史中位数的该倍数时视为退化
+REGRESSION_RATIO = 1.25
+
+
+def _mirror_name(url):
+    """取线路的域名作为统计键（同一线路不同文件合并统计）"""
+    return urlsplit(url).netloc or url
+
+
+def build_run_record(tracer, **extra):
+    """
+    根据追踪器记录生成一条运行统计
+    :param tracer: mod_trace.Tracer对象
+    :param extra: 附加字段（如mirror所选线路、pack_version整合包版本）
+    :return: 统计记录字典
+    """
+    summary = tracer.summary()
+    counters = summary["counters"]
+
+    # 各线路吞吐量（字节/秒），由每次下载区间的字节数和耗时计算
+    mirror_bytes = {}
+    mirror_seconds = {}
+    mirror_latency = {}
+    for event in list(tracer.events):
+        if event["ph"] != "X":
+            continue
+        url = event["args"].get("url")
+        if not url:
+            continue
+        mirror = _mirror_name(url)
+        if event["name"] == "download" and "bytes" in event["args"]:
+            mirror_bytes[mirror] = mirror_bytes.get(mirror, 0) + event["args"]["bytes"]
+            mirror_seconds[mirror] = mirror_seconds.get(mirror, 0) + event["dur"] / 1e6
+        elif event["name"] == "probe_mirror" and "error" not in event["args"]:
+            mirror_latency[mirror] = round(event["dur"] / 1000, 1)
+
+    hits = counters.get("hash_cache_hits", 0)
+    misses = counters.get("hash_cache_misses", 0)
+    record = {
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "phases_ms": {name: summary["spans"][name]["total_ms"] for name in PHASES if name in summary["spans"]},
+        "bytes_hashed": counters.get("hash_bytes", 0),
+        "bytes_quick_read": counters.get("quick_bytes", 0),
+        "bytes_downloaded": counters.get("download_bytes", 0),
+        "files_hashed": summary["spans"].get("hash", {}).get("count", 0),
+        "hash_cache_hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+        "mirror_throughput_bps": {m: int(mirror_bytes[m] / mirror_seconds[m])
+                                  for m in mirror_bytes if mirror_seconds[m] > 0},
+        "mirror_latency_ms": mirror_latency,
+    }
+    if extra.get("mirror"):
+        extra["mirror"] = _mirror_name(extra["mirror"])
+    record.update(extra)
+    return record
+
+
+def append_run_record(record, file_path=None):
+    """
+    追加一条运行统计到统计文件
+    :param record: build_run_record生成的记录
+    :param file_path: 统计文件路径（默认config/update_stats.jsonl）
+    :return: 成功返回True，否则False
+    """
+    file_path = file_path or stats_file_path
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        with open(file_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return True
+    except Exception as e:
+        print(f"[错误] 写入运行统计失败：{str(e)}")
+        return False
+
+
+def load_run_records(file_path=None):
+    """
+    读取全部运行统计（跳过损坏的行，如写入时被中断）
+    :param file_path: 统计文件路径（默认config/update_stats.jsonl）
+    :return: 记录列表（按写入顺序）
+    """
+    file_path = file_path or stats_file_path
+    records = []
+    if not os.path.isfile(file_path):
+        return records
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def find_regressions(records, window=5, ratio=REGRESSION_RATIO):
+    """
+    将最新一次运行与之前若干次运行的中位数比较，找出变慢的指标
+    :param records: 运行记录列表
+    :param window: 参与比较的历史记录数
+    :param ratio: 超过中位数的倍数阈值
+    :return: 退化项列表，每项为(指标名, 最新值, 历史中位数)
+    """
+    if len(records) < 2:
+        return []
+    latest = records[-1]
+    history = records[-window - 1:-1]
+    regressions = []
+
+    metrics = [(f"phases_ms.{name}", lambda r, n=name: r.get("phases_ms", {}).get(n)) for name in PHASES]
+    metrics.append(("bytes_hashed", lambda r: r.get("bytes_hashed")))
+    for mirror in latest.get("mirror_throughput_bps", {}):
+        # 吞吐量越低越差，取倒数按同样规则比较
+        metrics.append((f"mirror_throughput_bps.{mirror}",
+                        lambda r, m=mirror: (1 / r["mirror_throughput_bps"][m])
+                        if r.get("mirror_throughput_bps", {}).get(m) else None))
+
+    for name, getter in metrics:
+        latest_value = getter(latest)
+        values = [v for v in (getter(r) for r in history) if v]
+        if latest_value is None or not values:
+            continue
+        median = statistics.median(values)
+        if median > 0 and latest_value > median * ratio:
+            if name.startswith("mirror_throughput_bps."):
+                regressions.append((name, round(1 / latest_value), round(1 / median)))
+            else:
+                regressions.append((name, latest_value, median))
+    return regressions
+
+
+def print_stats(records, last=10, window=5):
+    """
+    输出最近若干次运行的统计表和退化项
+    :param records: 运行记录列表
+    :param last: 展示的记录数
+    :param window: 退化比较使用的历史记录数
+    """
+    if not records:
+        print("[信息] 暂无运行统计记录")
+        return
+
+    shown = records[-last:]
+    print("=" * 100)
+    print(f"{'时间':<20}{'版本':<21}{'线路':<20}{'总耗时(s)':>10}{'校验(s)':>9}{'哈希(MB)':>10}{'下载(MB)':>10}")
+    print("-" * 100)
+    for record in shown:
+        phases = record.get("phases_ms", {})
+        print(f"{record.get('time', ''):<20}"
+              f"{str(record.get('pack_version', '-')):<21}"
+              f"{str(record.get('mirror', '-'))[:19]:<20}"
+              f"{phases.get('update', 0) / 1000:>10.2f}"
+              f"{phases.get('validate', 0) / 1000:>9.2f}"
+              f"{record.get('bytes_hashed', 0) / 1024 / 1024:>10.1f}"
+              f"{record.get('bytes_downloaded', 0) / 1024 / 1024:>10.1f}")
+    print("=" * 100)
+
+    regressions = find_regressions(records, window)
+    if not regressions:
+        print("[信息] 最近一次运行未发现性能退化")
+        return
+    print(f"[警告] 最近一次运行相比前 {window} 次的中位数出现退化：")
+    for name, latest_value, median in regressions:
+        print(f"  - {name}：{latest_value}（历史中位数：{median}）")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="更新器运行统计")
+    sub = parser.add_subparsers(dest="command")
+    stats_parser = sub.add_parser("stats", help="显示最近的运行统计和性能退化")
+    stats_parser.add_argument("--last", type=int, default=10, help="展示最近的记录数（默认10）")
+    stats_parser.add_argument("--window", type=int, default=5, help="退化比较的历史记录数（默认5）")
+    stats_parser.add_argument("--file", default=None, help="统计文件路径（默认config/update_stats.jsonl）")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        print_stats(load_run_records(args.file), args.last, args.window)
+    else:
+        parser.print_help()
@@ -0,0 +1,225 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+# 环境变量：设置为输出路径时，main.py自动开启追踪并在结束时导出
+TRACE_ENV_VAR = "CMAGIC_TRACE"
+
+# 当前线程所属的追踪器：只有调用start的线程及其通过bind启动的工作线程会记录
+# （同一进程中的后台预下载、完整校验、监视器、局域网共享等线程不计入本次运行）
+_active = contextvars.ContextVar("cmagic_tracer", default=None)
+
+
+class _NullSpan:
+    """追踪关闭时使用的空上下文（共享单例，几乎无开销）"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def add(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """单个计时区间，退出时记录为一个完整事件（Chrome Trace的ph=X）"""
+
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args["error"] = repr(exc)
+        self.tracer.record(self.name, self.start, end, self.args)
+        return False
+
+    def add(self, **args):
+        """在区间结束前补充参数（如实际下载字节数）"""
+        self.args.update(args)
+
+
+class Tracer:
+    """
+    轻量追踪器：记录嵌套计时区间和计数器，可导出为Chrome Trace JSON
+    （可在 chrome://tracing 或 https://ui.perfetto.dev 中查看）
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.names = None  # 只记录这些名称的区间（None为全部记录）
+        self.origin = time.perf_counter()
+        self.events = []
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def start(self, names=None):
+        """
+        开启追踪并清空之前的记录（全局span/traced/count只记录当前线程及其通过bind启动的工作线程）
+        :param names: 只记录这些名称的区间，计数器只累加不生成事件（None为全部记录，导出追踪文件时使用）
+        """
+        with self._lock:
+            self.origin = time.perf_counter()
+            self.events = []
+            self.counters = {}
+            self.names = set(names) if names is not None else None
+            self.enabled = True
+        _active.set(self)
+
+    def stop(self):
+        """关闭追踪（已记录的数据保留，可继续导出）"""
+        self.enabled = False
+
+    def span(self, name, **args):
+        """
+        创建计时区间（with语句使用）
+        :param name: 区间名称（如"validate"、"hash"）
+        :param args: 附加参数（如文件名、字节数）
+        """
+        if not self.wants(name):
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def wants(self, name):
+        """是否记录该名称的区间"""
+        return self.enabled and (self.names is None or name in self.names)
+
+    def record(self, name, start, end, args=None):
+        """记录一个已完成的区间（时间为perf_counter秒）"""
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": (start - self.origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": args or {},
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def count(self, name, value=1):
+        """累加计数器（如hash_bytes、download_bytes）"""
+        if not self.enabled:
+            return
+        with self._lock:
+            total = self.counters.get(name, 0) + value
+            self.counters[name] = total
+            if self.names is not None:
+                return
+            self.events.append({
+                "name": name,
+                "ph": "C",
+                "ts": (time.perf_counter() - self.origin) * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": {name: total},
+            })
+
+    def summary(self):
+        """
+        汇总各区间总耗时和计数器
+        :return: {"spans": {名称: {"count": 次数, "total_ms": 总耗时}}, "counters": {...}}
+        """
+        spans = {}
+        with self._lock:
+            for event in self.events:
+                if event["ph"] != "X":
+                    continue
+                item = spans.setdefault(event["name"], {"count": 0, "total_ms": 0.0})
+                item["count"] += 1
+                item["total_ms"] += event["dur"] / 1000
+            counters = dict(self.counters)
+        for item in spans.values():
+            item["total_ms"] = round(item["total_ms"], 3)
+        return {"spans": spans, "counters": counters}
+
+    def export(self, file_path):
+        """
+        导出为Chrome Trace JSON文件
+        :param file_path: 输出路径
+        :return: 成功返回True，否则False
+        """
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+            with self._lock:
+                data = {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+            with open(file_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            return True
+        except Exception as e:
+            print(f"[错误] 导出追踪文件 {file_path} 失败：{str(e)}")
+            return False
+
+
+# 全局追踪器（各模块共用）
+tracer = Tracer()
+
+
+def span(name, **args):
+    """当前线程所属追踪器的计时区间（不在追踪范围内或不记录该区间时返回共享空上下文）"""
+    current = _active.get()
+    if current is None or not current.wants(name):
+        return _NULL_SPAN
+    return _Span(current, name, args)
+
+
+def traced(name):
+    """
+    装饰器：将整个函数调用记录为一个计时区间
+    :param name: 区间名称
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            current = _active.get()
+            if current is None or not current.wants(name):
+                return func(*args, **kwargs)
+            with _Span(current, name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1):
+    """当前线程所属追踪器的计数器"""
+    current = _active.get()
+    if current is not None and current.enabled:
+        current.count(name, value)
+
+
+def bind(func):
+    """
+    让工作线程继承当前线程的追踪范围（threading.Thread和线程池不会继承contextvars）
+    :param func: 在工作线程中执行的函数
+    :return: 包装后的函数（当前线程不在追踪范围内时原样返回）
+    """
+    current = _active.get()
+    if current is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _active.set(current)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _active.reset(token)
+    return wrapper
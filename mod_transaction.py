@@ -0,0 +1,146 @@
+import json
+import os
+from datetime import datetime
+
+from mod_trace import traced
+from util import get_file_size_bytes, get_json_from_file
+
+root_dir = os.getcwd()  # 根目录
+temp_dir = os.path.join(root_dir, "temp")
+# 应用日志：存在即表示有未完成的应用（启动时按日志继续完成）
+journal_path = os.path.join(temp_dir, "apply_journal.json")
+
+
+def _fsync_dir(dir_path):
+    """将目录项（改名/删除）落盘（Windows不支持打开目录，跳过）"""
+    try:
+        fd = os.open(dir_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _write_journal(journal, path):
+    """写入日志（先写临时文件并落盘，再改名，保证日志本身要么完整要么不存在）"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(journal, f, ensure_ascii=False, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(os.path.dirname(os.path.abspath(path)))
+
+
+class UpdateTransaction:
+    """
+    更新事务：新文件先全部暂存并校验，写入日志后再依次改名到位，配置文件最后替换
+    中途中断时，下次启动调用recover_journal按日志继续完成（只需检查文件大小，无需重新计算哈希）
+    """
+
+    def __init__(self, journal_file=None):
+        """
+        :param journal_file: 日志路径（默认temp/apply_journal.json）
+        """
+        self.journal_file = journal_file or journal_path
+        self.moves = []
+        self.removes = []
+        self.manifest = None
+
+    def add_file(self, staged_path, target_path, size=None):
+        """
+        登记一个已暂存（已校验）的文件
+        :param staged_path: 暂存路径（须与目标在同一磁盘，改名才是原子的）
+        :param target_path: 目标路径
+        :param size: 文件字节数（恢复时用于确认文件完整，默认取暂存文件大小）
+        """
+        if size is None:
+            size = get_file_size_bytes(staged_path)
+        self.moves.append({"src": os.path.abspath(staged_path), "dst": os.path.abspath(target_path), "size": size})
+
+    def remove_file(self, path):
+        """登记需要删除的文件（如被新版本取代的旧Mod）"""
+        self.removes.append(os.path.abspath(path))
+
+    def set_manifest(self, staged_manifest, target_manifest):
+        """登记配置文件（在所有文件到位后最后替换，替换后本地即视为新版本）"""
+        self.manifest = {"src": os.path.abspath(staged_manifest), "dst": os.path.abspath(target_manifest)}
+
+    @traced("apply_transaction")
+    def commit(self, log=print):
+        """
+        执行事务：写日志 → 改名文件 → 删除旧文件 → 替换配置文件 → 删除日志
+        :param log: 日志输出函数
+        :return: 全部完成返回True
+        """
+        for move in self.moves:
+            if not os.path.exists(move["src"]):
+                raise Exception(f"暂存文件不存在：{move['src']}")
+        journal = {
+            "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "moves": self.moves,
+            "removes": self.removes,
+            "manifest": self.manifest,
+        }
+        _write_journal(journal, self.journal_file)
+        return _roll_forward(journal, self.journal_file, log)
+
+
+def _roll_forward(journal, journal_file, log):
+    """
+    按日志完成应用（可重复执行：已完成的步骤会被跳过）
+    :return: 全部完成返回True；有文件既不在暂存处也不在目标处时返回False（保留旧配置文件，交由常规校验修复）
+    """
+    complete = True
+    touched_dirs = set()
+    for move in journal["moves"]:
+        if os.path.exists(move["src"]):
+            os.replace(move["src"], move["dst"])
+            touched_dirs.add(os.path.dirname(move["dst"]))
+        elif not os.path.exists(move["dst"]) or os.path.getsize(move["dst"]) != move["size"]:
+            log(f"[错误] 文件 {os.path.basename(move['dst'])} 既不在暂存目录也不完整，更新未完成")
+            complete = False
+    destinations = {move["dst"] for move in journal["moves"]}
+    for path in journal["removes"]:
+        if path not in destinations and os.path.exists(path):
+            os.remove(path)
+            touched_dirs.add(os.path.dirname(path))
+            log(f"🗑️ 删除旧版本 {os.path.basename(path)}")
+    for dir_path in touched_dirs:
+        _fsync_dir(dir_path)
+
+    manifest = journal.get("manifest")
+    if complete and manifest:
+        if os.path.exists(manifest["src"]):
+            os.replace(manifest["src"], manifest["dst"])
+            _fsync_dir(os.path.dirname(manifest["dst"]))
+        elif not os.path.exists(manifest["dst"]):
+            log(f"[错误] 配置文件 {manifest['src']} 不存在，更新未完成")
+            complete = False
+    os.remove(journal_file)
+    return complete
+
+
+@traced("recover_journal")
+def recover_journal(journal_file=None, log=print):
+    """
+    启动时检查是否有中断的应用，有则按日志继续完成
+    :param journal_file: 日志路径（默认temp/apply_journal.json）
+    :param log: 日志输出函数
+    :return: 无中断或恢复完成返回True，恢复不完整返回False
+    """
+    journal_file = journal_file or journal_path
+    if not os.path.exists(journal_file):
+        return True
+    journal = get_json_from_file(journal_file)
+    if journal is None:
+        # 日志无法读取：丢弃日志，本地配置文件仍为旧版本，由常规校验修复
+        os.remove(journal_file)
+        return False
+    log(f"🔧 检测到上次未完成的更新（{journal['created']}），继续完成")
+    return _roll_forward(journal, journal_file, log)
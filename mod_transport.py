@@ -0,0 +1,195 @@
+import hashlib
+import lzma
+import os
+import zlib
+
+# 传输压缩文件的目录名（仓库根目录下，文件名为 <原文件哈希>.<扩展名>）
+TRANSPORT_DIR_NAME = "transport"
+# 支持的压缩方式及扩展名（均为标准库实现，客户端无需额外依赖）
+CODEC_EXTENSIONS = {"zlib": "zz", "lzma": "xz"}
+# 压缩后不超过原大小的该比例才保存压缩版本（JAR等已压缩文件通常达不到）
+MIN_SAVING_RATIO = 0.8
+# 小于该字节数的文件不压缩（节省的字节抵不上额外的处理）
+MIN_COMPRESS_SIZE = 1024
+# 读取/压缩块大小
+BLOCK_SIZE = 256 * 1024
+
+
+def _new_compressor(codec):
+    if codec == "zlib":
+        return zlib.compressobj(9)
+    if codec == "lzma":
+        return lzma.LZMACompressor(format=lzma.FORMAT_XZ, preset=6)
+    raise ValueError(f"不支持的压缩方式：{codec}")
+
+
+def new_decompressor(codec):
+    """
+    创建流式解压器（decompress逐块解压，eof表示压缩数据已完整结束）
+    :param codec: 压缩方式（zlib/lzma）
+    """
+    if codec == "zlib":
+        return zlib.decompressobj()
+    if codec == "lzma":
+        return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+    raise ValueError(f"不支持的压缩方式：{codec}")
+
+
+def compress_file(file_path, file_hash, transport_dir, codecs=("zlib", "lzma")):
+    """
+    为文件生成传输压缩版本：依次尝试各压缩方式，保留最小且足够划算的一个
+    :param file_path: 原文件路径
+    :param file_hash: 原文件哈希（作为压缩文件名，相同内容只保存一份）
+    :param transport_dir: 压缩文件输出目录
+    :param codecs: 尝试的压缩方式
+    :return: 传输信息字典{"codec", "path", "size_bytes", "hash"}（hash为压缩后数据的MD5）；不划算返回None
+    """
+    file_size = os.path.getsize(file_path)
+    if file_size < MIN_COMPRESS_SIZE:
+        return None
+    os.makedirs(transport_dir, exist_ok=True)
+    # 上次生成的压缩文件（每个原文件只保留最优的一个）解压后大小一致时直接复用，不再重新压缩
+    for codec in codecs:
+        out_path = os.path.join(transport_dir, f"{file_hash}.{CODEC_EXTENSIONS[codec]}")
+        if os.path.isfile(out_path):
+            existing = _existing_transport(out_path, codec, file_size)
+            if existing:
+                return existing
+    best = None
+    for codec in codecs:
+        out_path = os.path.join(transport_dir, f"{file_hash}.{CODEC_EXTENSIONS[codec]}")
+        tmp_path = out_path + ".tmp"
+        compressor = _new_compressor(codec)
+        hash_obj = hashlib.md5()
+        size = 0
+        with open(file_path, "rb") as src, open(tmp_path, "wb") as dst:
+            while block := src.read(BLOCK_SIZE):
+                data = compressor.compress(block)
+                if data:
+                    dst.write(data)
+                    hash_obj.update(data)
+                    size += len(data)
+            data = compressor.flush()
+            dst.write(data)
+            hash_obj.update(data)
+            size += len(data)
+        if size <= file_size * MIN_SAVING_RATIO and (best is None or size < best["size_bytes"]):
+            if best is not None:
+                os.remove(best["path"])
+            os.replace(tmp_path, out_path)
+            best = {"codec": codec, "path": out_path.replace("\\", "/"), "size_bytes": size,
+                    "hash": hash_obj.hexdigest()}
+        else:
+            os.remove(tmp_path)
+    return best
+
+
+def _existing_transport(out_path, codec, file_size):
+    """
+    读取已有的压缩文件：逐块解压只统计字节数，解压后大小与原文件一致才视为可用
+    :return: 传输信息字典（同compress_file）；不可用返回None
+    """
+    decompressor = new_decompressor(codec)
+    hash_obj = hashlib.md5()
+    decoded = 0
+    try:
+        with open(out_path, "rb") as f:
+            while block := f.read(BLOCK_SIZE):
+                hash_obj.update(block)
+                for data in iter_decompress(decompressor, block):
+                    decoded += len(data)
+                    if decoded > file_size:
+                        return None
+        if hasattr(decompressor, "flush"):
+            decoded += len(decompressor.flush())
+    except (OSError, zlib.error, lzma.LZMAError):
+        return None
+    if decoded != file_size or not decompressor.eof:
+        return None
+    return {"codec": codec, "path": out_path.replace("\\", "/"), "size_bytes": os.path.getsize(out_path),
+            "hash": hash_obj.hexdigest()}
+
+
+def iter_decompress(decompressor, data, max_length=BLOCK_SIZE):
+    """
+    分步解压一块压缩数据，每步最多输出max_length字节（压缩比异常的数据不会一次性占满内存）
+    :param decompressor: new_decompressor创建的解压器
+    :param data: 压缩数据
+    :param max_length: 每步最多输出的字节数
+    :return: 解压后数据块的生成器
+    """
+    if isinstance(decompressor, lzma.LZMADecompressor):
+        # lzma的未消耗数据保存在解压器内部，needs_input为False时以空数据继续
+        out = decompressor.decompress(data, max_length)
+        while True:
+            if out:
+                yield out
+            if decompressor.eof or decompressor.needs_input:
+                return
+            out = decompressor.decompress(b"", max_length)
+    else:
+        while data:
+            out = decompressor.decompress(data, max_length)
+            data = decompressor.unconsumed_tail
+            if out:
+                yield out
+            if decompressor.eof:
+                return
+
+
+def prune_transport_dir(transport_dir, referenced_paths):
+    """删除传输目录中不再被配置文件引用的压缩文件"""
+    if not os.path.isdir(transport_dir):
+        return
+    keep = {os.path.normcase(os.path.abspath(p)) for p in referenced_paths}
+    for name in os.listdir(transport_dir):
+        path = os.path.join(transport_dir, name)
+        if os.path.normcase(os.path.abspath(path)) not in keep:
+            os.remove(path)
+
+
+class DecodingWriter:
+    """
+    边下载边解压写入：写入的是压缩数据，落盘的是解压后的内容，同时计算解压后内容的哈希
+    （压缩数据的哈希由下载函数计算，两者在同一次传输中完成校验，无需再读一遍磁盘）
+    """
+
+    def __init__(self, f, codec, hash_algorithm="md5", max_size=None):
+        """
+        :param f: 已打开的输出文件
+        :param codec: 压缩方式（zlib/lzma）
+        :param hash_algorithm: 解压后内容的哈希算法
+        :param max_size: 解压后的最大字节数（超过即视为数据异常，避免异常数据写满磁盘）
+        """
+        self.f = f
+        self.decompressor = new_decompressor(codec)
+        self.hash_obj = hashlib.new(hash_algorithm)
+        self.max_size = max_size
+        self.size = 0
+
+    def write(self, data):
+        # 分步解压，解压后大小超过上限时立即停止（不会先把整块数据解压到内存）
+        for out in iter_decompress(self.decompressor, data):
+            self._output(out)
+
+    def finish(self):
+        """写入剩余数据（压缩数据不完整时抛出异常）"""
+        if hasattr(self.decompressor, "flush"):
+            self._output(self.decompressor.flush())
+        if not self.decompressor.eof:
+            raise Exception("压缩数据不完整")
+
+    def _output(self, data):
+        if data:
+            self.size += len(data)
+            if self.max_size is not None and self.size > self.max_size:
+                raise Exception(f"解压后大小超过预期的{self.max_size}字节")
+            self.f.write(data)
+            self.hash_obj.update(data)
+
+    def verify(self, expected_size=None, expected_hash=None):
+        """校验解压后的大小和哈希，不一致时抛出异常"""
+        if expected_size is not None and self.size != expected_size:
+            raise Exception(f"解压后大小不匹配：{self.size}字节，预期{expected_size}字节")
+        if expected_hash and self.hash_obj.hexdigest() != expected_hash:
+            raise Exception(f"解压后哈希不匹配：{self.hash_obj.hexdigest()}，预期{expected_hash}")
@@ -0,0 +1,393 @@
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+
+from mod_download import download_file
+from mod_pipeline import DOWNLOAD_WORKERS, build_file_urls
+from mod_scheduler import FOREGROUND
+from mod_trace import bind, count, span, traced
+from mod_transport import compress_file
+from util import calculate_file_hash, get_json_from_file
+
+root_dir = os.getcwd()  # 根目录
+temp_dir = os.path.join(root_dir, "temp")
+# 目录树配置文件在仓库中的相对路径
+TREE_MANIFEST_REL_PATH = "config/tree_info.json"
+# 本地文件状态缓存（相对路径 -> [大小, 修改时间, 哈希]），大小和修改时间未变的文件不重新计算哈希
+tree_cache_path = os.path.join(temp_dir, "tree_cache.json")
+
+# 默认同步的目录（相对整合包实例目录；Mod目录由mod_info.json单独处理）
+DEFAULT_INCLUDE = ["config/**", "kubejs/**", "resourcepacks/**", "shaderpacks/**", "defaultconfigs/**"]
+# 默认排除（日志、缓存、系统文件）
+DEFAULT_EXCLUDE = ["**/*.log", "**/.DS_Store", "**/Thumbs.db", "**/desktop.ini", "**/*.tmp"]
+
+
+class TreeRules:
+    """包含/排除规则（glob，路径使用/分隔，*可匹配多级目录，排除优先于包含）"""
+
+    def __init__(self, include=None, exclude=None):
+        self.include = list(DEFAULT_INCLUDE if include is None else include)
+        self.exclude = list(DEFAULT_EXCLUDE if exclude is None else exclude)
+        # 包含规则中第一个通配符之前的目录前缀，用于跳过不可能匹配的目录
+        # （不含通配符的规则只需进入其所在目录）
+        self._prefixes = []
+        for pattern in self.include:
+            wildcard = next((i for i, ch in enumerate(pattern) if ch in "*?["), None)
+            literal = pattern if wildcard is None else pattern[:wildcard]
+            prefix = literal[:literal.rfind("/") + 1]
+            if prefix or wildcard is not None:
+                self._prefixes.append(prefix)
+
+    def matches(self, rel_path):
+        """文件是否需要同步"""
+        if any(fnmatch.fnmatchcase(rel_path, pattern) for pattern in self.exclude):
+            return False
+        return any(fnmatch.fnmatchcase(rel_path, pattern) for pattern in self.include)
+
+    def should_descend(self, rel_dir):
+        """目录是否可能包含需要同步的文件（被整体排除或不在任何包含规则下的目录直接跳过）"""
+        dir_prefix = rel_dir + "/"
+        if any(fnmatch.fnmatchcase(dir_prefix, pattern) for pattern in self.exclude):
+            return False
+        return any(dir_prefix.startswith(prefix) or prefix.startswith(dir_prefix) for prefix in self._prefixes)
+
+    def to_dict(self):
+        return {"include": self.include, "exclude": self.exclude}
+
+
+class StatCache:
+    """持久化的文件状态缓存（JSON），大小和修改时间都未变化时直接复用上次的哈希"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._entries = get_json_from_file(path) or {}
+
+    def file_hash(self, rel_path, file_path, st):
+        with self._lock:
+            cached = self._entries.get(rel_path)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            self.hits += 1
+            return cached[2]
+        self.misses += 1
+        file_hash = calculate_file_hash(file_path)
+        with self._lock:
+            self._entries[rel_path] = [st.st_size, st.st_mtime_ns, file_hash]
+        return file_hash
+
+    def save(self, seen=None):
+        """
+        写入缓存文件
+        :param seen: 本次扫描到的相对路径集合（指定时删除已不存在的文件记录）
+        """
+        if not self.path:
+            return
+        with self._lock:
+            if seen is not None:
+                self._entries = {k: v for k, v in self._entries.items() if k in seen}
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(self.path + ".tmp", self.path)
+
+
+def _dir_hash(files, dirs, tree):
+    """目录摘要哈希：由直接包含的文件（名称、大小、哈希）和子目录摘要计算，任一后代变化都会改变摘要"""
+    hash_obj = hashlib.md5()
+    for name in sorted(files):
+        size, file_hash = files[name]
+        hash_obj.update(f"f {name} {size} {file_hash}\n".encode("utf-8"))
+    for child in sorted(dirs):
+        hash_obj.update(f"d {child.rsplit('/', 1)[-1]} {tree[child]['hash']}\n".encode("utf-8"))
+    return hash_obj.hexdigest()
+
+
+@traced("scan_tree")
+def scan_tree(instance_dir, rules, cache=None):
+    """
+    扫描实例目录，生成目录摘要树
+    :param instance_dir: 整合包实例目录（如.minecraft/versions/CMagic_client）
+    :param rules: TreeRules
+    :param cache: 可选的StatCache（为None时所有文件都计算哈希）
+    :return: 目录树字典：目录相对路径（根目录为""） -> {"hash", "files": {文件名: [大小, 哈希]}, "dirs": [子目录相对路径]}
+             （不含任何需要同步文件的目录不出现在树中）
+    """
+    tree = {}
+    seen = set()
+
+    def walk(dir_path, rel_dir):
+        files = {}
+        dirs = []
+        try:
+            entries = list(os.scandir(dir_path))
+        except OSError:
+            return False
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if rules.should_descend(rel_path) and walk(entry.path, rel_path):
+                    dirs.append(rel_path)
+            elif entry.is_file() and rules.matches(rel_path):
+                st = entry.stat()
+                file_hash = cache.file_hash(rel_path, entry.path, st) if cache else calculate_file_hash(entry.path)
+                if file_hash:
+                    files[entry.name] = [st.st_size, file_hash]
+                    seen.add(rel_path)
+        if not files and not dirs:
+            return False
+        tree[rel_dir] = {"hash": _dir_hash(files, dirs, tree), "files": files, "dirs": sorted(dirs)}
+        return True
+
+    if os.path.isdir(instance_dir) and not walk(instance_dir, ""):
+        tree[""] = {"hash": _dir_hash({}, [], tree), "files": {}, "dirs": []}
+    if cache:
+        count("tree_cache_hits", cache.hits)
+        count("tree_cache_misses", cache.misses)
+        cache.save(seen)
+    return tree
+
+
+def repo_relative_dir(path):
+    """
+    目录相对仓库根目录（当前目录）的路径，客户端按该路径拼接下载地址
+    :param path: 目录路径（相对或绝对）
+    :return: 使用/分隔的相对路径（目录不在仓库中时抛出ValueError）
+    """
+    try:
+        rel_path = os.path.relpath(os.path.abspath(path), root_dir)
+    except ValueError:
+        rel_path = None  # Windows下位于不同盘符
+    if rel_path is None or rel_path == os.pardir or rel_path.startswith(os.pardir + os.sep):
+        raise ValueError(f"目录 {path} 不在仓库目录 {root_dir} 中")
+    return rel_path.replace("\\", "/")
+
+
+def build_tree_manifest(instance_dir, rules=None, output_path=None, repo_instance_dir=None, transport_dir=None):
+    """
+    生成目录树配置文件（发布端使用）
+    :param instance_dir: 整合包实例目录
+    :param rules: TreeRules（默认DEFAULT_INCLUDE/DEFAULT_EXCLUDE）
+    :param output_path: 输出路径（默认config/tree_info.json）
+    :param repo_instance_dir: 实例目录在仓库中的相对路径（默认由instance_dir相对当前目录计算，不记录绝对路径）
+    :param transport_dir: 传输压缩文件目录（指定时为可压缩的文件生成压缩版本，按内容哈希记录在transport中）
+    :return: 配置文件内容
+    """
+    rules = rules or TreeRules()
+    if repo_instance_dir is None:
+        repo_instance_dir = repo_relative_dir(instance_dir)
+    tree = scan_tree(instance_dir, rules)
+    transport = {}
+    if transport_dir:
+        for rel_dir, node in tree.items():
+            for name, (size, file_hash) in node["files"].items():
+                if file_hash in transport:
+                    continue
+                file_path = os.path.join(instance_dir, *rel_dir.split("/"), name) if rel_dir else \
+                    os.path.join(instance_dir, name)
+                transport[file_hash] = compress_file(file_path, file_hash, transport_dir)
+        transport = {k: v for k, v in transport.items() if v}
+    manifest = {
+        "tree_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "instance_dir": repo_instance_dir.replace("\\", "/"),
+        "rules": rules.to_dict(),
+        "root_hash": tree.get("", {}).get("hash"),
+        "file_count": sum(len(node["files"]) for node in tree.values()),
+        "dirs": tree,
+    }
+    if transport:
+        manifest["transport"] = transport
+    output_path = output_path or os.path.join(root_dir, *TREE_MANIFEST_REL_PATH.split("/"))
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, separators=(",", ":"))
+    return manifest
+
+
+def fetch_tree_manifest(urls, dest_path, root_hash, log=print, **kwargs):
+    """
+    下载目录树配置文件，并确认其根摘要与mod列表中记录的一致
+    （线路/代理缓存了旧版本时换其他线路重新下载）
+    :param urls: 目录树配置文件的下载地址列表
+    :param dest_path: 保存路径
+    :param root_hash: mod列表中记录的根摘要（tree.root_hash）
+    :param log: 日志输出函数
+    :param kwargs: 传给download_file的其他参数（mirror_pool、scheduler等）
+    :return: 配置文件内容（下载失败或所有线路都不是该版本时返回None）
+    """
+    remaining = list(urls)
+    while remaining:
+        report = {}
+        if not download_file(remaining, dest_path, log=log, report=report, **kwargs):
+            return None
+        manifest = get_json_from_file(dest_path)
+        if manifest and manifest.get("root_hash") == root_hash:
+            return manifest
+        log(f"⚠️ 线路 {report['url']} 的目录树配置与mod列表版本不一致，尝试其他线路")
+        remaining = [url for url in remaining if url != report["url"]]
+    return None
+
+
+@traced("diff_tree")
+def diff_tree(remote_tree, local_tree, previous_tree=None):
+    """
+    比较远程和本地目录树：摘要相同的目录整体跳过，只深入摘要不同的目录
+    :param remote_tree: 远程目录树（配置文件的dirs）
+    :param local_tree: scan_tree生成的本地目录树
+    :param previous_tree: 上次同步的目录树（可选；用于找出远程已删除、且本地未被修改的文件）
+    :return: (需要下载的文件列表[(相对路径, 大小, 哈希)], 需要删除的文件相对路径列表)
+    """
+    changed = []
+    removed = []
+    compared = 0
+    stack = [""] if "" in remote_tree else []
+    while stack:
+        rel_dir = stack.pop()
+        compared += 1
+        remote_node = remote_tree[rel_dir]
+        local_node = local_tree.get(rel_dir)
+        if local_node and local_node["hash"] == remote_node["hash"]:
+            continue
+        local_files = local_node["files"] if local_node else {}
+        for name, (size, file_hash) in remote_node["files"].items():
+            if local_files.get(name) != [size, file_hash]:
+                changed.append((f"{rel_dir}/{name}" if rel_dir else name, size, file_hash))
+        stack.extend(remote_node["dirs"])
+    count("tree_dirs_compared", compared)
+
+    if previous_tree:
+        # 上次同步下发、本次远程已删除的文件：本地内容仍与上次一致时才删除（保留用户自行修改的文件）
+        for rel_dir, previous_node in previous_tree.items():
+            remote_files = remote_tree.get(rel_dir, {}).get("files", {})
+            local_files = local_tree.get(rel_dir, {}).get("files", {})
+            for name, info in previous_node["files"].items():
+                if name not in remote_files and local_files.get(name) == info:
+                    removed.append(f"{rel_dir}/{name}" if rel_dir else name)
+    return changed, removed
+
+
+class TreeSync:
+    """整合包实例目录同步（config、kubejs、资源包、光影包等大量小文件）"""
+
+    def __init__(self, base_urls, instance_dir, staging_dir, log=print, mirror_pool=None, scheduler=None,
+                 priority=FOREGROUND, cache_path=None, workers=DOWNLOAD_WORKERS):
+        """
+        :param base_urls: 仓库根地址列表
+        :param instance_dir: 本地整合包实例目录
+        :param staging_dir: 下载暂存目录（须与实例目录在同一磁盘）
+        :param log: 日志输出函数
+        :param mirror_pool: 线路状态表（可选）
+        :param scheduler: 传输调度器（可选）
+        :param priority: 传输优先级
+        :param cache_path: 文件状态缓存路径（默认temp/tree_cache.json）
+        :param workers: 下载并发数
+        """
+        self.base_urls = base_urls
+        self.instance_dir = instance_dir
+        self.staging_dir = staging_dir
+        self.log = log
+        self.mirror_pool = mirror_pool
+        self.scheduler = scheduler
+        self.priority = priority
+        self.cache = StatCache(cache_path or tree_cache_path)
+        self.workers = workers
+
+    def plan(self, manifest, previous_manifest=None):
+        """
+        扫描本地实例目录并与配置比较
+        :param manifest: 远程目录树配置文件内容
+        :param previous_manifest: 本地保存的上次目录树配置（可选）
+        :return: (需要下载的文件列表, 需要删除的文件相对路径列表)
+        """
+        rules = TreeRules(**manifest["rules"])
+        with span("scan_tree_local"):
+            local_tree = scan_tree(self.instance_dir, rules, self.cache)
+        previous_tree = previous_manifest.get("dirs") if previous_manifest else None
+        return diff_tree(manifest["dirs"], local_tree, previous_tree)
+
+    @traced("tree_download")
+    def download(self, manifest, changed):
+        """
+        并发下载变化的文件到暂存目录（逐个校验哈希）
+        :param manifest: 远程目录树配置文件内容
+        :param changed: plan返回的需要下载的文件列表
+        :return: (成功的文件列表[(暂存路径, 相对路径, 大小)], 失败的相对路径列表)
+        """
+        repo_dir = manifest["instance_dir"].strip("/")
+        transport = manifest.get("transport", {})
+
+        def fetch(item):
+            rel_path, size, file_hash = item
+            staged_path = os.path.join(self.staging_dir, *rel_path.split("/"))
+            os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+            variant = transport.get(file_hash)
+            if variant:
+                # 有压缩版本时下载压缩数据，边下载边解压并同时校验压缩前后的哈希
+                urls = build_file_urls(self.base_urls, variant["path"])
+                kwargs = {"expected_size": variant["size_bytes"], "expected_hash": variant["hash"],
+                          "codec": variant["codec"], "decoded_size": size, "decoded_hash": file_hash}
+            else:
+                urls = build_file_urls(self.base_urls, f"{repo_dir}/{rel_path}" if repo_dir else rel_path)
+                kwargs = {"expected_size": size, "expected_hash": file_hash}
+            if self.mirror_pool is not None:
+                urls = self.mirror_pool.rank(urls)
+            slot = self.scheduler.slot(self.priority) if self.scheduler else nullcontext()
+            with slot:
+                ok = download_file(urls, staged_path, log=lambda msg: None, mirror_pool=self.mirror_pool,
+                                   scheduler=self.scheduler, priority=self.priority, **kwargs)
+            return item, staged_path, ok
+
+        succeeded, failed = [], []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for (rel_path, size, file_hash), staged_path, ok in executor.map(bind(fetch), changed):
+                if ok:
+                    succeeded.append((staged_path, rel_path, size))
+                else:
+                    failed.append(rel_path)
+                    self.log(f"❌ {rel_path} 下载失败")
+        return succeeded, failed
+
+    def add_to_transaction(self, transaction, succeeded, removed):
+        """将下载结果和需要删除的文件登记到更新事务（与Mod一起原子应用）"""
+        for staged_path, rel_path, size in succeeded:
+            target_path = os.path.join(self.instance_dir, *rel_path.split("/"))
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            transaction.add_file(staged_path, target_path, size)
+        for rel_path in removed:
+            transaction.remove_file(os.path.join(self.instance_dir, *rel_path.split("/")))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="整合包实例目录同步（config、kubejs、资源包、光影包等）")
+    sub = parser.add_subparsers(dest="command")
+    build_parser = sub.add_parser("build", help="生成目录树配置文件")
+    build_parser.add_argument("instance_dir", help="整合包实例目录")
+    build_parser.add_argument("--include", action="append", default=None, help="包含规则（可多次指定）")
+    build_parser.add_argument("--exclude", action="append", default=None, help="排除规则（可多次指定）")
+    build_parser.add_argument("--output", default=None, help=f"输出路径（默认{TREE_MANIFEST_REL_PATH}）")
+    diff_parser = sub.add_parser("diff", help="比较本地实例目录与目录树配置文件")
+    diff_parser.add_argument("manifest", help="目录树配置文件路径")
+    diff_parser.add_argument("instance_dir", help="本地整合包实例目录")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        result = build_tree_manifest(args.instance_dir, TreeRules(args.include, args.exclude), args.output)
+        print(f"[成功] 目录树配置文件已生成：{result['file_count']} 个文件，根摘要 {result['root_hash']}")
+    elif args.command == "diff":
+        tree_manifest = get_json_from_file(args.manifest)
+        local = scan_tree(args.instance_dir, TreeRules(**tree_manifest["rules"]), StatCache(tree_cache_path))
+        changed_files, _ = diff_tree(tree_manifest["dirs"], local)
+        print(f"[信息] 需要同步 {len(changed_files)} 个文件")
+        for rel, _, _ in changed_files[:50]:
+            print(f"  - {rel}")
+    else:
+        parser.print_help()
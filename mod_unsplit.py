@@ -1,5 +1,7 @@
 
+import hashlib
 import json
+from mod_trace import traced
 from util import *
 
 # 单位转换常量（仅用于展示，所有校验均用字节数）
@@ -7,10 +9,24 @@ BYTES_TO_MB = 1024 * 1024
 
 
 
-def validate_chunks(chunk_info_list):
+def get_chunk_path(chunk, chunk_dir=None):
+    """
+    获取分包的本地路径
+    :param chunk: 配置文件中的单个分包信息
+    :param chunk_dir: 分包所在目录（可选，指定时按分包名在该目录中查找，用于下载到临时目录的分包）
+    :return: 分包路径
+    """
+    if chunk_dir is None:
+        return chunk["chunk_path"]
+    return os.path.join(chunk_dir, chunk["chunk_name"])
+
+
+@traced("validate_chunks")
+def validate_chunks(chunk_info_list, chunk_dir=None):
     """
     验证分包完整性（仅用字节数校验大小，哈希校验内容）
     :param chunk_info_list: 配置文件中的分包信息列表
+    :param chunk_dir: 分包所在目录（可选，默认使用配置中的chunk_path）
     :return: 全部验证通过返回True，否则False
     """
     print("\n--- 开始验证分包完整性 ---")
@@ -19,7 +35,7 @@ def validate_chunks(chunk_info_list):
     sorted_chunks = sorted(chunk_info_list, key=lambda x: x["chunk_index"])
 
     for chunk in sorted_chunks:
-        chunk_path = chunk["chunk_path"]
+        chunk_path = get_chunk_path(chunk, chunk_dir)
         expected_hash = chunk["chunk_hash"]
         expected_size = chunk["chunk_size_bytes"]  # 精准字节数
 
@@ -58,16 +74,20 @@ def validate_chunks(chunk_info_list):
     return all_valid
 
 
-def restore_split_file(file_info, output_dir=None):
+@traced("restore_split_file")
+def restore_split_file(file_info, output_dir=None, chunk_dir=None, verify_chunks=True):
     """
     还原被分割的Mod文件
     :param file_info: 配置文件中的单个文件信息（含split_details）
     :param output_dir: 还原文件输出目录（默认原文件目录）
+    :param chunk_dir: 分包所在目录（可选，默认使用配置中的chunk_path）
+    :param verify_chunks: 拼接前是否逐个校验分包（分包已在下载时校验过可跳过）
     :return: 还原成功返回True，否则False
     """
     # 基础路径配置
     original_path = file_info["file_path"]
-    file_name = os.path.basename(original_path)
+    # 发布目录中file_path为内容寻址路径，还原后的文件名以file_name为准
+    file_name = file_info.get("file_name") or os.path.basename(original_path)
 
     if output_dir is None:
         output_dir = os.path.dirname(original_path)
@@ -81,39 +101,42 @@ def restore_split_file(file_info, output_dir=None):
 
     # 1. 验证分包
     chunk_list = file_info["split_details"]["chunks"]
-    if not validate_chunks(chunk_list):
+    if verify_chunks and not validate_chunks(chunk_list, chunk_dir):
         return False
 
-    # 2. 按序拼接分包
+    # 2. 按序拼接分包（先写入临时文件，校验通过后再改名为目标文件，中断时不会留下不完整的Mod）
     print(f"\n--- 开始拼接分包，还原文件：{restored_path} ---")
     sorted_chunks = sorted(chunk_list, key=lambda x: x["chunk_index"])
+    partial_path = restored_path + ".restoring"
     total_written = 0  # 记录写入总字节数，用于校验
+    hash_obj = hashlib.md5()  # 拼接时同步计算哈希，无需再次读取还原文件
 
     try:
-        with open(restored_path, 'wb') as restored_file:
+        with open(partial_path, 'wb') as restored_file:
             for chunk in sorted_chunks:
-                chunk_path = chunk["chunk_path"]
+                chunk_path = get_chunk_path(chunk, chunk_dir)
                 print(f"   拼接：{os.path.basename(chunk_path)}")
 
                 with open(chunk_path, 'rb') as chunk_file:
-                    while chunk_data := chunk_file.read(4096):
+                    while chunk_data := chunk_file.read(1024 * 1024):
                         restored_file.write(chunk_data)
+                        hash_obj.update(chunk_data)
                         total_written += len(chunk_data)
 
         # 3. 校验还原后的文件
         print("\n--- 验证还原文件完整性 ---")
         expected_size = file_info["file_size_bytes"]
         expected_hash = file_info["file_hash"]
-        actual_size = get_file_size_bytes(restored_path)
-        actual_hash = calculate_file_hash(restored_path)
+        actual_size = total_written
+        actual_hash = hash_obj.hexdigest()
 
         # 校验大小（精准字节数）
         if actual_size != expected_size:
             print(f"[失败] 还原文件大小不匹配")
             print(f"       预期：{expected_size} 字节 ({round(expected_size / BYTES_TO_MB, 4)} MB)")
             print(f"       实际：{actual_size} 字节 ({round(actual_size / BYTES_TO_MB, 4)} MB)")
-            os.remove(restored_path)  # 删除损坏文件
-            print(f"       已删除验证失败的文件：{restored_path}")
+            os.remove(partial_path)  # 删除损坏文件
+            print(f"       已删除验证失败的文件：{partial_path}")
             return False
 
         # 校验哈希
@@ -121,10 +144,11 @@ def restore_split_file(file_info, output_dir=None):
             print(f"[失败] 还原文件哈希不匹配")
             print(f"       预期：{expected_hash}")
             print(f"       实际：{actual_hash}")
-            os.remove(restored_path)
-            print(f"       已删除验证失败的文件：{restored_path}")
+            os.remove(partial_path)
+            print(f"       已删除验证失败的文件：{partial_path}")
             return False
 
+        os.replace(partial_path, restored_path)
         # 还原成功
         print(f"[成功] 文件还原完成！")
         print(f"       路径：{restored_path}")
@@ -135,8 +159,8 @@ def restore_split_file(file_info, output_dir=None):
     except Exception as e:
         print(f"[错误] 拼接文件失败：{str(e)}")
         # 清理未完成的还原文件
-        if os.path.exists(restored_path):
-            os.remove(restored_path)
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
         return False
 
 
@@ -180,6 +204,7 @@ def validate_unsplit_file(file_info):
     return True
 
 
+@traced("mod_unsplit")
 def main(config_file, output_dir=None):
     """
     主函数：读取配置文件，批量处理所有Mod文件（还原分割文件/校验未分割文件）
@@ -2,10 +2,23 @@ import os
 import json
 import hashlib
 import argparse
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
 from pathlib import Path
 
+from mod_trace import span, count, traced
+from mod_version import get_mod_id_version
+from util import calculate_quick_fingerprint, get_json_from_file, is_split_part
+
+root_dir = os.getcwd()  # 根目录
+# 校验状态文件（记录上次完整校验时间，以及是否需要在下次更新时完整校验）
+verify_state_path = os.path.join(root_dir, "temp", "verify_state.json")
+
 # 单位转换常量（仅用于展示，校验用字节数）
 BYTES_TO_MB = 1024 * 1024
+# 完整校验间隔（天）：日常启动只做快速校验，超过间隔后在后台完整校验一次
+FULL_VERIFY_INTERVAL_DAYS = 7
 
 # ===================== 核心工具函数 =====================
 def calculate_file_hash(file_path, hash_algorithm="md5"):
@@ -19,9 +32,10 @@ def calculate_file_hash(file_path, hash_algorithm="md5"):
         return None
     try:
         hash_obj = hashlib.new(hash_algorithm)
-        with open(file_path, 'rb') as f:
+        with span("hash", file=os.path.basename(file_path)), open(file_path, 'rb') as f:
             while chunk := f.read(4096):  # 4096字节/块，平衡效率与内存
                 hash_obj.update(chunk)
+            count("hash_bytes", f.tell())
         return hash_obj.hexdigest()
     except Exception as e:
         print(f"[警告] 计算 {os.path.basename(file_path)} 哈希失败：{str(e)}")
@@ -41,13 +55,31 @@ def get_file_size_bytes(file_path):
         print(f"[警告] 获取 {os.path.basename(file_path)} 大小失败：{str(e)}")
         return None
 
-def get_local_mod_file_map(local_mod_dir):
+def get_local_mod_file_map(local_mod_dir, watcher=None, quick_entries=None, log=print):
     """
     获取本地Mod目录的文件映射表（哈希->文件信息，文件名->文件信息）
     用于快速匹配「哈希一致文件名不同」的情况
     :param local_mod_dir: 本地Mod目录
+    :param watcher: 可选的mod_watch.ModDirWatcher，监视同一目录时直接使用其缓存状态
+    :param quick_entries: 配置文件中的Mod信息列表（指定时使用快速校验，监视器缓存可直接使用时仍优先使用缓存）
+    :param log: 日志输出函数（快速校验的统计信息）
     :return: hash_to_files（哈希为键，值为文件信息列表）、name_to_files（文件名为键，值为文件信息）、all_local_files（所有本地文件信息列表）
     """
+    if watcher is not None and os.path.abspath(watcher.mod_dir) == os.path.abspath(local_mod_dir):
+        if quick_entries is None or watcher.is_warm():
+            with span("scan_local", source="watcher"):
+                return watcher.snapshot()
+    if quick_entries is not None:
+        with span("scan_local", source="quick"):
+            return _scan_local_mod_dir_quick(local_mod_dir, quick_entries, log)
+    with span("scan_local", source="walk"):
+        hash_to_files, name_to_files, all_local_files = _scan_local_mod_dir(local_mod_dir)
+        count("hash_cache_misses", len(all_local_files))
+        return hash_to_files, name_to_files, all_local_files
+
+
+def _scan_local_mod_dir(local_mod_dir):
+    """遍历本地Mod目录并计算所有文件的哈希（get_local_mod_file_map的冷启动路径）"""
     hash_to_files = {}
     name_to_files = {}
     all_local_files = []
@@ -58,6 +90,8 @@ def get_local_mod_file_map(local_mod_dir):
     # 遍历本地Mod目录所有文件
     for root, dirs, files in os.walk(local_mod_dir):
         for file in files:
+            if is_split_part(file):
+                continue
             file_path = os.path.join(root, file)
             file_hash = calculate_file_hash(file_path)
             file_size = get_file_size_bytes(file_path)
@@ -67,8 +101,7 @@ def get_local_mod_file_map(local_mod_dir):
                 "file_name": file,
                 "file_path": file_path,
                 "hash": file_hash,
-                "size_bytes": file_size,
-                "size_mb": round(file_size / BYTES_TO_MB, 4) if file_size else None
+                "size_bytes": file_size
             }
             all_local_files.append(file_info)
 
@@ -85,254 +118,544 @@ def get_local_mod_file_map(local_mod_dir):
 
     return hash_to_files, name_to_files, all_local_files
 
+def _scan_local_mod_dir_quick(local_mod_dir, config_entries, log=print):
+    """
+    快速校验：同名文件大小和快速指纹都与配置一致时，直接采用配置中的哈希（只读取文件末尾和几个抽样块）
+    指纹缺失、大小或指纹不一致等有疑问的文件，只对该文件计算完整哈希，再按常规流程比较
+    """
+    hash_to_files = {}
+    name_to_files = {}
+    all_local_files = []
+    expected = {entry['file_name']: entry for entry in config_entries}
+    quick_verified = 0
+
+    if not os.path.isdir(local_mod_dir):
+        return hash_to_files, name_to_files, all_local_files
+
+    for root, dirs, files in os.walk(local_mod_dir):
+        for file in files:
+            if is_split_part(file):
+                continue
+            file_path = os.path.join(root, file)
+            file_size = get_file_size_bytes(file_path)
+            file_info = {
+                "file_name": file,
+                "file_path": file_path,
+                "size_bytes": file_size
+            }
+            entry = expected.get(file)
+            if (entry and entry.get('quick_fingerprint') and file_size == entry['file_size_bytes']
+                    and calculate_quick_fingerprint(file_path) == entry['quick_fingerprint']):
+                file_info['hash'] = entry['file_hash']
+                # 与配置一致的文件无需再打开JAR读取modId
+                file_info['mod_id'] = entry.get('mod_id')
+                file_info['mod_version'] = entry.get('mod_version')
+                quick_verified += 1
+            else:
+                file_info['hash'] = calculate_file_hash(file_path)
+            all_local_files.append(file_info)
+
+            if file_info['hash']:
+                hash_to_files.setdefault(file_info['hash'], []).append(file_info)
+            name_to_files.setdefault(file, []).append(file_info)
+
+    count("quick_verified", quick_verified)
+    count("hash_cache_misses", len(all_local_files) - quick_verified)
+    log(f"[信息] 快速校验：{quick_verified} 个文件通过，{len(all_local_files) - quick_verified} 个文件计算完整哈希")
+    return hash_to_files, name_to_files, all_local_files
+
+def get_local_mod_id_map(all_local_files):
+    """
+    读取本地JAR的modId和版本号（仅读取JAR内的mods.toml，不计算哈希）
+    读取结果会写回文件信息的mod_id/mod_version字段
+    :param all_local_files: get_local_mod_file_map返回的本地文件信息列表
+    :return: mod_id_to_files（modId为键，值为文件信息列表）
+    """
+    mod_id_to_files = {}
+    for file_info in all_local_files:
+        if not file_info['file_name'].lower().endswith(".jar"):
+            continue
+        # 监视器缓存中已有modId时不再重复读取JAR
+        if 'mod_id' not in file_info:
+            file_info['mod_id'], file_info['mod_version'] = get_mod_id_version(file_info['file_path'])
+        mod_id = file_info['mod_id']
+        if mod_id:
+            mod_id_to_files.setdefault(mod_id, []).append(file_info)
+    return mod_id_to_files
+
+# ===================== 校验结果 =====================
+# 不一致项类型（与兼容接口中inconsistent_mods的键一致）
+MISSING_FILES = "missing_files"
+SIZE_MISMATCH = "size_mismatch"
+HASH_MISMATCH = "hash_mismatch"
+VERSION_UPDATES = "version_updates"
+ERROR_FILES = "error_files"
+ISSUE_KINDS = (MISSING_FILES, SIZE_MISMATCH, HASH_MISMATCH, VERSION_UPDATES, ERROR_FILES)
+# 各类型的默认说明（仅在渲染时使用）
+ISSUE_REASONS = {
+    MISSING_FILES: "本地无哈希匹配文件，且文件名不存在",
+    SIZE_MISMATCH: "文件名匹配，但大小不一致",
+    HASH_MISMATCH: "文件名匹配，但哈希不一致（内容被修改或损坏）",
+    VERSION_UPDATES: "modId匹配，本地为其他版本",
+}
+# GUI表格中各类型的名称
+ISSUE_LABELS = {
+    MISSING_FILES: "缺失",
+    SIZE_MISMATCH: "大小不一致",
+    HASH_MISMATCH: "哈希不一致",
+    VERSION_UPDATES: "版本升级",
+    ERROR_FILES: "异常",
+}
+
+
+@dataclass(slots=True)
+class ModIssue:
+    """单个不一致项：只保存类型、对配置项/本地文件信息的引用和实际值，展示文本在渲染时生成"""
+    kind: str
+    entry: dict  # 配置文件中的Mod信息（引用，不复制）
+    local_path: str = None
+    actual_size: int = None
+    actual_hash: str = None
+    old_files: tuple = ()  # 版本升级：被取代的本地文件信息
+    reason: str = None  # 仅异常项使用（其余类型使用ISSUE_REASONS）
+
+    @property
+    def file_name(self):
+        return self.entry['file_name']
+
+    def to_dict(self):
+        """转为兼容接口中的字典格式"""
+        entry = self.entry
+        reason = self.reason or ISSUE_REASONS.get(self.kind)
+        if self.kind == MISSING_FILES:
+            return {"file_name": entry['file_name'], "config_path": entry['file_path'],
+                    "expected_hash": entry['file_hash'], "is_split": entry.get("is_split", False),
+                    "split_details": entry.get("split_details"), "reason": reason}
+        if self.kind == VERSION_UPDATES:
+            old_file = self.old_files[0]
+            return {"mod_id": entry.get("mod_id"), "file_name": entry['file_name'], "config_path": entry['file_path'],
+                    "expected_hash": entry['file_hash'], "is_split": entry.get("is_split", False),
+                    "split_details": entry.get("split_details"), "from_version": old_file.get('mod_version'),
+                    "to_version": entry.get("mod_version"), "old_file_name": old_file['file_name'],
+                    "old_file_paths": [f['file_path'] for f in self.old_files], "reason": reason}
+        if self.kind == SIZE_MISMATCH:
+            return {"file_name": entry['file_name'], "local_path": self.local_path,
+                    "expected_size_bytes": entry['file_size_bytes'],
+                    "expected_size_mb": round(entry['file_size_bytes'] / BYTES_TO_MB, 4),
+                    "actual_size_bytes": self.actual_size, "actual_size_mb": round(self.actual_size / BYTES_TO_MB, 4),
+                    "reason": reason}
+        if self.kind == HASH_MISMATCH:
+            return {"file_name": entry['file_name'], "local_path": self.local_path,
+                    "expected_hash": entry['file_hash'], "actual_hash": self.actual_hash, "reason": reason}
+        return {"file_name": entry['file_name'], "local_path": self.local_path, "reason": reason}
+
+
+@dataclass(slots=True)
+class ExtraFile:
+    """本地多出的文件（配置中无哈希和文件名匹配）"""
+    info: dict  # 本地文件信息（引用）
+    stale: bool = False  # 配置中已有该modId的其他版本（旧版本残留）
+
+    def to_dict(self):
+        info = self.info
+        size = info.get('size_bytes')
+        return {"file_name": info['file_name'], "file_path": info['file_path'], "hash": info['hash'],
+                "size_mb": round(size / BYTES_TO_MB, 4) if size else None, "mod_id": info.get('mod_id'),
+                "mod_version": info.get('mod_version'),
+                "reason": "配置文件中已有该modId的其他版本（旧版本残留）" if self.stale
+                else "配置文件中未记录该文件（无哈希/文件名匹配）"}
+
+
+@dataclass(slots=True)
+class ValidationResult:
+    """
+    校验结果：记录只包含整数、摘要和引用，文本/JSON/GUI表格在需要时才生成
+    （to_legacy转为旧接口的inconsistent_mods字典和extra_local_files列表）
+    """
+    issues: list = field(default_factory=list)
+    extra_files: list = field(default_factory=list)
+    duplicates: list = field(default_factory=list)  # (modId, 本地文件信息元组)
+    split_time: str = None
+    config_count: int = 0
+    local_count: int = 0
+    valid: bool = True  # 配置文件或Mod目录无法读取时为False
+
+    def of_kind(self, kind):
+        return [issue for issue in self.issues if issue.kind == kind]
+
+    @property
+    def problem_count(self):
+        """不一致/异常项数（不含重复modId和多出文件）"""
+        return len(self.issues)
+
+    def files_to_sync(self):
+        """需要下载的Mod文件名（缺失、版本升级、大小/哈希不匹配）"""
+        return {issue.file_name for issue in self.issues if issue.kind != ERROR_FILES}
+
+    def superseded_paths(self):
+        """被新版本取代、需要删除的本地旧文件路径"""
+        return [f['file_path'] for issue in self.of_kind(VERSION_UPDATES) for f in issue.old_files]
+
+    def to_legacy(self):
+        """
+        兼容接口：转为validate_mods_with_config原有的返回格式
+        :return: inconsistent_mods（不一致项字典）、extra_local_files（本地多出文件列表）
+        """
+        if not self.valid:
+            return {}, []
+        inconsistent_mods = {kind: [] for kind in (MISSING_FILES, SIZE_MISMATCH, HASH_MISMATCH, VERSION_UPDATES)}
+        inconsistent_mods["duplicate_mod_ids"] = [
+            {"mod_id": mod_id, "files": [{"file_name": f['file_name'], "file_path": f['file_path'],
+                                          "mod_version": f.get('mod_version')} for f in files]}
+            for mod_id, files in self.duplicates]
+        inconsistent_mods[ERROR_FILES] = []
+        for issue in self.issues:
+            inconsistent_mods[issue.kind].append(issue.to_dict())
+        return inconsistent_mods, [extra.to_dict() for extra in self.extra_files]
+
+    def render_text(self):
+        """渲染为文本报告（与print_validate_report输出一致）"""
+        return format_validate_report(*self.to_legacy())
+
+    def to_json(self, **kwargs):
+        """渲染为JSON字符串（格式同to_legacy）"""
+        inconsistent_mods, extra_local_files = self.to_legacy()
+        return json.dumps({"split_time": self.split_time, "inconsistent_mods": inconsistent_mods,
+                           "extra_local_files": extra_local_files}, ensure_ascii=False, **kwargs)
+
+    def table_rows(self):
+        """渲染为GUI表格行：(类型, 文件名, 说明)"""
+        rows = []
+        for issue in self.issues:
+            if issue.kind == VERSION_UPDATES:
+                detail = f"{issue.old_files[0].get('mod_version')} -> {issue.entry.get('mod_version')}"
+            elif issue.kind == SIZE_MISMATCH:
+                detail = f"{issue.actual_size} / {issue.entry['file_size_bytes']} 字节"
+            else:
+                detail = issue.reason or ISSUE_REASONS.get(issue.kind)
+            rows.append((ISSUE_LABELS[issue.kind], issue.file_name, detail))
+        for extra in self.extra_files:
+            rows.append(("多出", extra.info['file_name'], "旧版本残留" if extra.stale else "配置未记录"))
+        return rows
+
+
 # ===================== 核心校验逻辑 =====================
-def validate_mods_with_config(config_file_path, local_mod_dir=None):
+@traced("validate")
+def validate_mods(config_file_path, local_mod_dir=None, watcher=None, quick=False, quiet=True):
     """
-    使用JSON配置文件校验本地Mod，忽略哈希一致文件名不同的情况，列出多出文件，缺失文件补充is_split和split_details
+    使用JSON配置文件校验本地Mod，忽略哈希一致文件名不同的情况，列出多出文件
     :param config_file_path: JSON配置文件路径
     :param local_mod_dir: 本地Mod目录（可选，若不指定则使用配置文件中记录的目录）
-    :return: inconsistent_mods（不一致项）、extra_local_files（本地多出文件）
+    :param watcher: 可选的mod_watch.ModDirWatcher，仅对变化过的文件重新计算哈希
+    :param quick: 快速校验（大小+快速指纹，有疑问的文件才计算完整哈希；完整校验由run_full_verify在后台进行）
+    :param quiet: 静默模式（不输出任何内容）
+    :return: ValidationResult
     """
+    log = (lambda msg: None) if quiet else print
+    result = ValidationResult()
+
     # 1. 验证配置文件是否存在
     if not os.path.isfile(config_file_path):
-        print(f"[错误] 配置文件不存在：{config_file_path}")
-        return {}, []
+        log(f"[错误] 配置文件不存在：{config_file_path}")
+        result.valid = False
+        return result
 
     # 2. 读取JSON配置文件
     try:
         with open(config_file_path, 'r', encoding='utf-8') as f:
             mod_config = json.load(f)
-        print(f"[成功] 读取配置文件：{os.path.basename(config_file_path)}")
-        print(f"[信息] 配置文件生成时间：{mod_config['split_time']}")
-        print(f"[信息] 配置文件记录Mod总数：{len(mod_config['all_mod_files'])}")
+        result.split_time = mod_config['split_time']
+        result.config_count = len(mod_config['all_mod_files'])
+        log(f"[成功] 读取配置文件：{os.path.basename(config_file_path)}")
+        log(f"[信息] 配置文件生成时间：{result.split_time}")
+        log(f"[信息] 配置文件记录Mod总数：{result.config_count}")
     except Exception as e:
-        print(f"[错误] 解析配置文件失败：{str(e)}")
-        return {}, []
+        log(f"[错误] 解析配置文件失败：{str(e)}")
+        result.valid = False
+        return result
 
     # 3. 确定本地Mod目录
     if not local_mod_dir:
         local_mod_dir = mod_config['mod_directory']
-        print(f"[信息] 使用配置文件中记录的Mod目录：{local_mod_dir}")
+        log(f"[信息] 使用配置文件中记录的Mod目录：{local_mod_dir}")
     if not os.path.isdir(local_mod_dir):
-        print(f"[错误] 本地Mod目录不存在：{local_mod_dir}")
-        return {}, []
+        log(f"[错误] 本地Mod目录不存在：{local_mod_dir}")
+        result.valid = False
+        return result
 
     # 4. 获取本地Mod文件映射表
-    local_hash_map, local_name_map, all_local_files = get_local_mod_file_map(local_mod_dir)
-    print(f"[信息] 本地Mod目录文件总数：{len(all_local_files)}")
-
-    # 5. 提取配置文件中的Mod信息（哈希集合、文件名集合）
-    config_hash_set = set()
-    config_name_set = set()
-    config_mod_list = []
-    for mod_info in mod_config['all_mod_files']:
-        mod_hash = mod_info['file_hash']
-        mod_name = mod_info['file_name']
-        if mod_hash:
-            config_hash_set.add(mod_hash)
-        config_name_set.add(mod_name)
-        config_mod_list.append(mod_info)
-
-    # 6. 初始化不一致信息列表（分类存储）
-    inconsistent_mods = {
-        "missing_files": [],  # 文件缺失（哈希和文件名均无匹配）
-        "size_mismatch": [],  # 大小不匹配（哈希未匹配，文件名匹配但大小不一致）
-        "hash_mismatch": [],  # 哈希不匹配（文件名匹配，但哈希不一致）
-        "error_files": []     # 读取/计算异常的文件
-    }
-
-    # 7. 遍历配置文件中的所有Mod，逐一校验（忽略哈希一致文件名不同）
-    for idx, mod_info in enumerate(config_mod_list, 1):
+    local_hash_map, local_name_map, all_local_files = get_local_mod_file_map(
+        local_mod_dir, watcher, mod_config['all_mod_files'] if quick else None, log=log)
+    local_mod_id_map = get_local_mod_id_map(all_local_files)
+    result.local_count = len(all_local_files)
+    log(f"[信息] 本地Mod目录文件总数：{result.local_count}")
+
+    # 5. 提取配置文件中的哈希、文件名、modId集合
+    config_mod_list = mod_config['all_mod_files']
+    config_hash_set = {mod_info['file_hash'] for mod_info in config_mod_list if mod_info['file_hash']}
+    config_name_set = {mod_info['file_name'] for mod_info in config_mod_list}
+    config_mod_id_set = {mod_info['mod_id'] for mod_info in config_mod_list if mod_info.get('mod_id')}
+    # 被新版本取代的本地旧文件路径（不再重复列入多出文件）
+    superseded_paths = set()
+
+    # 6. 遍历配置文件中的所有Mod，逐一校验（忽略哈希一致文件名不同）
+    for mod_info in config_mod_list:
         mod_file_name = mod_info['file_name']
-        mod_config_path = mod_info['file_path']
-        mod_expected_size = mod_info['file_size_bytes']
         mod_expected_hash = mod_info['file_hash']
-        # 提取is_split和split_details字段（兼容无此字段的情况，用get默认值）
-        mod_is_split = mod_info.get("is_split", False)
-        mod_split_details = mod_info.get("split_details", None)
-
-        print(f"\n[{idx}/{len(config_mod_list)}] 校验：{mod_file_name}（预期哈希：{mod_expected_hash[:8]}...）")
 
-        # ---- 步骤1：先通过哈希匹配（忽略文件名差异） ----
-        hash_matched = False
+        # ---- 步骤1：先通过哈希匹配（忽略文件名差异），匹配即内容一致 ----
         if mod_expected_hash and mod_expected_hash in local_hash_map:
-            # 找到哈希匹配的本地文件，视为内容一致，忽略文件名差异
-            matched_local_files = local_hash_map[mod_expected_hash]
-            hash_matched = True
-            print(f"  [匹配] 哈希一致（内容相同），忽略文件名差异，匹配到本地文件：{[f['file_name'] for f in matched_local_files]}")
-            continue  # 哈希匹配，无需后续校验，直接跳过
+            continue
+
+        # ---- 步骤2：哈希未匹配，文件名不同但modId相同：本地为旧版本，记录为升级操作 ----
+        mod_id = mod_info.get("mod_id")
+        if mod_file_name not in local_name_map and mod_id in local_mod_id_map:
+            old_files = tuple(f for f in local_mod_id_map[mod_id] if f['hash'] not in config_hash_set)
+            if old_files:
+                superseded_paths.update(f['file_path'] for f in old_files)
+                result.issues.append(ModIssue(VERSION_UPDATES, mod_info, old_files=old_files))
+                continue
 
-        # ---- 步骤2：哈希未匹配，按文件名匹配校验 ----
         if mod_file_name not in local_name_map:
-            # 文件名也未匹配，视为文件缺失，补充is_split和split_details
-            inconsistent_mods['missing_files'].append({
-                "file_name": mod_file_name,
-                "config_path": mod_config_path,
-                "expected_hash": mod_expected_hash,
-                "is_split": mod_is_split,  # 新增：是否为分割文件
-                "split_details": mod_split_details,  # 新增：分割详情
-                "reason": "本地无哈希匹配文件，且文件名不存在"
-            })
-            print(f"  [缺失] 本地无哈希匹配文件，且未找到文件名 {mod_file_name}")
+            # 文件名也未匹配，视为文件缺失
+            result.issues.append(ModIssue(MISSING_FILES, mod_info))
             continue
 
         # ---- 步骤3：文件名匹配，校验大小 ----
-        local_mod_files = local_name_map[mod_file_name]
-        local_mod_file = local_mod_files[0]  # 取第一个同名文件
+        local_mod_file = local_name_map[mod_file_name][0]  # 取第一个同名文件
         local_mod_path = local_mod_file['file_path']
         local_mod_size = local_mod_file['size_bytes']
         local_mod_hash = local_mod_file['hash']
-
-        # 校验文件大小
         if local_mod_size is None:
-            inconsistent_mods['error_files'].append({
-                "file_name": mod_file_name,
-                "local_path": local_mod_path,
-                "reason": "无法获取本地文件大小"
-            })
-            print(f"  [异常] 无法获取同名文件 {mod_file_name} 大小")
+            result.issues.append(ModIssue(ERROR_FILES, mod_info, local_mod_path, reason="无法获取本地文件大小"))
             continue
-        if local_mod_size != mod_expected_size:
-            inconsistent_mods['size_mismatch'].append({
-                "file_name": mod_file_name,
-                "local_path": local_mod_path,
-                "expected_size_bytes": mod_expected_size,
-                "expected_size_mb": round(mod_expected_size / BYTES_TO_MB, 4),
-                "actual_size_bytes": local_mod_size,
-                "actual_size_mb": local_mod_file['size_mb'],
-                "reason": "文件名匹配，但大小不一致"
-            })
-            print(f"  [不匹配] 大小不一致（预期：{round(mod_expected_size/BYTES_TO_MB,4)}MB，实际：{local_mod_file['size_mb']}MB）")
-        else:
-            print(f"  [匹配] 大小一致：{local_mod_file['size_mb']}MB")
+        if local_mod_size != mod_info['file_size_bytes']:
+            result.issues.append(ModIssue(SIZE_MISMATCH, mod_info, local_mod_path, actual_size=local_mod_size))
 
         # ---- 步骤4：文件名匹配，校验哈希 ----
         if local_mod_hash is None:
-            inconsistent_mods['error_files'].append({
-                "file_name": mod_file_name,
-                "local_path": local_mod_path,
-                "reason": "无法计算本地文件哈希"
-            })
-            print(f"  [异常] 无法计算同名文件 {mod_file_name} 哈希")
+            result.issues.append(ModIssue(ERROR_FILES, mod_info, local_mod_path, reason="无法计算本地文件哈希"))
             continue
         if local_mod_hash != mod_expected_hash:
-            inconsistent_mods['hash_mismatch'].append({
-                "file_name": mod_file_name,
-                "local_path": local_mod_path,
-                "expected_hash": mod_expected_hash,
-                "actual_hash": local_mod_hash,
-                "reason": "文件名匹配，但哈希不一致（内容被修改或损坏）"
-            })
-            print(f"  [不匹配] 哈希不一致（预期：{mod_expected_hash[:8]}...，实际：{local_mod_hash[:8]}...）")
-        else:
-            print(f"  [匹配] 哈希一致：{local_mod_hash[:8]}...")
-
-    # 8. 筛选本地多出的文件（配置中无哈希匹配，且无文件名匹配）
-    extra_local_files = []
-    for local_file in all_local_files:
-        local_file_hash = local_file['hash']
-        local_file_name = local_file['file_name']
+            result.issues.append(ModIssue(HASH_MISMATCH, mod_info, local_mod_path, actual_hash=local_mod_hash))
 
-        # 配置中存在该哈希 或 存在该文件名，不视为多出文件
-        if (local_file_hash in config_hash_set) or (local_file_name in config_name_set):
+    # 7. 筛选本地多出的JAR（配置中无哈希匹配且无文件名匹配，且不是已作为升级操作记录的旧文件）
+    for local_file in all_local_files:
+        if local_file['hash'] in config_hash_set or local_file['file_name'] in config_name_set:
             continue
-
-        if not local_file_name.endswith(".jar"):
+        if not local_file['file_name'].endswith(".jar") or local_file['file_path'] in superseded_paths:
             continue
+        result.extra_files.append(ExtraFile(local_file, local_file.get('mod_id') in config_mod_id_set))
+
+    # 8. 检测本地重复的modId（同一Mod存在多个JAR）
+    result.duplicates = [(mod_id, tuple(files)) for mod_id, files in local_mod_id_map.items() if len(files) > 1]
 
-        # 配置中无哈希和文件名匹配，视为多出文件
-        extra_local_files.append({
-            "file_name": local_file_name,
-            "file_path": local_file['file_path'],
-            "hash": local_file_hash,
-            "size_mb": local_file['size_mb'],
-            "reason": "配置文件中未记录该文件（无哈希/文件名匹配）"
-        })
+    log(f"[信息] 校验完成：{result.problem_count} 个不一致/异常项，{len(result.extra_files)} 个本地多出文件")
+    return result
 
-    return inconsistent_mods, extra_local_files
+
+def validate_mods_with_config(config_file_path, local_mod_dir=None, watcher=None, quick=False):
+    """
+    兼容接口：校验本地Mod并返回字典格式的结果（新代码请使用validate_mods）
+    :param config_file_path: JSON配置文件路径
+    :param local_mod_dir: 本地Mod目录（可选，若不指定则使用配置文件中记录的目录）
+    :param watcher: 可选的mod_watch.ModDirWatcher，仅对变化过的文件重新计算哈希
+    :param quick: 快速校验（见validate_mods）
+    :return: inconsistent_mods（不一致项）、extra_local_files（本地多出文件）
+    """
+    return validate_mods(config_file_path, local_mod_dir, watcher, quick, quiet=False).to_legacy()
+
+
+# ===================== 完整校验（后台/定期） =====================
+def load_verify_state(state_file=None):
+    """
+    读取校验状态
+    :param state_file: 状态文件路径（默认temp/verify_state.json）
+    :return: 状态字典（last_full_verify上次完整校验时间，force_full下次更新是否需要完整校验）
+    """
+    state_file = state_file or verify_state_path
+    if not os.path.exists(state_file):
+        return {}
+    return get_json_from_file(state_file) or {}
+
+
+def save_verify_state(state, state_file=None):
+    """写入校验状态"""
+    state_file = state_file or verify_state_path
+    os.makedirs(os.path.dirname(os.path.abspath(state_file)), exist_ok=True)
+    with open(state_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=4)
+
+
+def full_verify_due(state=None, interval_days=FULL_VERIFY_INTERVAL_DAYS):
+    """
+    是否需要进行完整校验（从未完整校验过、距上次超过间隔，或上次完整校验发现了问题）
+    :param state: load_verify_state返回的状态（默认读取状态文件）
+    :param interval_days: 完整校验间隔（天）
+    :return: 需要返回True
+    """
+    state = load_verify_state() if state is None else state
+    if state.get('force_full') or not state.get('last_full_verify'):
+        return True
+    last = datetime.strptime(state['last_full_verify'], "%Y-%m-%d %H:%M:%S")
+    return datetime.now() - last > timedelta(days=interval_days)
+
+
+def record_full_verify(problem_count, state_file=None):
+    """
+    记录一次完整校验的结果：无问题时更新完整校验时间，有问题时要求下次更新使用完整校验
+    :param problem_count: 发现的不一致项数
+    :param state_file: 状态文件路径（默认temp/verify_state.json）
+    """
+    state = load_verify_state(state_file)
+    state['force_full'] = problem_count > 0
+    if problem_count == 0:
+        state['last_full_verify'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    save_verify_state(state, state_file)
+
+
+@traced("full_verify")
+def run_full_verify(config_file_path, local_mod_dir, watcher=None, log=print):
+    """
+    完整校验：计算所有文件的完整哈希（使用监视器时复用其缓存），结果写入校验状态
+    :param config_file_path: 本地配置文件路径
+    :param local_mod_dir: 本地Mod目录
+    :param watcher: 可选的mod_watch.ModDirWatcher
+    :param log: 日志输出函数
+    :return: 不一致项数
+    """
+    problem_count = validate_mods(config_file_path, local_mod_dir, watcher).problem_count
+    record_full_verify(problem_count)
+    if problem_count:
+        log(f"[警告] 完整校验发现 {problem_count} 个不一致的Mod文件，下次更新时将完整校验并修复")
+    else:
+        log(f"[成功] 完整校验通过")
+    return problem_count
+
+
+def start_full_verify(config_file_path, local_mod_dir, watcher=None, log=print):
+    """
+    在后台线程中执行完整校验（不阻塞启动）
+    :return: 校验线程
+    """
+    thread = threading.Thread(target=run_full_verify, args=(config_file_path, local_mod_dir, watcher, log),
+                              name="FullVerify", daemon=True)
+    thread.start()
+    return thread
 
 # ===================== 输出校验报告 =====================
-def print_validate_report(inconsistent_mods, extra_local_files):
+def format_validate_report(inconsistent_mods, extra_local_files):
     """
-    格式化输出校验报告，包含不一致项和本地多出文件，缺失文件展示is_split和split_details
+    生成校验报告文本，包含不一致项和本地多出文件，缺失文件展示is_split和split_details
     :param inconsistent_mods: 不一致Mod信息字典
     :param extra_local_files: 本地多出文件列表
+    :return: 报告文本
     """
-    print(f"\n" + "="*80)
-    print(f"                      Mod校验报告")
-    print(f"="*80)
+    lines = []
+    lines.append(f"\n" + "="*80)
+    lines.append(f"                      Mod校验报告")
+    lines.append(f"="*80)
 
     # 统计总不一致数
     total_inconsistent = (len(inconsistent_mods['missing_files']) +
                           len(inconsistent_mods['size_mismatch']) +
                           len(inconsistent_mods['hash_mismatch']) +
+                          len(inconsistent_mods.get('version_updates', [])) +
                           len(inconsistent_mods['error_files']))
 
     # 输出不一致项
     if total_inconsistent > 0:
-        print(f"\n[警告] 共发现 {total_inconsistent} 个不一致/异常项，详情如下：")
+        lines.append(f"\n[警告] 共发现 {total_inconsistent} 个不一致/异常项，详情如下：")
 
         # 1. 输出文件缺失列表（展示is_split和split_details）
         if inconsistent_mods['missing_files']:
-            print(f"\n--- 1. 本地文件缺失（{len(inconsistent_mods['missing_files'])} 个） ---")
+            lines.append(f"\n--- 1. 本地文件缺失（{len(inconsistent_mods['missing_files'])} 个） ---")
             for idx, mod in enumerate(inconsistent_mods['missing_files'], 1):
-                print(f"  {idx}. 文件名：{mod['file_name']}")
-                print(f"     配置路径：{mod['config_path']}")
-                print(f"     预期哈希：{mod['expected_hash']}")
-                print(f"     是否为分割文件：{mod['is_split']}")
+                lines.append(f"  {idx}. 文件名：{mod['file_name']}")
+                lines.append(f"     配置路径：{mod['config_path']}")
+                lines.append(f"     预期哈希：{mod['expected_hash']}")
+                lines.append(f"     是否为分割文件：{mod['is_split']}")
                 # 展示split_details（若存在）
                 if mod['split_details']:
-                    print(f"     分割详情：")
+                    lines.append(f"     分割详情：")
                     # 简化展示split_details核心信息（避免输出过长）
                     split_chunk_count = mod['split_details'].get('chunk_count', 0)
                     split_original_size = mod['split_details'].get('original_file_size_mb', 0)
-                    print(f"       - 分包数量：{split_chunk_count}")
-                    print(f"       - 原文件大小：{split_original_size} MB")
-                    print(f"       - 分包配置：存在（可用于后续合成）")
+                    lines.append(f"       - 分包数量：{split_chunk_count}")
+                    lines.append(f"       - 原文件大小：{split_original_size} MB")
+                    lines.append(f"       - 分包配置：存在（可用于后续合成）")
                 else:
-                    print(f"     分割详情：无（非分割文件）")
-                print(f"     缺失原因：{mod['reason']}")
+                    lines.append(f"     分割详情：无（非分割文件）")
+                lines.append(f"     缺失原因：{mod['reason']}")
 
         # 2. 输出大小不匹配列表
         if inconsistent_mods['size_mismatch']:
-            print(f"\n--- 2. 文件大小不匹配（{len(inconsistent_mods['size_mismatch'])} 个） ---")
+            lines.append(f"\n--- 2. 文件大小不匹配（{len(inconsistent_mods['size_mismatch'])} 个） ---")
             for idx, mod in enumerate(inconsistent_mods['size_mismatch'], 1):
-                print(f"  {idx}. 文件名：{mod['file_name']}")
-                print(f"     本地路径：{mod['local_path']}")
-                print(f"     预期大小：{mod['expected_size_mb']} MB（{mod['expected_size_bytes']} 字节）")
-                print(f"     实际大小：{mod['actual_size_mb']} MB（{mod['actual_size_bytes']} 字节）")
+                lines.append(f"  {idx}. 文件名：{mod['file_name']}")
+                lines.append(f"     本地路径：{mod['local_path']}")
+                lines.append(f"     预期大小：{mod['expected_size_mb']} MB（{mod['expected_size_bytes']} 字节）")
+                lines.append(f"     实际大小：{mod['actual_size_mb']} MB（{mod['actual_size_bytes']} 字节）")
 
         # 3. 输出哈希不匹配列表
         if inconsistent_mods['hash_mismatch']:
-            print(f"\n--- 3. 文件哈希不匹配（内容异常，{len(inconsistent_mods['hash_mismatch'])} 个） ---")
+            lines.append(f"\n--- 3. 文件哈希不匹配（内容异常，{len(inconsistent_mods['hash_mismatch'])} 个） ---")
             for idx, mod in enumerate(inconsistent_mods['hash_mismatch'], 1):
-                print(f"  {idx}. 文件名：{mod['file_name']}")
-                print(f"     本地路径：{mod['local_path']}")
-                print(f"     预期哈希：{mod['expected_hash']}")
-                print(f"     实际哈希：{mod['actual_hash']}")
+                lines.append(f"  {idx}. 文件名：{mod['file_name']}")
+                lines.append(f"     本地路径：{mod['local_path']}")
+                lines.append(f"     预期哈希：{mod['expected_hash']}")
+                lines.append(f"     实际哈希：{mod['actual_hash']}")
 
         # 4. 输出异常文件列表
         if inconsistent_mods['error_files']:
-            print(f"\n--- 4. 文件读取/计算异常（{len(inconsistent_mods['error_files'])} 个） ---")
+            lines.append(f"\n--- 4. 文件读取/计算异常（{len(inconsistent_mods['error_files'])} 个） ---")
             for idx, mod in enumerate(inconsistent_mods['error_files'], 1):
-                print(f"  {idx}. 文件名：{mod['file_name']}")
-                print(f"     本地路径：{mod['local_path']}")
-                print(f"     异常原因：{mod['reason']}")
+                lines.append(f"  {idx}. 文件名：{mod['file_name']}")
+                lines.append(f"     本地路径：{mod['local_path']}")
+                lines.append(f"     异常原因：{mod['reason']}")
+
+        # 5. 输出版本升级列表
+        if inconsistent_mods.get('version_updates'):
+            lines.append(f"\n--- 5. 版本升级（{len(inconsistent_mods['version_updates'])} 个） ---")
+            for idx, mod in enumerate(inconsistent_mods['version_updates'], 1):
+                lines.append(f"  {idx}. modId：{mod['mod_id']}")
+                lines.append(f"     版本：{mod['from_version']} -> {mod['to_version']}")
+                lines.append(f"     新文件：{mod['file_name']}")
+                lines.append(f"     待删除旧文件：{mod['old_file_paths']}")
     else:
-        print(f"\n[恭喜] 所有配置内Mod校验通过，无不一致项！")
+        lines.append(f"\n[恭喜] 所有配置内Mod校验通过，无不一致项！")
+
+    # 输出重复modId
+    if inconsistent_mods.get('duplicate_mod_ids'):
+        lines.append(f"\n--- 本地重复modId（{len(inconsistent_mods['duplicate_mod_ids'])} 个） ---")
+        for idx, dup in enumerate(inconsistent_mods['duplicate_mod_ids'], 1):
+            lines.append(f"  {idx}. modId：{dup['mod_id']}")
+            for f in dup['files']:
+                lines.append(f"     - {f['file_name']}（版本：{f['mod_version']}）")
 
     # 输出本地多出文件
     if extra_local_files:
-        print(f"\n--- 5. 本地多出文件（配置未记录，{len(extra_local_files)} 个） ---")
+        lines.append(f"\n--- 6. 本地多出文件（配置未记录，{len(extra_local_files)} 个） ---")
         for idx, file in enumerate(extra_local_files, 1):
-            print(f"  {idx}. 文件名：{file['file_name']}")
-            print(f"     本地路径：{file['file_path']}")
-            print(f"     文件大小：{file['size_mb']} MB")
-            print(f"     文件哈希：{file['hash'] if file['hash'] else '无法计算'}")
+            lines.append(f"  {idx}. 文件名：{file['file_name']}")
+            lines.append(f"     本地路径：{file['file_path']}")
+            lines.append(f"     文件大小：{file['size_mb']} MB")
+            lines.append(f"     文件哈希：{file['hash'] if file['hash'] else '无法计算'}")
+            lines.append(f"     说明：{file['reason']}")
     else:
-        print(f"\n[信息] 本地无多出Mod，所有文件均在配置记录中")
+        lines.append(f"\n[信息] 本地无多出Mod，所有文件均在配置记录中")
+
+    lines.append(f"\n" + "="*80)
+    return "\n".join(lines)
+
 
-    print(f"\n" + "="*80)
+def print_validate_report(inconsistent_mods, extra_local_files):
+    """
+    格式化输出校验报告（ValidationResult可直接使用render_text）
+    :param inconsistent_mods: 不一致Mod信息字典
+    :param extra_local_files: 本地多出文件列表
+    """
+    print(format_validate_report(inconsistent_mods, extra_local_files))
 
 
 # ===================== 主函数 =====================
@@ -33,13 +33,45 @@ def get_mcmod_version(mod_path: str) -> dict:
                         if "modId" in mod and "version" in mod:
                             result["modId"] = mod["modId"]
                             result["version"] = mod["version"]
-                            result["displayName"] = mod["displayName"]
+                            result["displayName"] = mod.get("displayName", mod["modId"])
+                            break  # 多Mod的JAR以第一个Mod为准
+                # 版本号为占位符（如${file.jarVersion}）时，改读MANIFEST.MF中的实际版本
+                if str(result.get("version", "")).startswith("${"):
+                    result["version"] = _read_manifest_version(jar_file) or result["version"]
                 return result
 
     # 无匹配配置文件
     raise RuntimeError("未找到Mod版本配置文件（非标准Forge/Fabric/Quilt Mod）")
 
 
+def _read_manifest_version(jar_file):
+    """
+    从META-INF/MANIFEST.MF读取Implementation-Version
+    :param jar_file: 已打开的ZipFile对象
+    :return: 版本号字符串（不存在返回None）
+    """
+    if "META-INF/MANIFEST.MF" not in jar_file.namelist():
+        return None
+    with jar_file.open("META-INF/MANIFEST.MF") as f:
+        for line in f.read().decode("utf-8", errors="ignore").splitlines():
+            if line.startswith("Implementation-Version:"):
+                return line.split(":", 1)[1].strip()
+    return None
+
+
+def get_mod_id_version(mod_path):
+    """
+    读取Mod的modId和版本号（读取失败不抛异常，用于生成配置/校验时批量调用）
+    :param mod_path: Mod文件路径（.jar）
+    :return: (modId, 版本号)，无法识别时返回(None, None)
+    """
+    try:
+        mod_data = get_mcmod_version(mod_path)
+    except Exception:
+        return None, None
+    return mod_data.get("modId"), mod_data.get("version")
+
+
 # 示例调用
 if __name__ == "__main__":
     # 替换为你的Mod文件路径
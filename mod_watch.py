@@ -0,0 +1,230 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import threading
+
+from mod_trace import count
+from mod_version import get_mod_id_version
+from util import calculate_file_hash, is_split_part
+
+# inotify事件掩码（文件内容/属性变化、创建、删除、移动）
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+
+def _load_inotify():
+    """
+    加载libc中的inotify接口（仅Linux可用）
+    :return: libc对象（不可用返回None）
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class ModDirWatcher:
+    """
+    Mod目录监视器：在内存中维护目录内文件的名称/大小/修改时间/哈希
+    优先使用inotify接收变更通知，不可用时退化为定时轮询
+    只有大小或修改时间发生变化的文件才会重新计算哈希
+    """
+
+    def __init__(self, mod_dir, poll_interval=2.0, hash_algorithm="md5"):
+        """
+        :param mod_dir: 监视的Mod目录
+        :param poll_interval: 轮询间隔（秒，inotify模式下为检查停止标记的间隔）
+        :param hash_algorithm: 哈希算法（与配置文件保持一致，默认MD5）
+        """
+        self.mod_dir = mod_dir
+        self.poll_interval = poll_interval
+        self.hash_algorithm = hash_algorithm
+        self.mode = None  # "inotify" / "polling"，启动后确定
+        self.hash_hits = 0  # 复用缓存哈希的次数
+        self.hash_misses = 0  # 重新计算哈希的次数
+
+        self._entries = {}  # 文件路径 -> 文件信息（含size_bytes/mtime_ns/hash）
+        self._lock = threading.RLock()
+        self._dirty = True  # 目录自上次扫描后是否可能发生变化
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._inotify_fd = None
+        self._watched_dirs = set()
+
+    # ---------- 对外接口 ----------
+    def start(self):
+        """启动后台线程（首次扫描在后台执行，不阻塞调用方）"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._setup_inotify()
+        self._thread = threading.Thread(target=self._run, name="ModDirWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止后台线程并释放inotify句柄"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval + 1)
+            self._thread = None
+        if self._inotify_fd is not None:
+            os.close(self._inotify_fd)
+            self._inotify_fd = None
+            self._watched_dirs.clear()
+
+    def refresh(self):
+        """
+        同步目录状态：stat所有文件，只对大小/修改时间变化的文件重新计算哈希
+        :return: 本次重新计算哈希的文件数
+        """
+        with self._lock:
+            self._dirty = False
+            rehashed = 0
+            seen = set()
+            if os.path.isdir(self.mod_dir):
+                for root, dirs, files in os.walk(self.mod_dir):
+                    self._add_watch(root)
+                    for file in files:
+                        if is_split_part(file):
+                            continue
+                        file_path = os.path.join(root, file)
+                        try:
+                            st = os.stat(file_path)
+                        except OSError:
+                            continue
+                        seen.add(file_path)
+                        entry = self._entries.get(file_path)
+                        if entry and entry["size_bytes"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+                            self.hash_hits += 1
+                            continue
+                        self._entries[file_path] = self._build_entry(file, file_path, st)
+                        self.hash_misses += 1
+                        rehashed += 1
+            for file_path in list(self._entries):
+                if file_path not in seen:
+                    del self._entries[file_path]
+            return rehashed
+
+    def is_warm(self):
+        """
+        缓存是否可直接使用（inotify模式下首次扫描已完成且目录未变化，snapshot不会重新扫描）
+        :return: 可直接使用返回True
+        """
+        # 正在扫描时（持有锁）视为不可用，避免调用方等待完整扫描
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            return self.mode == "inotify" and not self._dirty and self.mod_dir in self._watched_dirs
+        finally:
+            self._lock.release()
+
+    def snapshot(self):
+        """
+        获取当前目录状态（格式与mod_validate.get_local_mod_file_map一致）
+        inotify模式下目录未变化时直接返回内存状态，不访问磁盘
+        :return: hash_to_files、name_to_files、all_local_files
+        """
+        with self._lock:
+            rehashed = 0
+            if self._dirty or self.mode != "inotify" or self.mod_dir not in self._watched_dirs:
+                rehashed = self.refresh()
+            # 命中率按每次取用统计（后台刷新不计入，inotify模式下未重新扫描时全部命中）
+            count("hash_cache_hits", len(self._entries) - rehashed)
+            count("hash_cache_misses", rehashed)
+            hash_to_files = {}
+            name_to_files = {}
+            all_local_files = []
+            for entry in self._entries.values():
+                file_info = dict(entry)
+                all_local_files.append(file_info)
+                if file_info["hash"]:
+                    hash_to_files.setdefault(file_info["hash"], []).append(file_info)
+                name_to_files.setdefault(file_info["file_name"], []).append(file_info)
+            return hash_to_files, name_to_files, all_local_files
+
+    # ---------- 内部实现 ----------
+    def _build_entry(self, file_name, file_path, st):
+        """计算单个文件的缓存信息（哈希，JAR额外读取modId）"""
+        entry = {
+            "file_name": file_name,
+            "file_path": file_path,
+            "hash": calculate_file_hash(file_path, self.hash_algorithm),
+            "size_bytes": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+        }
+        if file_name.lower().endswith(".jar"):
+            entry["mod_id"], entry["mod_version"] = get_mod_id_version(file_path)
+        return entry
+
+    def _setup_inotify(self):
+        """初始化inotify，失败则使用轮询模式"""
+        libc = _load_inotify()
+        if libc is not None:
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                self._libc = libc
+                self._inotify_fd = fd
+                if self._add_watch(self.mod_dir):
+                    self.mode = "inotify"
+                    return
+                os.close(fd)
+                self._inotify_fd = None
+        self.mode = "polling"
+
+    def _add_watch(self, dir_path):
+        """为目录添加inotify监视（已监视的目录跳过）"""
+        if self._inotify_fd is None:
+            return False
+        if dir_path in self._watched_dirs:
+            return True
+        wd = self._libc.inotify_add_watch(self._inotify_fd, os.fsencode(dir_path), WATCH_MASK)
+        if wd < 0:
+            return False
+        self._watched_dirs.add(dir_path)
+        return True
+
+    def _run(self):
+        """后台线程：首次扫描，之后等待变更通知或定时轮询"""
+        self.refresh()
+        while not self._stop_event.is_set():
+            if self.mode == "inotify":
+                try:
+                    readable, _, _ = select.select([self._inotify_fd], [], [], self.poll_interval)
+                except (OSError, ValueError, TypeError):
+                    break  # 句柄已关闭
+                if not readable:
+                    continue
+                self._dirty = True  # 先标记，保证去抖期间的snapshot不会返回旧状态
+                # 合并短时间内的连续事件（如大文件写入），再统一刷新
+                while readable:
+                    try:
+                        os.read(self._inotify_fd, 65536)
+                    except BlockingIOError:
+                        pass
+                    readable, _, _ = select.select([self._inotify_fd], [], [], 0.2)
+                with self._lock:
+                    # 监视目录本身被删除/移动后需重新建立监视
+                    self._watched_dirs = {d for d in self._watched_dirs if os.path.isdir(d)}
+                self.refresh()
+            else:
+                self._stop_event.wait(self.poll_interval)
+                if not self._stop_event.is_set():
+                    self.refresh()
@@ -3,6 +3,9 @@
 import hashlib
 import json
 import os
+import re
+
+from mod_trace import span, count
 
 def calculate_file_hash(file_path, hash_algorithm="md5"):
     """
@@ -17,16 +20,103 @@ def calculate_file_hash(file_path, hash_algorithm="md5"):
 
     try:
         hash_obj = hashlib.new(hash_algorithm)
-        with open(file_path, 'rb') as f:
+        with span("hash", file=os.path.basename(file_path)), open(file_path, 'rb') as f:
             # 4096字节/块读取，平衡效率和内存占用
             while chunk := f.read(4096):
                 hash_obj.update(chunk)
+            count("hash_bytes", f.tell())
         return hash_obj.hexdigest()
     except Exception as e:
         print(f"[错误] 计算 {file_path} 哈希失败：{str(e)}")
         return None
 
 
+# 快速指纹：末尾读取的字节数（包含ZIP的目录结束记录）
+QUICK_TAIL_SIZE = 64 * 1024
+# 快速指纹：中央目录超过该大小时只取末尾部分
+QUICK_CENTRAL_DIR_LIMIT = 1024 * 1024
+# 快速指纹：均匀抽样的块数和每块字节数
+QUICK_SAMPLE_COUNT = 4
+QUICK_SAMPLE_SIZE = 4096
+
+
+def locate_central_directory(tail, size):
+    """
+    在ZIP文件末尾的数据中查找目录结束记录（EOCD），取出中央目录的位置
+    :param tail: 文件末尾的数据
+    :param size: 文件总字节数
+    :return: (中央目录起始位置, 中央目录字节数)；不是ZIP或记录无效返回None
+    """
+    # 签名PK\x05\x06，偏移12为中央目录大小，偏移16为中央目录起始位置
+    eocd = tail.rfind(b"PK\x05\x06")
+    if eocd < 0 or eocd + 22 > len(tail):
+        return None
+    cd_size = int.from_bytes(tail[eocd + 12:eocd + 16], "little")
+    cd_offset = int.from_bytes(tail[eocd + 16:eocd + 20], "little")
+    if not cd_size or cd_offset + cd_size > size:
+        return None
+    return cd_offset, cd_size
+
+
+def calculate_quick_fingerprint(file_path):
+    """
+    计算文件的快速指纹：文件大小 + ZIP中央目录（含每个条目的CRC32）+ 若干均匀抽样块
+    只读取文件末尾和几个固定位置（每个Mod几十KB），用于日常启动时代替完整哈希；
+    非ZIP文件或中央目录无法解析时使用文件末尾代替中央目录
+    :param file_path: 文件路径
+    :return: 指纹字符串（失败返回None）
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            hash_obj = hashlib.md5(str(size).encode())
+            if size <= QUICK_TAIL_SIZE + QUICK_SAMPLE_COUNT * QUICK_SAMPLE_SIZE:
+                # 小文件直接读取全部内容
+                hash_obj.update(f.read())
+                count("quick_bytes", size)
+                return hash_obj.hexdigest()
+
+            tail_start = size - QUICK_TAIL_SIZE
+            f.seek(tail_start)
+            tail = f.read()
+            read_bytes = len(tail)
+            region = tail
+            central_dir = locate_central_directory(tail, size)
+            if central_dir:
+                cd_offset, cd_size = central_dir
+                cd_end = cd_offset + min(cd_size, QUICK_CENTRAL_DIR_LIMIT)
+                if cd_offset >= tail_start:
+                    region = tail[cd_offset - tail_start:cd_end - tail_start]
+                else:
+                    f.seek(cd_offset)
+                    region = f.read(cd_end - cd_offset)
+                    read_bytes += len(region)
+            hash_obj.update(region)
+
+            for i in range(1, QUICK_SAMPLE_COUNT + 1):
+                f.seek(size * i // (QUICK_SAMPLE_COUNT + 1))
+                block = f.read(QUICK_SAMPLE_SIZE)
+                hash_obj.update(block)
+                read_bytes += len(block)
+            count("quick_bytes", read_bytes)
+        return hash_obj.hexdigest()
+    except Exception as e:
+        print(f"[错误] 计算 {file_path} 快速指纹失败：{str(e)}")
+        return None
+
+
+# 分割脚本生成的分包文件名（如xxx.jar.part01）
+SPLIT_PART_PATTERN = re.compile(r"\.part\d+$")
+
+
+def is_split_part(file_name):
+    """
+    是否为分包文件（mod_split在原文件旁生成的分包，不是Mod本身，扫描Mod目录时跳过）
+    :param file_name: 文件名
+    """
+    return SPLIT_PART_PATTERN.search(file_name) is not None
+
+
 def get_file_size_bytes(file_path):
     """
     获取文件精准字节数（核心校验用）
@@ -53,3 +143,29 @@ def get_json_from_file(file_path):
         print(f"[错误] 读取 {file_path} 失败：{str(e)}")
         return None
 
+
+
+def parse_range_header(range_header, file_size):
+    """
+    解析HTTP Range请求头（仅支持单个区间）
+    :param range_header: Range头的值，如"bytes=0-1023"、"bytes=1024-"、"bytes=-512"
+    :param file_size: 文件总字节数
+    :return: (起始, 结束)闭区间；格式无法识别返回None；区间不可满足返回(-1, -1)
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_text, _, end_text = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text == "":
+            # 后缀区间：最后N个字节
+            length = int(end_text)
+            if length <= 0:
+                return -1, -1
+            return max(0, file_size - length), file_size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else file_size - 1
+    except ValueError:
+        return None
+    if start >= file_size or end < start:
+        return -1, -1
+    return start, min(end, file_size - 1)